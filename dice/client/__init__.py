@@ -15,9 +15,23 @@ import traceback
 import threading
 import time
 
+from ..core import coverage
 from ..core import provider
+from ..core import selector
+from ..utils import affinity
+from ..utils import forkserver
+from ..utils import persistent
+from ..utils import pyexec
+from ..utils import rlimits
 from ..utils import rnd
 
+from . import categories
+from . import concurrency
+from . import minimize
+from . import prefetch
+from . import resources
+from . import schedule
+from . import timeouts
 from . import window
 
 logger = logging.getLogger('dice')
@@ -52,6 +66,7 @@ class _TestStat(object):
         self.queue_max = queue_max
         self.method = method
         self.queue = collections.deque([], queue_max)
+        self.resources = resources.ResourceSummary()
 
     def match(self, text):
         if self.method == 'exact':
@@ -59,13 +74,15 @@ class _TestStat(object):
         elif self.method == 'regex':
             return re.match(self.key + '$', text)
 
-    def append(self, result):
+    def append(self, item):
         self.counter += 1
-        self.queue.append(result)
+        self.queue.append(item)
+        if getattr(item.res, 'rusage', None):
+            self.resources.add(item.res.rusage)
 
     def extend(self, stat):
-        for result in stat.queue:
-            self.append(result)
+        for item in stat.queue:
+            self.append(item)
 
 
 class DiceApp(object):
@@ -115,6 +132,255 @@ class DiceApp(object):
             dest='ui',
             default=True,
         )
+        self.parser.add_argument(
+            '--prefetch',
+            action='store',
+            type=int,
+            help='number of items generated ahead of execution. 0 to '
+            'generate each item right before it runs.',
+            dest='prefetch',
+            default=16,
+        )
+        self.parser.add_argument(
+            '--forkserver',
+            action='store_true',
+            help='spawn commands of items from a pre-spawned fork server '
+            'instead of forking DICE itself',
+            dest='forkserver',
+            default=False,
+        )
+        self.parser.add_argument(
+            '--py-workers',
+            action='store',
+            type=int,
+            help='number of worker processes calling Python functions of '
+            'Python items. Default to the number of CPUs.',
+            dest='py_workers',
+            default=None,
+        )
+        self.parser.add_argument(
+            '--py-max-tasks',
+            action='store',
+            type=int,
+            help='number of Python items a worker process runs before being '
+            'replaced',
+            dest='py_max_tasks',
+            default=1000,
+        )
+        self.parser.add_argument(
+            '--adaptive-timeout',
+            action='store_true',
+            help='derive timeouts of items from the call times observed for '
+            'their provider instead of a fixed timeout',
+            dest='adaptive_timeout',
+            default=False,
+        )
+        self.parser.add_argument(
+            '--timeout-per-trace',
+            action='store_true',
+            help='also observe call times for each combination of '
+            'constraint traces chosen for the items',
+            dest='timeout_per_trace',
+            default=False,
+        )
+        self.parser.add_argument(
+            '--timeout-percentile',
+            action='store',
+            type=float,
+            help='percentile of call times adaptive timeouts derive from',
+            dest='timeout_percentile',
+            default=99.9,
+        )
+        self.parser.add_argument(
+            '--timeout-multiplier',
+            action='store',
+            type=float,
+            help='factor applied to the percentile of call times',
+            dest='timeout_multiplier',
+            default=3.0,
+        )
+        self.parser.add_argument(
+            '--timeout-floor',
+            action='store',
+            type=float,
+            help='minimum adaptive timeout in seconds',
+            dest='timeout_floor',
+            default=0.1,
+        )
+        self.parser.add_argument(
+            '--timeout-ceiling',
+            action='store',
+            type=float,
+            help='maximum adaptive timeout in seconds, also used until '
+            'enough call times are observed',
+            dest='timeout_ceiling',
+            default=10.0,
+        )
+        self.parser.add_argument(
+            '--stall-window',
+            action='store',
+            type=float,
+            help='kill commands of items as stalled once their processes '
+            'have all been sleeping without using any CPU for this many '
+            'seconds',
+            dest='stall_window',
+            default=None,
+        )
+        self.parser.add_argument(
+            '--resource-outliers',
+            action='store',
+            type=float,
+            help='put successful and expected failing items using more CPU '
+            'time, memory or block I/O than this many standard deviations '
+            'above the mean of their provider in the resource_outlier '
+            'category',
+            dest='resource_outliers',
+            default=None,
+        )
+        self.parser.add_argument(
+            '--limit-as',
+            action='store',
+            type=int,
+            help='maximum address space of item processes in megabytes',
+            dest='limit_as',
+            default=None,
+        )
+        self.parser.add_argument(
+            '--limit-cpu',
+            action='store',
+            type=int,
+            help='maximum CPU time of item processes in seconds',
+            dest='limit_cpu',
+            default=None,
+        )
+        self.parser.add_argument(
+            '--limit-nproc',
+            action='store',
+            type=int,
+            help='maximum number of processes of the user in item processes',
+            dest='limit_nproc',
+            default=None,
+        )
+        self.parser.add_argument(
+            '--limit-fsize',
+            action='store',
+            type=int,
+            help='maximum size of files written by item processes in '
+            'megabytes',
+            dest='limit_fsize',
+            default=None,
+        )
+        self.parser.add_argument(
+            '--limit-core',
+            action='store',
+            type=int,
+            help='maximum size of core dumps of item processes in megabytes. '
+            '0 to disable core dumps.',
+            dest='limit_core',
+            default=None,
+        )
+        self.parser.add_argument(
+            '--pin',
+            action='store_true',
+            help='pin the test loop and the commands it spawns to dedicated '
+            'CPUs, leaving one core to the UI and other threads',
+            dest='pin',
+            default=False,
+        )
+        self.parser.add_argument(
+            '--pin-avoid-smt',
+            action='store_true',
+            help='with --pin, use only one CPU of each physical core for '
+            'running items',
+            dest='pin_avoid_smt',
+            default=False,
+        )
+        self.parser.add_argument(
+            '--jobs',
+            action='store',
+            type=int,
+            help='number of items run concurrently, or initial number with '
+            '--adaptive-jobs',
+            dest='jobs',
+            default=1,
+        )
+        self.parser.add_argument(
+            '--adaptive-jobs',
+            action='store_true',
+            help='grow or shrink the number of items run concurrently to '
+            'maximize throughput under a CPU utilization ceiling',
+            dest='adaptive_jobs',
+            default=False,
+        )
+        self.parser.add_argument(
+            '--max-jobs',
+            action='store',
+            type=int,
+            help='maximum number of items run concurrently with '
+            '--adaptive-jobs. Default to 4 times the number of CPUs.',
+            dest='max_jobs',
+            default=None,
+        )
+        self.parser.add_argument(
+            '--cpu-ceiling',
+            action='store',
+            type=float,
+            help='maximum fraction of the CPUs used with --adaptive-jobs',
+            dest='cpu_ceiling',
+            default=0.9,
+        )
+        self.parser.add_argument(
+            '--schedule',
+            action='store',
+            choices=schedule.ProviderScheduler.modes,
+            help='how providers share the campaign: equal item shares, '
+            'equal time shares, or time shares favoring providers finding '
+            'new results',
+            dest='schedule',
+            default='items',
+        )
+        self.parser.add_argument(
+            '--weights',
+            action='store',
+            help='comma separated weights of providers as name=weight. '
+            'Default to 1.',
+            dest='weights',
+            default=None,
+        )
+        self.parser.add_argument(
+            '--trace-selector',
+            action='store',
+            choices=sorted(selector.SELECTORS),
+            help='how constraints choose their traces: uniformly, or '
+            'favoring traces whose items got new or unexpected results',
+            dest='trace_selector',
+            default='uniform',
+        )
+        self.parser.add_argument(
+            '--coverage-file',
+            action='store',
+            help="file to save trace coverage to on exit, to be reported "
+            "with 'dice coverage'",
+            dest='coverage_file',
+            default=None,
+        )
+        self.parser.add_argument(
+            '--mutation-ratio',
+            action='store',
+            type=float,
+            help='ratio of items made by mutating interesting items which '
+            'already run, instead of generating them from scratch',
+            dest='mutation_ratio',
+            default=0.0,
+        )
+        self.parser.add_argument(
+            '--mutation-sources',
+            action='store',
+            help="result categories separated by ',' whose items are "
+            "mutated",
+            dest='mutation_sources',
+            default='unexpected_neg,unexpected_pass,failure',
+        )
 
         self.args, _ = self.parser.parse_known_args()
 
@@ -123,20 +389,37 @@ class DiceApp(object):
         except provider.ProviderError as detail:
             exit(detail)
 
-        self.stats = {
-            "skip": {},
-            "failure": {},
-            "success": {},
-            "timeout": {},
-            "expected_neg": {},
-            "unexpected_neg": {},
-            "unexpected_pass": {},
-        }
+        for prvdr in self.providers.values():
+            prvdr.constraint_manager.set_selector(self.args.trace_selector)
+
+        try:
+            self.scheduler = schedule.ProviderScheduler(
+                list(self.providers.values()),
+                mode=self.args.schedule,
+                weights=schedule.ProviderScheduler.parse_weights(
+                    self.args.weights),
+            )
+        except schedule.ScheduleError as detail:
+            exit(detail)
+
+        self.stats = collections.OrderedDict(
+            (name, {}) for name in categories.CATEGORIES)
+        self.mutation_sources = set(
+            self.args.mutation_sources.split(',')
+            if self.args.mutation_sources else ())
+        for name in self.mutation_sources:
+            if name not in self.stats:
+                sys.exit("Error: unknown result category '%s'" % name)
+        # Statistics of mutation sources with items of each provider, keyed
+        # by provider names then by category and statistics key
+        self.corpus = {}
+        self.mutated = 0
         self.QUEUE_MAX = 100
         self.exiting = False
         self.pause = False
         self.setting_watch = False
         self.show_log = False
+        self.show_coverage = False
         self.watching = ''
         self.scroll_x = 0
         self.scroll_y = 0
@@ -146,6 +429,39 @@ class DiceApp(object):
         self.last_send_thread = None
         self.last_item = None
         self.cur_counter = 'failure'
+        self.prefetcher = None
+        self.outliers = None
+        if self.args.resource_outliers is not None:
+            self.outliers = resources.OutlierDetector(
+                threshold=self.args.resource_outliers)
+        self.limits = self._limits()
+        self.stat_lock = threading.Lock()
+        self.generate_lock = threading.Lock()
+        self.controller = concurrency.ConcurrencyController(
+            jobs=self.args.jobs,
+            max_jobs=self.args.max_jobs,
+            cpu_ceiling=self.args.cpu_ceiling,
+            adaptive=self.args.adaptive_jobs,
+        )
+        self.reserved_cpus = None
+        self.worker_cpus = []
+        if self.args.pin:
+            if not affinity.supported():
+                sys.exit('Error: --pin not supported on this system')
+            workers = self.controller.jobs
+            if self.controller.adaptive:
+                workers = self.controller.max_jobs
+            self.reserved_cpus, self.worker_cpus = affinity.plan(
+                workers, avoid_smt=self.args.pin_avoid_smt)
+        self.timeouts = None
+        if self.args.adaptive_timeout:
+            self.timeouts = timeouts.TimeoutEstimator(
+                percentile=self.args.timeout_percentile,
+                multiplier=self.args.timeout_multiplier,
+                floor=self.args.timeout_floor,
+                ceiling=self.args.timeout_ceiling,
+                per_trace=self.args.timeout_per_trace,
+            )
 
         if self.args.ui:
             self.window = window.Window(self)
@@ -153,10 +469,14 @@ class DiceApp(object):
             self.window.stat_panel.add_keypress_listener(
                 'merge_stat', 'm', self._merge_stat)
             self.window.items_panel.set_select_callback(self._update_content)
+            self.window.items_panel.add_keypress_listener(
+                'minimize_item', 'r', self._minimize_item)
 
         self.stream = io.StringIO()
         self.cur_class = (None, None)
         self.cur_item = (None, None)
+        self.minimizer = None
+        self.minimize_thread = None
 
     def _update_items(self, cat_name, item_idx):
         self.cur_class = (cat_name, item_idx)
@@ -182,43 +502,61 @@ class DiceApp(object):
 
         self.pause = False
 
+    def _minimize_item(self, panel):
+        """
+        Minimize the item selected in the items panel in the background and
+        save it.
+        """
+        if self.minimize_thread is not None and \
+                self.minimize_thread.is_alive():
+            logger.info('An item is being minimized already')
+            return
+        cat_name, stat_idx = self.cur_class
+        _, item_idx = self.cur_item
+        if cat_name is None or stat_idx is None or item_idx is None:
+            return
+        with self.stat_lock:
+            stat = list(self.stats[cat_name].values())[stat_idx]
+            item = stat.queue[item_idx]
+        # Keys of merged statistics are regexes the results must match
+        match = stat.match if stat.method == 'regex' else None
+        self.minimizer = minimize.Minimizer(item, jobs=self.controller.jobs,
+                                            match=match)
+        self.minimize_thread = threading.Thread(
+            target=self._run_minimizer, args=(self.minimizer,),
+            name='dice-minimize')
+        self.minimize_thread.daemon = True
+        self.minimize_thread.start()
+
+    def _run_minimizer(self, minimizer):
+        try:
+            result = minimizer.minimize()
+        # pylint: disable=broad-except
+        except Exception:
+            logger.exception('Failed to minimize item')
+            return
+        result.save('minimized_item.txt')
+        logger.info('Minimized item saved to minimized_item.txt')
+
     def _stat_result(self, item):
         """
         Categorizes and keep the count of a result of a test item depends on
         the expected failure patterns.
         """
         res = item.res
-        fail_patts = item.fail_patts
-
-        key = res.stderr
-        catalog = None
-        if res:
-            if res.exit_status == 'timeout':
-                catalog = 'timeout'
-
-            if self.watching and self.watching in res.stderr:
-                self.pause = True
-
-            if fail_patts:
-                if res.exit_status == 'success':
-                    catalog = 'unexpected_pass'
-                elif res.exit_status == 'failure':
-                    found = False
-                    for patt in fail_patts:
-                        if re.search(patt, res.stderr):
-                            catalog = 'expected_neg'
-                            key = patt
-                            found = True
-                            break
-                    if not found:
-                        catalog = 'unexpected_neg'
-            else:
-                if res.exit_status == 'success':
-                    catalog = 'success'
-                elif res.exit_status == 'failure':
-                    catalog = 'failure'
-        else:
-            catalog = 'skip'
+        catalog, key = categories.categorize(item)
+        if res and self.watching and self.watching in res.stderr:
+            self.pause = True
+
+        if self.outliers is not None and res and res.rusage and \
+                catalog not in ('timeout', 'stalled') and \
+                catalog not in rlimits.STATUSES:
+            names = self.outliers.check(item.provider.name, res.rusage)
+            # Oracle violations stay in their categories whatever resources
+            # they use
+            if names and catalog in categories.OUTLIER_SOURCES:
+                catalog = 'resource_outlier'
+                key = ', '.join(names)
 
         found = False
         for stat in self.stats[catalog].values():
@@ -229,9 +567,29 @@ class DiceApp(object):
 
         if not found:
             self.stats[catalog][key] = _TestStat(key)
+        self.scheduler.record(item, new_key=not found)
+        novel = not found or catalog in ('unexpected_pass', 'unexpected_neg')
+        item.provider.constraint_manager.reward(item, 1.0 if novel else 0.0)
+        item.provider.constraint_manager.record_outcome(item, catalog)
 
         stat = self.stats[catalog][key]
-        stat.append(res)
+        stat.append(item)
+        if catalog in self.mutation_sources:
+            self.corpus.setdefault(item.provider.name, {})[
+                (catalog, key)] = stat
+
+    def _limits(self):
+        """
+        Resource limits of items from command line options.
+        """
+        megabyte = 1024 * 1024
+        limits = {}
+        for name, scale in (('as', megabyte), ('cpu', 1), ('nproc', 1),
+                            ('fsize', megabyte), ('core', megabyte)):
+            value = getattr(self.args, 'limit_' + name)
+            if value is not None:
+                limits[name] = value * scale
+        return limits
 
     def _process_providers(self):
         """
@@ -279,29 +637,191 @@ class DiceApp(object):
         except requests.ConnectionError as detail:
             logger.debug('Failed to send result to server: %s', detail)
 
+    def _pick_parent(self, prvdr):
+        """
+        Pick an item of a provider to mutate, choosing the statistics key
+        first so rare keys get as many variants as frequent ones.
+
+        :return: The item or None if there is none yet.
+        """
+        with self.stat_lock:
+            stats = list(self.corpus.get(prvdr.name, {}).values())
+            if not stats:
+                return None
+            stat = random.choice(stats)
+            items = [item for item in stat.queue if item.provider is prvdr]
+        if not items:
+            return None
+        return random.choice(items)
+
+    def _generate(self):
+        """
+        Generate a test item from the provider chosen by the scheduler,
+        mutating an interesting item of the provider at the mutation ratio.
+        """
+        prvdr = self.scheduler.choose()
+        if self.args.mutation_ratio and \
+                random.random() < self.args.mutation_ratio:
+            parent = self._pick_parent(prvdr)
+            if parent is not None:
+                self.mutated += 1
+                return prvdr.mutate(parent)
+        return prvdr.generate()
+
+    def _next_item(self):
+        """
+        Get the next item to run, from the prefetch queue if enabled.
+
+        :return: The item or None if no item is ready yet.
+        """
+        if self.prefetcher is None:
+            # Providers are not thread-safe
+            with self.generate_lock:
+                return self._generate()
+        return self.prefetcher.get()
+
+    def metrics(self):
+        """
+        Collect runtime metrics of the test loop.
+
+        :return: An ordered dictionary of metric names and values.
+        """
+        metrics = collections.OrderedDict()
+        if self.prefetcher is not None:
+            metrics.update(self.prefetcher.metrics())
+        if self.timeouts is not None:
+            metrics.update(self.timeouts.metrics())
+        metrics.update(self.controller.metrics())
+        metrics.update(self.scheduler.metrics())
+        if self.args.mutation_ratio:
+            metrics['mutated_items'] = self.mutated
+        if self.minimizer is not None:
+            metrics.update(self.minimizer.metrics())
+        return metrics
+
+    def coverages(self):
+        """
+        Serialize the trace coverage of all providers.
+
+        :return: A dictionary of serialized coverages keyed by provider
+                 names.
+        """
+        return dict((name, prvdr.constraint_manager.coverage.serialize())
+                    for name, prvdr in self.providers.items())
+
+    def save_coverage(self, path):
+        """
+        Save the trace coverage of all providers to a JSON file.
+        """
+        with open(path, 'w') as fp:
+            json.dump(self.coverages(), fp, indent=4, sort_keys=True)
+
+    def _metrics_text(self):
+        """
+        Format runtime metrics as lines of text.
+        """
+        return '\n'.join('%s: %s' % (name, value)
+                         for name, value in self.metrics().items())
+
     def run_tests(self):
         """
         Iteratively run tests.
         """
-        while not self.exiting:
-            item = random.choice(self.providers.values()).generate()
+        if self.args.prefetch > 0:
+            self.prefetcher = prefetch.Prefetcher(
+                self._generate, size=self.args.prefetch)
+            self.prefetcher.start()
+        self.controller.start()
+        try:
+            if self.controller.adaptive or self.controller.jobs > 1:
+                self._supervise()
+            else:
+                # Pinned after starting the prefetcher, which stays on the
+                # reserved CPUs
+                self._pin_worker(0)
+                self._run_tests()
+        finally:
+            if self.prefetcher is not None:
+                self.prefetcher.stop()
+
+    def _pin_worker(self, idx):
+        if self.worker_cpus:
+            affinity.pin(self.worker_cpus[idx % len(self.worker_cpus)])
+
+    def _supervise(self):
+        """
+        Start and retire worker threads running items as the concurrency
+        controller decides.
+        """
+        workers = {}
+        excs = queue.Queue()
+        try:
+            while not self.exiting:
+                for idx in range(self.controller.update()):
+                    worker = workers.get(idx)
+                    if worker is None or not worker.is_alive():
+                        worker = threading.Thread(
+                            target=self._run_worker,
+                            args=(idx, excs),
+                            name='dice-worker-%d' % idx,
+                        )
+                        worker.daemon = True
+                        workers[idx] = worker
+                        worker.start()
+                try:
+                    exc = excs.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                raise exc[1].with_traceback(exc[2])
+        finally:
+            self.exiting = True
+            for worker in workers.values():
+                worker.join()
+
+    def _run_worker(self, idx, excs):
+        self._pin_worker(idx)
+        try:
+            self._run_tests(idx)
+        # pylint: disable=broad-except
+        except Exception:
+            excs.put(sys.exc_info())
+        finally:
+            # Retired workers don't keep their targets running
+            persistent.stop_thread()
+
+    def _run_tests(self, idx=0):
+        # Workers above the current number of jobs retire
+        while not self.exiting and idx < self.controller.jobs:
+            item = self._next_item()
+            if item is None:
+                continue
+            if self.timeouts is not None:
+                item.timeout = self.timeouts.timeout_for(item)
+            if self.args.stall_window:
+                item.stall_window = self.args.stall_window
+            if self.limits:
+                item.limits = self.limits
             item.run()
+            if self.timeouts is not None:
+                self.timeouts.observe(item)
+            self.controller.record(item.res)
             self.last_item = item
 
-            if self.args.server is not None:
-                self.send_queue.append(item)
-                if len(self.send_queue) > 200:
-                    if self.last_send_thread:
-                        self.last_send_thread.join()
-                    send_thread = threading.Thread(
-                        target=self._send,
-                        args=(self.send_queue,)
-                    )
-                    send_thread.start()
-                    self.last_send_thread = send_thread
-                    self.send_queue = []
-
-            self._stat_result(item)
+            with self.stat_lock:
+                if self.args.server is not None:
+                    self.send_queue.append(item)
+                    if len(self.send_queue) > 200:
+                        if self.last_send_thread:
+                            self.last_send_thread.join()
+                        send_thread = threading.Thread(
+                            target=self._send,
+                            args=(self.send_queue,)
+                        )
+                        send_thread.start()
+                        self.last_send_thread = send_thread
+                        self.send_queue = []
+
+                self._stat_result(item)
             if self.pause:
                 while self.pause and not self.exiting:
                     time.sleep(0.5)
@@ -326,7 +846,7 @@ class DiceApp(object):
             item_name, stat = self.stats[cat_name].items()[item_idx]
             try:
                 for item in self.stats[cat_name][item_name].queue:
-                    bundle = {'item': item.cmdline}
+                    bundle = {'item': getattr(item.res, 'cmdline', '')}
                     panel.add_item(bundle)
             except RuntimeError:
                 pass
@@ -335,14 +855,20 @@ class DiceApp(object):
         panel = self.window.detail_panel
         panel.clear()
         cat_name, item_idx = self.cur_class
-        if cat_name is not None and item_idx is not None:
+        if self.show_coverage:
+            panel.set_content(coverage.report(self.coverages()))
+        elif cat_name is not None and item_idx is not None:
             item_name, stat = self.stats[cat_name].items()[item_idx]
             items = self.stats[cat_name][item_name].queue
 
             item_name, item_idx = self.cur_item
             if item_name is not None and item_idx is not None:
-                bundle = items[self.cur_item[1]]
+                bundle = items[self.cur_item[1]].res
                 panel.set_content(bundle)
+            else:
+                panel.set_content(stat.resources)
+        else:
+            panel.set_content(self._metrics_text())
 
         self.window.update()
 
@@ -359,31 +885,53 @@ class DiceApp(object):
 
         os.environ["EDITOR"] = "echo"
 
-        self.last_item = None
-        if self.args.ui:
-            try:
-                self.test_thread.start()
-                while True:
-                    if self.args.ui:
-                        self.update_window()
+        if self.reserved_cpus is not None:
+            affinity.pin(self.reserved_cpus)
+        try:
+            if self.args.forkserver:
+                forkserver.start()
+            pyexec.start(size=self.args.py_workers,
+                         max_tasks=self.args.py_max_tasks)
 
-                    if self.exiting:
-                        break
+            self.last_item = None
+            if self.args.ui:
+                try:
+                    self.test_thread.start()
+                    while True:
+                        if self.args.ui:
+                            self.update_window()
 
-                    if not self.test_thread.isAlive():
-                        break
-            except KeyboardInterrupt:
-                pass
-            finally:
-                if self.args.ui:
-                    self.window.destroy()
-                self.exiting = True
-                self.test_thread.join()
+                        if self.exiting:
+                            break
+
+                        if not self.test_thread.isAlive():
+                            break
+                except KeyboardInterrupt:
+                    pass
+                finally:
+                    if self.args.ui:
+                        self.window.destroy()
+                    self.exiting = True
+                    self.test_thread.join()
+                    try:
+                        exc = self.test_excs.get(block=False)
+                        for line in traceback.format_exception(*exc):
+                            print(line, end='')
+                    except queue.Empty:
+                        pass
+                    print(self._metrics_text())
+            else:
                 try:
-                    exc = self.test_excs.get(block=False)
-                    for line in traceback.format_exception(*exc):
-                        print(line, end='')
-                except queue.Empty:
+                    self.run_tests()
+                except KeyboardInterrupt:
                     pass
-        else:
-            self.run_tests()
+                finally:
+                    print(self._metrics_text())
+
+            if self.args.coverage_file:
+                self.save_coverage(self.args.coverage_file)
+        finally:
+            # Also stop on errors, so no target or worker process is left
+            persistent.stop_all()
+            pyexec.stop()
+            forkserver.stop()
@@ -0,0 +1,100 @@
+import re
+
+from ..utils import rlimits
+
+
+# Result categories of items, in the order statistics are shown.
+CATEGORIES = (
+    'skip',
+    'failure',
+    'success',
+    'timeout',
+    'stalled',
+    'resource_outlier',
+    'oom',
+    'cpu_limit',
+    'fsize_limit',
+    'nproc_limit',
+    'expected_neg',
+    'unexpected_neg',
+    'unexpected_pass',
+)
+
+# Categories of items expected by the oracles, which are reported as
+# resource outliers when they use unusual resources.
+OUTLIER_SOURCES = ('success', 'expected_neg')
+
+
+# Parts of error messages varying between runs of the same error, like
+# addresses, numbers and quoted inputs
+_VARYING = [
+    (re.compile(r"'[^']*'"), "'?'"),
+    (re.compile(r'"[^"]*"'), '"?"'),
+    (re.compile(r'\b0x[0-9a-fA-F]+|\d+'), '?'),
+]
+
+
+def signature(key):
+    """
+    Get the part of a statistics key identifying an error, which is its
+    first non-empty line with addresses, numbers and quoted texts masked.
+
+    :param key: Statistics key from categorize().
+    :return: Signature string.
+    """
+    for line in key.splitlines():
+        line = line.strip()
+        if line:
+            break
+    else:
+        return ''
+    for regex, repl in _VARYING:
+        line = regex.sub(repl, line)
+    return line
+
+
+def categorize(item):
+    """
+    Categorize the result of an item which has run depending on its expected
+    failure patterns.
+
+    Resource outliers depend on the results of other items and are not
+    detected here.
+
+    :param item: The item.
+    :return: A tuple of the category and the statistics key, which is the
+             matching failure pattern for expected failures and the
+             standard error otherwise.
+    """
+    res = item.res
+    if not res:
+        return 'skip', ''
+
+    key = res.stderr
+    catalog = None
+    if res.exit_status == 'timeout':
+        catalog = 'timeout'
+    elif res.exit_status == 'stalled':
+        catalog = 'stalled'
+    elif res.exit_status in rlimits.STATUSES:
+        catalog = res.exit_status
+
+    if item.fail_patts:
+        if res.exit_status == 'success':
+            catalog = 'unexpected_pass'
+        elif res.exit_status == 'failure' or catalog in rlimits.STATUSES:
+            if res.exit_status == 'failure':
+                catalog = 'unexpected_neg'
+            # An error expected by the oracle stays expected even if a
+            # resource limit seems to be hit
+            for patt in item.fail_patts:
+                if re.search(patt, res.stderr):
+                    catalog = 'expected_neg'
+                    key = patt
+                    break
+    else:
+        if res.exit_status == 'success':
+            catalog = 'success'
+        elif res.exit_status == 'failure':
+            catalog = 'failure'
+    return catalog, key
@@ -0,0 +1,233 @@
+import collections
+import multiprocessing
+import os
+import threading
+import time
+
+
+def _cpu_set():
+    if hasattr(os, 'sched_getaffinity'):
+        return set(os.sched_getaffinity(0))
+    return set(range(multiprocessing.cpu_count()))
+
+
+def _cpu_times(cpus, path='/proc/stat'):
+    """
+    Read the busy and total times of CPUs.
+
+    :param cpus: Set of the CPU numbers to sum.
+    :param path: Path of the kernel CPU statistics.
+    :return: A tuple of busy time, total time and number of CPUs summed, or
+             None if the statistics are unavailable.
+    """
+    try:
+        with open(path) as fp:
+            lines = fp.readlines()
+    except (IOError, OSError):
+        return None
+    busy = total = count = 0
+    for line in lines:
+        fields = line.split()
+        if not fields or not fields[0].startswith('cpu') or \
+                fields[0] == 'cpu' or int(fields[0][3:]) not in cpus:
+            continue
+        # user nice system idle iowait irq softirq steal, guest times are
+        # part of user and nice already
+        values = [int(value) for value in fields[1:9]]
+        idle = sum(values[3:5])
+        busy += sum(values) - idle
+        total += sum(values)
+        count += 1
+    if not count:
+        return None
+    return busy, total, count
+
+
+class CpuLoad(object):
+    """
+    Number of busy CPUs between two samples, read from the CPU times of the
+    kernel. Unlike the load average, which lags by about a minute, it
+    follows the changes of concurrency from one interval to the next.
+    """
+    def __init__(self, cpus, path='/proc/stat'):
+        """
+        :param cpus: Set of the CPU numbers to watch.
+        :param path: Path of the kernel CPU statistics.
+        """
+        self.cpus = cpus
+        self.path = path
+        self.last = _cpu_times(cpus, path)
+
+    def sample(self):
+        """
+        Get the number of busy CPUs since the last sample. Fall back to the
+        1-minute load average without CPU times.
+        """
+        last, self.last = self.last, _cpu_times(self.cpus, self.path)
+        if last is None or self.last is None:
+            try:
+                return os.getloadavg()[0]
+            except (AttributeError, OSError):
+                return 0.0
+        busy = self.last[0] - last[0]
+        total = self.last[1] - last[1]
+        if total <= 0:
+            return 0.0
+        return float(busy) / total * self.last[2]
+
+
+def _load(sampler):
+    return sampler.sample()
+
+
+class ConcurrencyController(object):
+    """
+    Size the number of items running concurrently to maximize throughput
+    under a CPU utilization ceiling.
+
+    Every interval, the controller compares the items per second with those
+    of the previous interval and estimates the CPU utilization of running
+    one more item from the ratio of CPU time to wall time of the items, as
+    recorded in their rusage, and from the busy CPUs of the host. It keeps
+    growing while throughput improves and there is CPU headroom, backs off
+    when the host is overloaded or when growing didn't pay, and then holds
+    for a few intervals before probing again. CPU-bound targets settle
+    around one item per CPU while sleep-heavy targets get many more.
+    """
+    def __init__(self, jobs=1, min_jobs=1, max_jobs=None, cpu_ceiling=0.9,
+                 interval=2.0, adaptive=True, tolerance=0.05, cooldown=5):
+        """
+        :param jobs: Initial number of concurrent items.
+        :param min_jobs: Minimum number of concurrent items.
+        :param max_jobs: Maximum number of concurrent items. Default to 4
+                         times the number of CPUs.
+        :param cpu_ceiling: Maximum fraction of the CPUs to use.
+        :param interval: Seconds between two decisions.
+        :param adaptive: Whether the number of items changes at all.
+        :param tolerance: Relative throughput change considered as noise.
+        :param cooldown: Intervals to hold after a grow which didn't pay.
+        """
+        cpus = _cpu_set()
+        self.cpus = len(cpus)
+        self.cpu_load = CpuLoad(cpus)
+        self.min_jobs = min_jobs
+        self.max_jobs = max_jobs or 4 * self.cpus
+        self.jobs = max(min(jobs, self.max_jobs), min_jobs)
+        self.cpu_ceiling = cpu_ceiling
+        self.interval = interval
+        self.adaptive = adaptive
+        self.tolerance = tolerance
+        self.cooldown = cooldown
+
+        self.lock = threading.Lock()
+        self.items = 0
+        self.cpu_time = 0.0
+        self.wall_time = 0.0
+        self.last_update = time.time()
+        self.last_rate = None
+        self.last_action = None
+        self.hold = 0
+
+        self.rate = 0.0
+        self.cpu_ratio = 0.0
+        self.load = 0.0
+        self.decisions = collections.Counter()
+        self.last_decision = 'start'
+
+    def start(self):
+        """
+        Start measuring the first interval.
+        """
+        with self.lock:
+            self.items = 0
+            self.cpu_time = 0.0
+            self.wall_time = 0.0
+            self.last_update = time.time()
+
+    def record(self, res):
+        """
+        Record the result of an item which has run.
+
+        :param res: CmdResult of the item.
+        """
+        with self.lock:
+            self.items += 1
+            if res and res.rusage:
+                self.cpu_time += res.rusage['utime'] + res.rusage['stime']
+                self.wall_time += res.call_time
+
+    def _decide(self):
+        ceiling = self.cpu_ceiling * self.cpus
+        overloaded = self.load > ceiling or \
+            self.jobs * self.cpu_ratio > ceiling
+        headroom = self.load < ceiling and \
+            (self.jobs + 1) * self.cpu_ratio <= ceiling
+        worse = self.last_rate is not None and \
+            self.rate < self.last_rate * (1 - self.tolerance)
+
+        if overloaded:
+            return 'shrink', 'cpu'
+        if self.last_action == 'grow' and worse:
+            self.hold = self.cooldown
+            return 'shrink', 'throughput'
+        if self.hold > 0:
+            self.hold -= 1
+            return 'hold', 'cooldown'
+        if headroom:
+            return 'grow', 'headroom'
+        return 'hold', 'ceiling'
+
+    def update(self, now=None):
+        """
+        Make a decision if an interval has passed since the last one.
+
+        :param now: Current time.
+        :return: Number of items to run concurrently.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            elapsed = now - self.last_update
+            if elapsed < self.interval:
+                return self.jobs
+            self.rate = self.items / elapsed
+            if self.wall_time > 0:
+                self.cpu_ratio = self.cpu_time / self.wall_time
+            self.items = 0
+            self.cpu_time = 0.0
+            self.wall_time = 0.0
+            self.last_update = now
+        self.load = _load(self.cpu_load)
+
+        if not self.adaptive:
+            return self.jobs
+
+        action, reason = self._decide()
+        if action == 'grow' and self.jobs < self.max_jobs:
+            self.jobs += 1
+        elif action == 'shrink' and self.jobs > self.min_jobs:
+            self.jobs -= 1
+        else:
+            action = 'hold'
+        self.last_action = action
+        self.last_rate = self.rate
+        self.decisions[action] += 1
+        self.last_decision = '%s (%s)' % (action, reason)
+        return self.jobs
+
+    def metrics(self):
+        """
+        Collect concurrency metrics.
+
+        :return: An ordered dictionary of metric names and values.
+        """
+        return collections.OrderedDict([
+            ('concurrency_jobs', self.jobs),
+            ('concurrency_items_per_sec', round(self.rate, 3)),
+            ('concurrency_cpu_ratio', round(self.cpu_ratio, 3)),
+            ('concurrency_load', round(self.load, 3)),
+            ('concurrency_grows', self.decisions['grow']),
+            ('concurrency_shrinks', self.decisions['shrink']),
+            ('concurrency_holds', self.decisions['hold']),
+            ('concurrency_last_decision', self.last_decision),
+        ])
@@ -0,0 +1,76 @@
+from __future__ import print_function
+import argparse
+import json
+import sys
+
+from ..core import coverage
+from ..core import provider
+
+
+class CoverageApp(object):
+    """
+    DICE client application reporting how often the traces of the
+    constraints are chosen, solved and run, to find dead oracle branches.
+    """
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(prog='dice coverage')
+        self.parser.add_argument(
+            'coverage_file',
+            nargs='?',
+            action='store',
+            help="coverage file saved by 'dice --coverage-file'",
+            default=None,
+        )
+        self.parser.add_argument(
+            '--providers',
+            action='store',
+            help="list of test providers separated by ',' to generate items "
+            "from instead of reading a coverage file. Items are not run, so "
+            "only choosing and solving traces is covered.",
+            dest='providers',
+            default=None,
+        )
+        self.parser.add_argument(
+            '--count',
+            action='store',
+            type=int,
+            help='number of items to generate for each provider',
+            dest='count',
+            default=1000,
+        )
+        self.parser.add_argument(
+            '--unreached',
+            action='store_true',
+            help='only report traces never chosen or never run',
+            dest='unreached',
+            default=False,
+        )
+
+        self.args, _ = self.parser.parse_known_args()
+
+    def _generate(self):
+        coverages = {}
+        for path in self.args.providers.split(','):
+            try:
+                prvdr = provider.Provider(path)
+            except provider.ProviderError as detail:
+                sys.exit(detail)
+            for _ in prvdr.generate_many(self.args.count):
+                pass
+            coverages[prvdr.name] = \
+                prvdr.constraint_manager.coverage.serialize()
+        return coverages
+
+    def run(self):
+        """
+        Print the coverage report.
+        """
+        if self.args.coverage_file is not None:
+            with open(self.args.coverage_file) as fp:
+                coverages = json.load(fp)
+        elif self.args.providers is not None:
+            coverages = self._generate()
+        else:
+            self.parser.error('a coverage file or --providers is required')
+        print(coverage.report(coverages, unreached_only=self.args.unreached))
+        return 0
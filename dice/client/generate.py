@@ -0,0 +1,234 @@
+from __future__ import print_function
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ..core import provider
+
+# Providers of the generation processes, inherited by forked workers.
+_PROVIDERS = {}
+
+
+def encode_jsonl(data):
+    """
+    Encode a serialized item as a line of JSON.
+    """
+    return (json.dumps(data, sort_keys=True) + '\n').encode('utf-8')
+
+
+def _encode_bin_value(value):
+    if value is None:
+        return b'n'
+    elif isinstance(value, bool):
+        return b'b' + (b'\x01' if value else b'\x00')
+    elif isinstance(value, int):
+        data = str(value).encode('ascii')
+        return b'i' + struct.pack('<I', len(data)) + data
+    elif isinstance(value, (list, tuple, set)):
+        return b'l' + struct.pack('<I', len(value)) + b''.join(
+            _encode_bin_value(entry) for entry in value)
+    else:
+        value = '%s' % value
+        try:
+            return b's' + struct.pack('<I', len(value)) + value.encode(
+                'latin-1')
+        except UnicodeEncodeError:
+            data = value.encode('utf-8')
+            return b'u' + struct.pack('<I', len(data)) + data
+
+
+def encode_bin(data):
+    """
+    Encode the options of a serialized item as a binary record.
+
+    A record starts with the little-endian uint32 number of options, each
+    option is the uint32 length and UTF-8 bytes of its path followed by its
+    value. A value is a type tag byte followed by:
+
+    - ``n``: nothing, for None;
+    - ``b``: one byte 0 or 1;
+    - ``i``: uint32 length and the decimal ASCII digits of the integer;
+    - ``s``: uint32 length and the Latin-1 encoded string, i.e. raw bytes;
+    - ``u``: uint32 length and the UTF-8 encoded string;
+    - ``l``: uint32 number of entries followed by the entry values.
+    """
+    options = data['options']
+    chunks = [struct.pack('<I', len(options))]
+    for path in sorted(options):
+        name = path.encode('utf-8')
+        chunks.append(struct.pack('<I', len(name)) + name)
+        chunks.append(_encode_bin_value(options[path]))
+    return b''.join(chunks)
+
+
+ENCODERS = {
+    'jsonl': encode_jsonl,
+    'bin': encode_bin,
+    'null': None,
+}
+
+
+def _init_worker():
+    # Forked workers inherit the random state of the parent.
+    random.seed()
+    if numpy is not None:
+        numpy.random.seed()
+
+
+def _generate_chunk(args):
+    """
+    Generate and encode a chunk of items in a worker.
+
+    :param args: A tuple of item count, output format and batch size.
+    :return: A tuple of the encoded items and the number of them.
+    """
+    count, fmt, batch_size = args
+    encode = ENCODERS[fmt]
+    names = sorted(_PROVIDERS)
+    counts = dict.fromkeys(names, 0)
+    for _ in range(count):
+        counts[random.choice(names)] += 1
+
+    chunks = []
+    for name in names:
+        for item in _PROVIDERS[name].generate_many(
+                counts[name], batch_size=batch_size):
+            if encode is not None:
+                chunks.append(encode(item.serialize()))
+    return b''.join(chunks), count
+
+
+class GenerateApp(object):
+    """
+    DICE client application generating items without running them.
+    """
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(prog='dice generate')
+        self.parser.add_argument(
+            'providers',
+            nargs='?',
+            action='store',
+            help="list of test providers separated by ','. Default to current "
+            "working directory",
+            default=os.getcwd(),
+        )
+        self.parser.add_argument(
+            '--count',
+            action='store',
+            type=int,
+            help='number of items to generate',
+            dest='count',
+            default=1000,
+        )
+        self.parser.add_argument(
+            '--format',
+            action='store',
+            choices=sorted(ENCODERS),
+            help="output format of generated items. 'null' generates without "
+            "serializing or writing items",
+            dest='format',
+            default='jsonl',
+        )
+        self.parser.add_argument(
+            '--output',
+            action='store',
+            help="file to write generated items to. Default to stdout",
+            dest='output',
+            default='-',
+        )
+        self.parser.add_argument(
+            '--jobs',
+            action='store',
+            type=int,
+            help='number of generation processes',
+            dest='jobs',
+            default=1,
+        )
+        self.parser.add_argument(
+            '--batch-size',
+            action='store',
+            type=int,
+            help='number of items constrained together',
+            dest='batch_size',
+            default=64,
+        )
+
+        self.args, _ = self.parser.parse_known_args()
+
+        try:
+            self.providers = self._process_providers()
+        except provider.ProviderError as detail:
+            exit(detail)
+
+    def _process_providers(self):
+        """
+        Return a dict of specified providers.
+        """
+        providers = {}
+        for path in self.args.providers.split(','):
+            prvdr = provider.Provider(path)
+            providers[prvdr.name] = prvdr
+        return providers
+
+    def _chunks(self, chunk_size=256):
+        count = self.args.count
+        while count > 0:
+            size = min(count, chunk_size)
+            yield size, self.args.format, self.args.batch_size
+            count -= size
+
+    def _open_output(self):
+        if self.args.output == '-':
+            return getattr(sys.stdout, 'buffer', sys.stdout)
+        return open(self.args.output, 'wb')
+
+    def run(self):
+        """
+        Generate items and write them to the output.
+        """
+        _PROVIDERS.clear()
+        _PROVIDERS.update(self.providers)
+
+        output = self._open_output()
+        start = time.time()
+        generated = 0
+        try:
+            if self.args.jobs > 1:
+                try:
+                    ctx = multiprocessing.get_context('fork')
+                except AttributeError:
+                    ctx = multiprocessing
+                pool = ctx.Pool(self.args.jobs, initializer=_init_worker)
+                try:
+                    results = pool.imap_unordered(_generate_chunk,
+                                                  self._chunks())
+                    for data, count in results:
+                        output.write(data)
+                        generated += count
+                finally:
+                    pool.terminate()
+            else:
+                for chunk in self._chunks():
+                    data, count = _generate_chunk(chunk)
+                    output.write(data)
+                    generated += count
+        finally:
+            output.flush()
+            if self.args.output != '-':
+                output.close()
+
+        elapsed = time.time() - start
+        print('Generated %d items in %.3fs (%.1f items/s)' % (
+            generated, elapsed, generated / elapsed if elapsed else 0.0),
+            file=sys.stderr)
+        return 0
@@ -0,0 +1,346 @@
+from __future__ import print_function
+import argparse
+import collections
+import hashlib
+import json
+import sys
+import threading
+
+from ..core import item as item_mod
+from ..core import provider
+from ..utils import forkserver
+from ..utils import persistent
+from ..utils import pyexec
+
+from . import categories
+
+
+class MinimizeError(Exception):
+    """
+    Class for item minimization specific exceptions.
+    """
+    pass
+
+
+def _reduce_int(value):
+    """
+    Candidates of an integer closer to zero, smallest first.
+    """
+    if value == 0:
+        return []
+    sign = 1 if value > 0 else -1
+    candidates = [0, value // 2 if value > 0 else -(-value // 2),
+                  value - sign]
+    return [cand for idx, cand in enumerate(candidates)
+            if cand != value and cand not in candidates[:idx]]
+
+
+class Minimizer(object):
+    """
+    Reduce the options of an item by delta debugging toward a minimal item
+    whose result keeps the same category and an equivalent statistics key.
+    Keys are equivalent if they have the same signature, see
+    categories.signature(), or if they match a given function like the
+    one of a merged statistic.
+
+    Options are removed first, then the entries of lists and the characters
+    of strings are reduced with ddmin and integers are moved toward zero.
+    Candidates of a reduction step are run in parallel waves of ``jobs``
+    items through the same backend as the test loop, and results are cached
+    by options so no candidate is run twice.
+    """
+    def __init__(self, item, jobs=1, max_probes=1000, match=None):
+        """
+        :param item: The item to minimize. It is run once first if it hasn't
+                     run yet. Candidates are run with its timeout, stall
+                     window and resource limits.
+        :param jobs: Number of candidates run in parallel.
+        :param max_probes: Maximum number of candidates run.
+        :param match: Function checking whether the statistics key of a
+                      candidate is equivalent to the one of the item. Default
+                      to comparing their signatures.
+        """
+        self.item = item
+        self.jobs = max(jobs, 1)
+        self.max_probes = max_probes
+        self.cache = {}
+        self.probes = 0
+        self.cache_hits = 0
+        self.lock = threading.Lock()
+        if not item.res:
+            item.run()
+        self.target = categories.categorize(item)
+        if match is None:
+            target = categories.signature(self.target[1])
+
+            def match(key):
+                return categories.signature(key) == target
+        self.match = match
+        self.options = dict(item.options)
+
+    @staticmethod
+    def _cache_key(options):
+        # Options of long strings make large keys
+        text = repr(sorted(options.items()))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _kept(self, item):
+        catalog, key = categories.categorize(item)
+        return catalog == self.target[0] and bool(self.match(key))
+
+    def _run(self, options):
+        """
+        Run a candidate item with options.
+
+        :return: Whether its result keeps the target category and key.
+        """
+        cand = self._clone(options)
+        cand.run()
+        return self._kept(cand)
+
+    def _clone(self, options):
+        cand = self.item.clone()
+        cand.options = options
+        cand.res = ''
+        for attr in ('timeout', 'stall_window', 'limits'):
+            setattr(cand, attr, getattr(self.item, attr, None))
+        return cand
+
+    def _first_kept(self, count, build):
+        """
+        Find the first candidate keeping the target result, running
+        candidates not cached yet in parallel waves. Candidates are built
+        wave by wave, as those of long strings are large.
+
+        :param count: Number of candidates.
+        :param build: Function building the options of a candidate from its
+                      index.
+        :return: Index of the first candidate kept, or None.
+        """
+        for start in range(0, count, self.jobs):
+            stop = min(start + self.jobs, count)
+            results = {}
+            threads = []
+            for idx in range(start, stop):
+                options = build(idx)
+                key = self._cache_key(options)
+                if key in self.cache:
+                    self.cache_hits += 1
+                    results[idx] = self.cache[key]
+                elif self.probes < self.max_probes:
+                    self.probes += 1
+                    thread = threading.Thread(
+                        target=self._probe,
+                        args=(options, key, results, idx),
+                        name='dice-minimize')
+                    thread.start()
+                    threads.append(thread)
+            for thread in threads:
+                thread.join()
+
+            for idx in range(start, stop):
+                if results.get(idx):
+                    return idx
+            if self.probes >= self.max_probes:
+                break
+        return None
+
+    def _probe(self, options, key, results, idx):
+        kept = self._run(options)
+        with self.lock:
+            self.cache[key] = kept
+        results[idx] = kept
+
+    def _ddmin(self, seq, build):
+        """
+        Reduce a sequence with ddmin.
+
+        :param seq: List of elements to reduce.
+        :param build: Function building the options of a candidate from a
+                      list of elements.
+        :return: The reduced list of elements.
+        """
+        if seq and self._first_kept(1, lambda idx: build([])) is not None:
+            return []
+        granularity = 2
+        while len(seq) >= 2 and self.probes < self.max_probes:
+            size = -(-len(seq) // granularity)
+            starts = range(0, len(seq), size)
+
+            def _candidate(idx, seq=seq, size=size, starts=starts):
+                # Subsets first, then their complements
+                if idx < len(starts):
+                    pos = starts[idx]
+                    return seq[pos:pos + size]
+                pos = starts[idx - len(starts)]
+                return seq[:pos] + seq[pos + size:]
+
+            # With two subsets, subsets and complements are the same
+            count = len(starts) if granularity == 2 else 2 * len(starts)
+            idx = self._first_kept(count,
+                                   lambda idx: build(_candidate(idx)))
+            if idx is not None:
+                seq = _candidate(idx)
+                if idx < len(starts):
+                    granularity = 2
+                else:
+                    granularity = max(granularity - 1, 2)
+                continue
+            if granularity >= len(seq):
+                break
+            granularity = min(len(seq), granularity * 2)
+        return seq
+
+    def _with(self, path, value):
+        options = dict(self.options)
+        options[path] = value
+        return options
+
+    def minimize(self):
+        """
+        Minimize the options of the item.
+
+        :return: A new item with the minimized options, which has run.
+        """
+        paths = sorted(self.options)
+        kept = self._ddmin(
+            paths, lambda cand: dict((path, self.options[path])
+                                     for path in cand))
+        self.options = dict((path, self.options[path]) for path in kept)
+
+        for path in sorted(self.options):
+            value = self.options[path]
+            if isinstance(value, bool):
+                continue
+            elif isinstance(value, int):
+                while True:
+                    candidates = _reduce_int(value)
+                    idx = self._first_kept(
+                        len(candidates),
+                        lambda idx, path=path, candidates=candidates:
+                        self._with(path, candidates[idx]))
+                    if idx is None:
+                        break
+                    value = candidates[idx]
+                    self.options[path] = value
+            elif isinstance(value, list):
+                self.options[path] = self._ddmin(
+                    value, lambda cand, path=path: self._with(path, cand))
+            elif isinstance(value, str):
+                self.options[path] = ''.join(self._ddmin(
+                    list(value),
+                    lambda cand, path=path: self._with(path, ''.join(cand))))
+
+        result = self._clone(dict(self.options))
+        result.run()
+        return result
+
+    def metrics(self):
+        """
+        Collect minimization metrics.
+
+        :return: An ordered dictionary of metric names and values.
+        """
+        return collections.OrderedDict([
+            ('minimize_probes', self.probes),
+            ('minimize_cache_hits', self.cache_hits),
+            ('minimize_options', len(self.options)),
+        ])
+
+
+class MinimizeApp(object):
+    """
+    DICE client application minimizing a saved item while keeping the
+    category and statistics key of its result.
+    """
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(prog='dice minimize')
+        self.parser.add_argument(
+            'item_file',
+            action='store',
+            help="item file saved by DICE",
+        )
+        self.parser.add_argument(
+            '--providers',
+            action='store',
+            help="list of test providers separated by ',', one of which "
+            "made the item",
+            dest='providers',
+            default=None,
+        )
+        self.parser.add_argument(
+            '--output',
+            action='store',
+            help="file to save the minimized item to. Default to stdout",
+            dest='output',
+            default='-',
+        )
+        self.parser.add_argument(
+            '--jobs',
+            action='store',
+            type=int,
+            help='number of candidate items run in parallel',
+            dest='jobs',
+            default=1,
+        )
+        self.parser.add_argument(
+            '--max-probes',
+            action='store',
+            type=int,
+            help='maximum number of candidate items run',
+            dest='max_probes',
+            default=1000,
+        )
+        self.parser.add_argument(
+            '--forkserver',
+            action='store_true',
+            help='spawn target processes from a fork server',
+            dest='forkserver',
+            default=False,
+        )
+
+        self.args, _ = self.parser.parse_known_args()
+
+    def _load_item(self):
+        with open(self.args.item_file) as fp:
+            data = json.load(fp)
+        if not self.args.providers:
+            self.parser.error('--providers is required')
+        for path in self.args.providers.split(','):
+            prvdr = provider.Provider(path)
+            if prvdr.name == data.get('provider'):
+                return item_mod.ItemBase.deserialize(prvdr, data)
+        raise MinimizeError("Provider '%s' of the item not found" %
+                            data.get('provider'))
+
+    def run(self):
+        """
+        Minimize the item and save it.
+        """
+        try:
+            item = self._load_item()
+        except (provider.ProviderError, MinimizeError) as detail:
+            sys.exit(detail)
+
+        if self.args.forkserver:
+            forkserver.start()
+        try:
+            minimizer = Minimizer(item, jobs=self.args.jobs,
+                                  max_probes=self.args.max_probes)
+            result = minimizer.minimize()
+        finally:
+            persistent.stop_all()
+            pyexec.stop()
+            forkserver.stop()
+
+        catalog, key = minimizer.target
+        print('Minimized %s item (%s) with %d probes' %
+              (catalog, key.strip().splitlines()[-1] if key.strip() else '',
+               minimizer.probes), file=sys.stderr)
+        data = json.dumps(result.serialize(), indent=4, sort_keys=True)
+        if self.args.output == '-':
+            print(data)
+        else:
+            with open(self.args.output, 'w') as fp:
+                fp.write(data)
+        return 0
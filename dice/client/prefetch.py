@@ -0,0 +1,114 @@
+import collections
+import sys
+import threading
+import time
+# pylint: disable=import-error
+import queue
+
+
+class Prefetcher(object):
+    """
+    Generate test items ahead of their execution into a bounded queue.
+
+    Items are generated by a single producer thread, so providers, which are
+    not thread-safe, are never used concurrently. Executing an item mostly
+    waits on its target process with the GIL released, which leaves the
+    producer free to solve the constraints of the next items meanwhile.
+    """
+    def __init__(self, generate, size=16):
+        """
+        :param generate: Callable returning a newly generated item.
+        :param size: Maximum number of items generated ahead.
+        """
+        self.generate = generate
+        self.queue = queue.Queue(maxsize=size)
+        self.exiting = False
+        self.exc_info = None
+        self.generated = 0
+        self.consumed = 0
+        self.gen_time = 0.0
+        self.wait_time = 0.0
+        self.thread = threading.Thread(target=self._produce,
+                                       name='dice-prefetch')
+        self.thread.daemon = True
+
+    def _produce(self):
+        try:
+            while not self.exiting:
+                start = time.time()
+                item = self.generate()
+                self.gen_time += time.time() - start
+                self.generated += 1
+                while not self.exiting:
+                    try:
+                        self.queue.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+        # pylint: disable=broad-except
+        except Exception:
+            self.exc_info = sys.exc_info()
+
+    def start(self):
+        """
+        Start generating items in background.
+        """
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop generating items and wait for the producer to exit.
+        """
+        self.exiting = True
+        self.thread.join()
+
+    def _raise_error(self):
+        if self.exc_info is not None:
+            raise self.exc_info[1].with_traceback(self.exc_info[2])
+
+    def get(self, timeout=0.5):
+        """
+        Get the next generated item.
+
+        :param timeout: Seconds to wait for an item to be generated.
+        :return: The generated item or None if nothing is ready in time.
+        :raises: Any exception raised while generating items.
+        """
+        # Fail as soon as the producer did, not after draining the queue
+        self._raise_error()
+        start = time.time()
+        try:
+            item = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            self._raise_error()
+            item = None
+        self.wait_time += time.time() - start
+        if item is not None:
+            self.consumed += 1
+        return item
+
+    @property
+    def hidden_time(self):
+        """
+        Generation time overlapped with execution, i.e. the time spent
+        generating items which the consumer didn't have to wait for.
+        """
+        return max(self.gen_time - self.wait_time, 0.0)
+
+    def metrics(self):
+        """
+        Collect prefetch metrics.
+
+        :return: An ordered dictionary of metric names and values.
+        """
+        hidden_ratio = 0.0
+        if self.gen_time > 0:
+            hidden_ratio = self.hidden_time / self.gen_time
+        return collections.OrderedDict([
+            ('prefetch_queued', self.queue.qsize()),
+            ('prefetch_generated', self.generated),
+            ('generation_time', round(self.gen_time, 3)),
+            ('generation_wait_time', round(self.wait_time, 3)),
+            ('generation_hidden_time', round(self.hidden_time, 3)),
+            ('generation_hidden_ratio', round(hidden_ratio, 3)),
+        ])
@@ -0,0 +1,106 @@
+import collections
+import math
+import threading
+
+from ..utils import procstat
+
+
+def _metrics(rusage):
+    """
+    Resources of a command outliers are detected on.
+    """
+    return collections.OrderedDict([
+        ('cpu', rusage['utime'] + rusage['stime']),
+        ('maxrss', rusage['maxrss']),
+        ('blkio', rusage['inblock'] + rusage['oublock']),
+    ])
+
+
+class ResourceSummary(object):
+    """
+    Aggregated resource usage of a group of command results.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = dict.fromkeys(procstat.RUSAGE_FIELDS, 0)
+        self.peak = dict.fromkeys(procstat.RUSAGE_FIELDS, 0)
+
+    def add(self, rusage):
+        """
+        Add the resource usage of a command.
+
+        :param rusage: A dictionary keyed by procstat.RUSAGE_FIELDS.
+        """
+        self.count += 1
+        for name in procstat.RUSAGE_FIELDS:
+            self.total[name] += rusage[name]
+            self.peak[name] = max(self.peak[name], rusage[name])
+
+    def __str__(self):
+        if not self.count:
+            return 'no resource usage recorded'
+        lines = ['%-8s %12s %12s' % ('resource', 'mean', 'max')]
+        for name in procstat.RUSAGE_FIELDS:
+            mean = float(self.total[name]) / self.count
+            lines.append('%-8s %12.3f %12.3f' % (name, mean, self.peak[name]))
+        return '\n'.join(lines)
+
+
+class _RunningStat(object):
+    """
+    Running mean and variance with Welford's algorithm.
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def std(self):
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(self.m2 / (self.count - 1))
+
+
+class OutlierDetector(object):
+    """
+    Flag commands using far more CPU time, memory or block I/O than the
+    others of the same provider.
+    """
+    def __init__(self, threshold=4.0, min_samples=100):
+        """
+        :param threshold: Number of standard deviations above the mean from
+                          which a resource usage is an outlier.
+        :param min_samples: Number of commands observed before flagging.
+        """
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def check(self, key, rusage):
+        """
+        Check the resource usage of a command and record it.
+
+        :param key: Key of the group the command is compared with, e.g. the
+                    provider name.
+        :param rusage: A dictionary keyed by procstat.RUSAGE_FIELDS.
+        :return: A list of names of the outlying resources.
+        """
+        outliers = []
+        with self.lock:
+            stats = self.stats.setdefault(key, collections.defaultdict(
+                _RunningStat))
+            for name, value in _metrics(rusage).items():
+                stat = stats[name]
+                if stat.count >= self.min_samples and \
+                        value > stat.mean + self.threshold * stat.std:
+                    outliers.append(name)
+                stat.add(value)
+        return outliers
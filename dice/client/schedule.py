@@ -0,0 +1,163 @@
+import collections
+import threading
+
+
+class ScheduleError(Exception):
+    """
+    Class for provider scheduling specific exceptions.
+    """
+    pass
+
+
+class _ProviderShare(object):
+    def __init__(self, provider, weight):
+        self.provider = provider
+        self.weight = weight
+        self.passed = 0.0
+        self.items = 0
+        self.time = 0.0
+        self.cost = None
+        self.yield_rate = 1.0
+        # Estimated costs charged for items not recorded yet
+        self.charged = collections.deque()
+
+
+class ProviderScheduler(object):
+    """
+    Choose the provider of every generated item so that providers get
+    shares of the campaign proportional to their weights.
+
+    Shares are allocated with stride scheduling: the provider chosen is the
+    one with the least consumption so far, and choosing it adds the cost of
+    an item divided by its weight to its consumption. The estimated cost is
+    corrected with the actual one once the item has run. In ``items`` mode all
+    items cost the same, giving equal item shares. In ``time`` mode items
+    cost the running mean call time of their provider, giving equal time
+    shares. In ``yield`` mode the time cost is divided by the rate at which
+    the provider finds new statistics keys, favoring providers which still
+    find new behaviors.
+    """
+    modes = ('items', 'time', 'yield')
+
+    def __init__(self, providers, mode='items', weights=None, alpha=0.05,
+                 min_yield=0.01):
+        """
+        :param providers: List of providers to schedule.
+        :param mode: How the cost of items is measured.
+        :param weights: Dictionary of weights keyed by provider names.
+                        Default to 1 for providers not in it.
+        :param alpha: Smoothing factor of the running means of call time
+                      and yield.
+        :param min_yield: Minimum yield rate, which keeps every provider
+                          running a bit.
+        """
+        if mode not in self.modes:
+            raise ScheduleError("Unknown schedule mode '%s'" % mode)
+        if not providers:
+            raise ScheduleError('No provider to schedule')
+        weights = weights or {}
+        for name in weights:
+            if name not in [prvdr.name for prvdr in providers]:
+                raise ScheduleError("Weight for unknown provider '%s'" % name)
+
+        self.mode = mode
+        self.alpha = alpha
+        self.min_yield = min_yield
+        self.lock = threading.Lock()
+        self.shares = collections.OrderedDict()
+        for prvdr in providers:
+            weight = weights.get(prvdr.name, 1.0)
+            if weight <= 0:
+                raise ScheduleError(
+                    "Weight of provider '%s' must be positive" % prvdr.name)
+            self.shares[prvdr.name] = _ProviderShare(prvdr, weight)
+
+    @staticmethod
+    def parse_weights(text):
+        """
+        Parse weights given as a comma separated list of name=weight.
+
+        :return: Dictionary of weights keyed by provider names.
+        """
+        weights = {}
+        if not text:
+            return weights
+        for entry in text.split(','):
+            name, sep, weight = entry.partition('=')
+            try:
+                weights[name.strip()] = float(weight)
+            except ValueError:
+                sep = None
+            if not sep:
+                raise ScheduleError("Invalid provider weight '%s'" % entry)
+        return weights
+
+    def _cost(self, share, call_time=None):
+        if self.mode == 'items':
+            return 1.0
+        if call_time is not None:
+            cost = call_time
+        elif share.cost is not None:
+            cost = share.cost
+        else:
+            # Until measured, assume the average cost of other providers
+            known = [other.cost for other in self.shares.values()
+                     if other.cost is not None]
+            cost = sum(known) / len(known) if known else 1.0
+        # Items which didn't run still cost something
+        cost = max(cost, 1e-6)
+        if self.mode == 'yield':
+            cost /= max(share.yield_rate, self.min_yield)
+        return cost
+
+    def choose(self):
+        """
+        Choose the provider of the next item.
+
+        :return: A provider.
+        """
+        with self.lock:
+            share = min(self.shares.values(), key=lambda share: share.passed)
+            cost = self._cost(share)
+            share.charged.append(cost)
+            share.passed += cost / share.weight
+            return share.provider
+
+    def record(self, item, new_key=False):
+        """
+        Record an item which has run.
+
+        :param item: The item.
+        :param new_key: Whether the result of the item got a new statistics
+                        key.
+        """
+        with self.lock:
+            share = self.shares.get(item.provider.name)
+            if share is None:
+                return
+            call_time = item.res.call_time if item.res else 0.0
+            share.items += 1
+            share.time += call_time
+            if share.cost is None:
+                share.cost = call_time
+            else:
+                share.cost += self.alpha * (call_time - share.cost)
+            share.yield_rate += self.alpha * (
+                (1.0 if new_key else 0.0) - share.yield_rate)
+            if share.charged:
+                share.passed += (self._cost(share, call_time) -
+                                 share.charged.popleft()) / share.weight
+
+    def metrics(self):
+        """
+        Collect provider scheduling metrics.
+
+        :return: An ordered dictionary of metric names and values.
+        """
+        metrics = collections.OrderedDict()
+        with self.lock:
+            for name, share in self.shares.items():
+                metrics['schedule_%s' % name] = (
+                    '%d items, %.3fs, yield %.3f' %
+                    (share.items, share.time, share.yield_rate))
+        return metrics
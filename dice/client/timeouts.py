@@ -0,0 +1,183 @@
+import collections
+import math
+import threading
+
+
+class LatencyHistogram(object):
+    """
+    Streaming histogram of call times with logarithmic buckets, which keeps
+    a bounded relative error on percentiles in constant memory whatever the
+    number of samples.
+    """
+    def __init__(self, min_value=1e-4, growth=1.1):
+        """
+        :param min_value: Upper bound of the first bucket in seconds.
+        :param growth: Ratio between the bounds of consecutive buckets.
+        """
+        self.min_value = min_value
+        self.growth = growth
+        self.log_growth = math.log(growth)
+        self.buckets = collections.defaultdict(int)
+        self.count = 0
+
+    def _bucket(self, value):
+        if value <= self.min_value:
+            return 0
+        return int(math.ceil(math.log(value / self.min_value) /
+                             self.log_growth))
+
+    def add(self, value):
+        """
+        Add a sample to the histogram.
+
+        :param value: Call time in seconds.
+        """
+        self.buckets[self._bucket(value)] += 1
+        self.count += 1
+
+    def percentile(self, percent):
+        """
+        Estimate a percentile of the samples.
+
+        :param percent: Percentile between 0 and 100.
+        :return: Upper bound of the bucket containing the percentile, or
+                 None if there is no sample.
+        """
+        if not self.count:
+            return None
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen >= rank:
+                break
+        return self.min_value * self.growth ** idx
+
+
+class TimeoutEstimator(object):
+    """
+    Derive timeouts of items from the call times observed for their
+    provider, or for the traces chosen by their constraints, instead of
+    waiting for the fixed timeout of the item class on every hang.
+
+    The timeout is a multiple of a high percentile of the call times, bound
+    by a floor and a ceiling. Timed out and stalled calls are not added to
+    the histograms, so occasional hangs don't drag the timeout up to the
+    ceiling. Instead, the timeout is doubled whenever too many of the
+    recent calls time out, as happens when call times shift above the
+    learned timeout, and halved back once none of them do.
+    """
+    def __init__(self, percentile=99.9, multiplier=3.0, floor=0.1,
+                 ceiling=10.0, per_trace=False, min_samples=100,
+                 max_timeout_rate=0.2, window=50):
+        """
+        :param percentile: Percentile of call times the timeout derives from.
+        :param multiplier: Factor applied to the percentile.
+        :param floor: Minimum timeout in seconds.
+        :param ceiling: Maximum timeout in seconds.
+        :param per_trace: Keep a histogram for each combination of traces
+                          besides the one of the provider.
+        :param min_samples: Number of samples needed before a histogram is
+                            used. Items fall back to the ceiling before.
+        :param max_timeout_rate: Rate of timed out calls in a window above
+                                 which the timeout is doubled.
+        :param window: Number of recent calls the rate is computed over.
+        """
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.floor = floor
+        self.ceiling = ceiling
+        self.per_trace = per_trace
+        self.min_samples = min_samples
+        self.max_timeout_rate = max_timeout_rate
+        self.window = window
+        self.histograms = {}
+        # Whether recent calls timed out and the factor applied to the
+        # timeout, keyed like histograms
+        self.recent = {}
+        self.boosts = {}
+        self.lock = threading.Lock()
+        self.adapted = 0
+        self.timed_out = 0
+        self.saved_time = 0.0
+
+    def _keys(self, item):
+        keys = [item.provider.name]
+        if self.per_trace and item.traces:
+            keys.append((item.provider.name, tuple(item.traces)))
+        return keys
+
+    def timeout_for(self, item):
+        """
+        Get the timeout to run an item with.
+
+        :param item: The item to be run.
+        :return: Timeout in seconds.
+        """
+        with self.lock:
+            # The most specific histogram with enough samples wins
+            for key in reversed(self._keys(item)):
+                hist = self.histograms.get(key)
+                if hist is not None and hist.count >= self.min_samples:
+                    timeout = hist.percentile(self.percentile)
+                    timeout *= self.multiplier * self.boosts.get(key, 1.0)
+                    self.adapted += 1
+                    return min(max(timeout, self.floor), self.ceiling)
+        return self.ceiling
+
+    def _record(self, key, timed_out):
+        """
+        Adjust the timeout factor of a key from its recent timeouts.
+        """
+        recent = self.recent.setdefault(
+            key, collections.deque(maxlen=self.window))
+        recent.append(timed_out)
+        if len(recent) < self.window:
+            return
+        rate = sum(recent) / float(len(recent))
+        boost = self.boosts.get(key, 1.0)
+        if rate > self.max_timeout_rate:
+            self.boosts[key] = boost * 2
+        elif rate == 0 and boost > 1.0:
+            self.boosts[key] = max(boost / 2, 1.0)
+        else:
+            return
+        recent.clear()
+
+    def observe(self, item):
+        """
+        Record the result of an item which has run.
+
+        :param item: The item run with a timeout from timeout_for().
+        """
+        res = item.res
+        if not res:
+            return
+        with self.lock:
+            if res.exit_status == 'timeout':
+                self.timed_out += 1
+                self.saved_time += max(self.ceiling - item.timeout, 0.0)
+                for key in self._keys(item):
+                    self._record(key, True)
+                return
+            if res.exit_status == 'stalled':
+                return
+            for key in self._keys(item):
+                self._record(key, False)
+                if key not in self.histograms:
+                    self.histograms[key] = LatencyHistogram()
+                self.histograms[key].add(res.call_time)
+
+    def metrics(self):
+        """
+        Collect adaptive timeout metrics.
+
+        :return: An ordered dictionary of metric names and values.
+        """
+        with self.lock:
+            return collections.OrderedDict([
+                ('timeout_adapted', self.adapted),
+                ('timeout_histograms', len(self.histograms)),
+                ('timeout_hits', self.timed_out),
+                ('timeout_saved_time', round(self.saved_time, 3)),
+            ])
@@ -98,6 +98,8 @@ class Window(object):
             app.setting_watch = True
         elif ch == ord('l'):
             app.show_log = not app.show_log
+        elif ch == ord('c'):
+            app.show_coverage = not app.show_coverage
         elif ch == ord('s'):
             app.last_item.save('saved_item.txt')
         elif ch == ord('\t'):
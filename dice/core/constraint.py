@@ -1,13 +1,25 @@
 import ast
 import copy
+import logging
 import os
 import random
 import re
+import time
 import yaml
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import coverage
+from . import selector
 from . import trace
 
 
+logger = logging.getLogger(__name__)
+
+
 class ConstraintError(Exception):
     """
     Constraint module specified exception.
@@ -26,6 +38,25 @@ class ConstraintManager(object):
         self.provider = provider
         path = os.path.join(provider.path, 'oracles')
         self.constraints = self._load_constraints(path)
+        self.requires = {c.name: self._parse_require(c.require)
+                         for c in self.constraints}
+        self.by_name = {c.name: c for c in self.constraints}
+        # Names of the constraints whose assumption is on each constraint
+        self.requirers = dict((c.name, []) for c in self.constraints)
+        for name, require in self.requires.items():
+            if require is not None and require[0] in self.requirers:
+                self.requirers[require[0]].append(name)
+        # Paths of the options every constraint reads. Those it writes are
+        # recorded for every item in item.solved.
+        self.reads = dict((c.name, c.reads) for c in self.constraints)
+
+        # Pruned traces are covered too, to report the dead branches
+        traces = [t for c in self.constraints for t in c.all_traces]
+        for idx, t in enumerate(traces):
+            t.id = idx
+        self.coverage = coverage.TraceCoverage(traces)
+        for c in self.constraints:
+            c.coverage = self.coverage
         self.item = None
         self.status = {}
 
@@ -40,21 +71,24 @@ class ConstraintManager(object):
             for fname in files:
                 fpath = os.path.join(root, fname)
                 with open(fpath) as fp:
-                    cstrs.extend(yaml.load(fp))
+                    cstrs.extend(yaml.safe_load(fp))
 
         cstrs = [Constraint.from_dict(self.provider, c) for c in cstrs]
         return cstrs
 
-    def _assumption_valid(self, constraint):
+    @staticmethod
+    def _parse_require(require):
         """
-        Check whether the assumption of a constraint is valid.
+        Parse the assumption of a constraint into its operands.
 
-        :param constraint: The constraint whose assumption to be checked.
+        :param require: Assumption expression of a constraint.
+        :return: A tuple of left operand, operator name and right operand, or
+                 None if there is no assumption.
         """
-        if constraint.require is None:
-            return True
+        if require is None:
+            return None
 
-        module = ast.parse(constraint.require)
+        module = ast.parse(require)
         assert len(module.body) == 1
         expr = module.body[0]
         assert isinstance(expr, ast.Expr)
@@ -71,15 +105,184 @@ class ConstraintManager(object):
 
         if isinstance(right, ast.Name):
             right = right.id
+        return left, op, right
 
-        if left in self.status:
-            left = self.status[left]
+    def _assumption_valid(self, constraint, status=None):
+        """
+        Check whether the assumption of a constraint is valid.
+
+        :param constraint: The constraint whose assumption to be checked.
+        :param status: Constraint results of the item being constrained.
+                       Default to the status of the current item.
+        """
+        require = self.requires[constraint.name]
+        if require is None:
+            return True
+
+        if status is None:
+            status = self.status
+
+        left, op, right = require
+        if left in status:
+            left = status[left]
 
         if op == 'Is':
             return left.lower() == right.lower()
         else:
             raise ConstraintError('Operator %s is not handled' % op)
 
+    def set_selector(self, name):
+        """
+        Set how constraints choose their traces.
+
+        :param name: Name of a trace selector, see selector.SELECTORS.
+        """
+        for constraint in self.constraints:
+            constraint.selector = selector.create(name)
+
+    def reward(self, item, value):
+        """
+        Reward the traces chosen for an item with the outcome of the item.
+
+        :param item: An item which has run.
+        :param value: Reward between 0 and 1.
+        """
+        for key in item.traces:
+            name = key.rsplit(':', 1)[0]
+            constraint = self.by_name.get(name)
+            if constraint is not None:
+                constraint.reward(key, value)
+
+    def record_outcome(self, item, category):
+        """
+        Count the result category of an item for the traces chosen for it.
+
+        :param item: An item which has run.
+        :param category: Result category of the item.
+        """
+        self.coverage.record_outcome(item.traces, category)
+
+    def _trace(self, key):
+        constraint = self.by_name.get(key.rsplit(':', 1)[0])
+        if constraint is None:
+            return None
+        return constraint.trace_keys.get(key)
+
+    def _unsolve(self, item, name):
+        """
+        Remove the options and the trace a constraint set to an item.
+        """
+        key, paths = item.solved.pop(name)
+        for path in paths:
+            item.options.pop(path, None)
+        if key in item.traces:
+            item.traces.remove(key)
+
+    def _status(self, item):
+        status = {}
+        for constraint in self.constraints:
+            status[constraint.name] = 'skipped'
+            if constraint.name in item.solved:
+                t = self._trace(item.solved[constraint.name][0])
+                if t is not None:
+                    status[constraint.name] = t.result
+        return status
+
+    def _refresh_patts(self, item):
+        item.fail_patts = set()
+        for key in item.traces:
+            t = self._trace(key)
+            if t is not None:
+                Constraint.add_patts(item, t)
+
+    def reconstrain(self, item, paths=(), changed=(), done=()):
+        """
+        Re-solve only the constraints of an item affected by changed options
+        or constraint results, transitively.
+
+        A constraint is affected if any of its traces reads a changed option,
+        if its assumption is on a changed constraint or if the validity of
+        its assumption changed. Options written by a re-solved constraint are
+        changed in turn. Every constraint is re-solved at most once.
+
+        :param item: Item already constrained.
+        :param paths: Paths of the changed options.
+        :param changed: Names of the constraints whose results changed.
+        :param done: Names of the constraints not to re-solve.
+        """
+        paths = set(paths)
+        changed = set(changed)
+        done = set(done)
+        status = self._status(item)
+        progress = True
+        while progress:
+            progress = False
+            for constraint in self.constraints:
+                name = constraint.name
+                if name in done:
+                    continue
+                valid = self._assumption_valid(constraint, status)
+                affected = (bool(self.reads[name] & paths) or
+                            any(name in self.requirers[dep]
+                                for dep in changed) or
+                            valid != (name in item.solved))
+                if not affected:
+                    continue
+
+                done.add(name)
+                progress = True
+                if name in item.solved:
+                    paths.update(item.solved[name][1])
+                    self._unsolve(item, name)
+                old_status = status[name]
+                status[name] = 'skipped'
+                if valid:
+                    status[name] = constraint.apply(item)
+                if name in item.solved:
+                    paths.update(item.solved[name][1])
+                if status[name] != old_status:
+                    changed.add(name)
+        self._refresh_patts(item)
+
+    def mutate(self, item, count=None, perturb_ratio=0.5):
+        """
+        Turn an item into a variant by re-solving the options of a few of its
+        constraints or perturbing one of their options, keeping all the
+        other options.
+
+        :param item: Item to mutate, usually a clone of an item which has
+                     run.
+        :param count: Number of constraints to change. Default to one and
+                      sometimes a few more.
+        :param perturb_ratio: Probability to perturb an option of a
+                              constraint rather than re-solving it.
+        """
+        names = [c.name for c in self.constraints if c.name in item.solved]
+        if not names:
+            self.constrain(item)
+            return
+        if count is None:
+            count = 1 + int(random.expovariate(1.5))
+
+        chosen = random.sample(names, min(count, len(names)))
+        status = self._status(item)
+        paths = set()
+        changed = set()
+        for name in chosen:
+            constraint = self.by_name[name]
+            if random.random() < perturb_ratio:
+                path = constraint.perturb(item)
+                if path is not None:
+                    paths.add(path)
+                    continue
+            paths.update(item.solved[name][1])
+            self._unsolve(item, name)
+            if constraint.apply(item) != status[name]:
+                changed.add(name)
+            if name in item.solved:
+                paths.update(item.solved[name][1])
+        self.reconstrain(item, paths, changed, done=chosen)
+
     def constrain(self, item):
         """
         Apply constraints to an item.
@@ -98,6 +301,26 @@ class ConstraintManager(object):
 
                 self.status[constraint.name] = result
 
+    def constrain_many(self, items):
+        """
+        Apply constraints to a batch of items at once.
+
+        Every constraint is applied to all the items before moving to the
+        next one, so traces are chosen in bulk and solved once for the items
+        sharing them.
+
+        :param items: List of items for constraints to apply on.
+        """
+        statuses = [{} for _ in items]
+        for constraint in self.constraints:
+            valid = [idx for idx, status in enumerate(statuses)
+                     if self._assumption_valid(constraint, status)]
+            results = constraint.apply_many([items[idx] for idx in valid])
+            for status in statuses:
+                status[constraint.name] = 'skipped'
+            for idx, result in zip(valid, results):
+                statuses[idx][constraint.name] = result
+
 
 class Constraint(object):
     """
@@ -120,7 +343,23 @@ class Constraint(object):
         self.require = require
         self.oracle = oracle
         self.fail_ratio = 0.1
-        self.traces = self._oracle2traces(oracle)
+        self.all_traces = self._oracle2traces(oracle)
+        for idx, t in enumerate(self.all_traces):
+            t.key = '%s:%d' % (name, idx)
+            t.name2path = self._name2path
+        self.traces = self._prune(self.all_traces)
+        if self.all_traces and not self.traces:
+            raise ConstraintError(
+                "All traces of oracle '%s' are unsatisfiable" % name)
+        # Paths of the options helper functions of the traces are called
+        # with, whichever trace is chosen
+        self.reads = set(self._name2path(name) for t in self.traces
+                         for name in t.call_args)
+        self.passes = [t for t in self.traces if t.result == 'success']
+        self.fails = [t for t in self.traces if t.result == 'fail']
+        self.trace_keys = dict((t.key, t) for t in self.traces)
+        self.selector = selector.UniformSelector()
+        self.coverage = None
 
     @classmethod
     def from_dict(cls, provider, data):
@@ -153,14 +392,24 @@ class Constraint(object):
 
             if isinstance(op, ast.Is):
                 rev_node.ops = [ast.IsNot()]
+            elif isinstance(op, ast.IsNot):
+                rev_node.ops = [ast.Is()]
             elif isinstance(op, ast.Gt):
                 rev_node.ops = [ast.LtE()]
+            elif isinstance(op, ast.GtE):
+                rev_node.ops = [ast.Lt()]
             elif isinstance(op, ast.Lt):
                 rev_node.ops = [ast.GtE()]
+            elif isinstance(op, ast.LtE):
+                rev_node.ops = [ast.Gt()]
             elif isinstance(op, ast.Eq):
                 rev_node.ops = [ast.NotEq()]
+            elif isinstance(op, ast.NotEq):
+                rev_node.ops = [ast.Eq()]
             elif isinstance(op, ast.In):
                 rev_node.ops = [ast.NotIn()]
+            elif isinstance(op, ast.NotIn):
+                rev_node.ops = [ast.In()]
             else:
                 raise ConstraintError('Unknown operator: %s' % op)
             return rev_node
@@ -210,7 +459,8 @@ class Constraint(object):
                     _parse_assert(node)
                 elif isinstance(node, ast.Return):
                     cur_trace.append(node)
-                    traces.append(trace.Trace(self.provider, cur_trace))
+                    traces.append(trace.Trace(self.provider, cur_trace,
+                                              path_prefix=self.path_prefix))
                     cur_trace.pop()
                 else:
                     raise ConstraintError(
@@ -223,7 +473,8 @@ class Constraint(object):
                 cur_trace.append(node.body[0].value)
                 ret = ast.parse('return success()').body[0]
                 cur_trace.append(ret)
-                traces.append(trace.Trace(self.provider, cur_trace))
+                traces.append(trace.Trace(self.provider, cur_trace,
+                                          path_prefix=self.path_prefix))
                 cur_trace.pop()
                 cur_trace.pop()
             else:
@@ -249,15 +500,40 @@ class Constraint(object):
                         'Unknown node type: %s' % v.__class__.__name__)
         return traces
 
+    @staticmethod
+    def _prune(traces):
+        """
+        Prepare the traces which don't call helper functions and drop those
+        unsatisfiable for any item, marking them as pruned.
+
+        :param traces: List of traces of the oracle.
+        :return: List of the satisfiable traces.
+        """
+        kept = []
+        for t in traces:
+            try:
+                t.prepare()
+            except trace.UnsatisfiableError as detail:
+                logger.warning('Pruned unsatisfiable trace %s: %s',
+                               t.key, detail)
+                t.pruned = True
+                continue
+            kept.append(t)
+        return kept
+
     def _choose(self, fail_ratio=None):
-        fails = []
-        passes = []
+        return self._choose_many(1, fail_ratio=fail_ratio)[0]
 
-        for t in self.traces:
-            if t.result == 'success':
-                passes.append(t)
-            elif t.result == 'fail':
-                fails.append(t)
+    def _choose_many(self, count, fail_ratio=None):
+        """
+        Choose traces for a number of items at once.
+
+        :param count: Number of traces to choose.
+        :param fail_ratio: Probability to choose a failing trace.
+        :return: A list of chosen traces.
+        """
+        fails = self.fails
+        passes = self.passes
 
         if fail_ratio is None:
             fail_ratio = self.fail_ratio
@@ -268,39 +544,196 @@ class Constraint(object):
                 self.name)
 
         if not fails:
-            return random.choice(passes)
+            fail_ratio = 0.0
         if not passes:
-            return random.choice(fails)
+            fail_ratio = 1.0
 
-        if random.random() < fail_ratio:
-            return random.choice(fails)
+        if numpy is not None and count > 1:
+            rolls = numpy.random.random(count).tolist()
         else:
-            return random.choice(passes)
-
-    def apply(self, item):
+            rolls = [random.random() for _ in range(count)]
+        is_fails = [roll < fail_ratio for roll in rolls]
+
+        fail_count = sum(is_fails)
+        chosen_fails = iter(self.selector.choose_many(fails, fail_count)
+                            if fail_count else [])
+        chosen_passes = iter(self.selector.choose_many(passes,
+                                                       count - fail_count)
+                             if count > fail_count else [])
+        chosen = [next(chosen_fails) if is_fail else next(chosen_passes)
+                  for is_fail in is_fails]
+        if self.coverage is not None:
+            for t in chosen:
+                self.coverage.select(t)
+        return chosen
+
+    def _solve(self, t, items):
         """
-        Apply this constraint to an item.
+        Solve a trace for items, counting failures and solving time.
 
-        :param item: The item to be applied on.
-        :return: Expected result of constraint item.
+        :return: A list of solutions, one for every item.
         """
-        def _name2path(name):
-            if not name.startswith(self.path_prefix):
-                return name
-            return name[len(self.path_prefix):].replace('_', '/')
-
-        t = self._choose()
-        sols = t.solve(item)
-        for name, sol in sols.items():
-            item.set(_name2path(name), sol)
+        start = time.time()
+        try:
+            if len(items) == 1:
+                return [t.solve(items[0])]
+            return t.solve_many(items)
+        except Exception:
+            if self.coverage is not None:
+                self.coverage.solve_failed(t)
+            raise
+        finally:
+            if self.coverage is not None:
+                self.coverage.add_solve_time(t, time.time() - start)
+
+    def reward(self, key, value):
+        """
+        Reward the trace chosen for an item with the outcome of the item.
 
+        :param key: Key of the trace.
+        :param value: Reward between 0 and 1.
+        """
+        t = self.trace_keys.get(key)
+        if t is not None:
+            self.selector.reward(t, value)
+
+    def _name2path(self, name):
+        if not name.startswith(self.path_prefix):
+            return name
+        return name[len(self.path_prefix):].replace('_', '/')
+
+    def _path2name(self, path):
+        if not path.startswith('/'):
+            return path
+        return self.path_prefix + path.replace('/', '_')
+
+    @staticmethod
+    def add_patts(item, t):
+        """
+        Add the expected failure patterns of a trace to an item.
+        """
         patts = t.result_patts
         if patts is not None:
             if isinstance(patts, list):
-                item.fail_patts |= patts
+                item.fail_patts |= set(patts)
             else:
                 item.fail_patts.add(patts)
+
+    def _assign(self, item, t, sols):
+        """
+        Set solved options and expected failure patterns of a trace to an
+        item.
+        """
+        paths = []
+        for name, sol in sols.items():
+            path = self._name2path(name)
+            item.set(path, sol)
+            paths.append(path)
+        item.traces.append(t.key)
+        item.solved[self.name] = (t.key, paths)
+        self.add_patts(item, t)
         return t.result
 
+    def perturb(self, item):
+        """
+        Perturb an option solved by this constraint for an item through its
+        symbol, keeping the trace chosen for the item.
+
+        :param item: The item this constraint was applied on.
+        :return: Path of the perturbed option, or None if no option was
+                 perturbed.
+        """
+        key, paths = item.solved.get(self.name, (None, ()))
+        t = self.trace_keys.get(key)
+        if t is None:
+            return None
+        values = dict((self._path2name(path), item.get(path))
+                      for path in paths)
+        try:
+            perturbed = t.mutate(item, values)
+        except trace.UnsatisfiableError:
+            return None
+        if perturbed is None:
+            return None
+        name, value = perturbed
+        path = self._name2path(name)
+        item.set(path, value)
+        return path
+
+    def apply(self, item):
+        """
+        Apply this constraint to an item.
+
+        :param item: The item to be applied on.
+        :return: Expected result of constraint item.
+        """
+        return self._apply_trace(item, self._choose())
+
+    def _apply_trace(self, item, chosen, tried=False):
+        """
+        Apply a chosen trace to an item. If it turns out unsatisfiable for
+        the item, fall back to the other traces with the same result in
+        random order, so the fail ratio holds as long as possible, then to
+        those with the other result.
+
+        :param item: The item to be applied on.
+        :param chosen: The chosen trace.
+        :param tried: Whether the chosen trace failed to be solved for the
+                      item already.
+        :return: Expected result of constraint item, or 'skipped' if no
+                 trace is satisfiable for the item.
+        """
+        if chosen.result == 'fail':
+            groups = [self.fails, self.passes]
+        else:
+            groups = [self.passes, self.fails]
+        order = [] if tried else [chosen]
+        for group in groups:
+            others = [t for t in group if t is not chosen]
+            order.extend(random.sample(others, len(others)))
+        for t in order:
+            try:
+                sols = self._solve(t, [item])[0]
+            except trace.UnsatisfiableError as detail:
+                logger.debug('Trace %s unsatisfiable: %s', t.key, detail)
+                continue
+            return self._assign(item, t, sols)
+        return 'skipped'
+
+    def apply_many(self, items):
+        """
+        Apply this constraint to a batch of items.
+
+        :param items: List of items to be applied on.
+        :return: List of expected results of the items.
+        """
+        if not items:
+            return []
+
+        groups = {}
+        for idx, t in enumerate(self._choose_many(len(items))):
+            groups.setdefault(t, []).append(idx)
+
+        results = [None] * len(items)
+        for t, idxs in groups.items():
+            group = [items[idx] for idx in idxs]
+            sols_list = None
+            if not t.item_dependent:
+                try:
+                    sols_list = self._solve(t, group)
+                except trace.UnsatisfiableError as detail:
+                    logger.debug('Trace %s unsatisfiable: %s', t.key, detail)
+            if sols_list is None:
+                # Item dependent traces may be unsatisfiable for some items
+                # only, so they are applied item by item. Item independent
+                # ones failed for all of them and aren't solved again.
+                tried = not t.item_dependent
+                for idx, item in zip(idxs, group):
+                    results[idx] = self._apply_trace(item, t, tried=tried)
+                continue
+            for idx, item, sols in zip(idxs, group, sols_list):
+                results[idx] = self._assign(item, t, sols)
+        return results
+
     def __repr__(self):
         return '<%s %s>' % (self.__class__.__name__, self.name)
@@ -0,0 +1,134 @@
+import array
+
+
+# Result categories of items counted for every trace. Categories unknown
+# here are counted as 'other'.
+OUTCOMES = ('success', 'failure', 'expected_neg', 'unexpected_neg',
+            'unexpected_pass', 'timeout', 'stalled', 'resource_outlier',
+            'oom', 'cpu_limit', 'fsize_limit', 'nproc_limit', 'skip', 'other')
+
+# Counters of every trace, in the order of the columns of the count array.
+COUNTERS = ('selected', 'solve_failures') + OUTCOMES
+
+
+class TraceCoverage(object):
+    """
+    Counters of how often every trace of the constraints of a provider is
+    chosen, fails to be solved and leads to each result category, with the
+    time spent solving it.
+
+    Counters are stored in a flat array of integers, a row for every trace
+    indexed by the trace ID, so counting is a single array increment.
+    Traces pruned at load time keep their rows, which are never counted.
+    """
+    def __init__(self, traces):
+        """
+        :param traces: List of all traces, whose ``id`` is their index.
+        """
+        self.traces = traces
+        self.width = len(COUNTERS)
+        self.columns = dict((name, idx) for idx, name in enumerate(COUNTERS))
+        self.counts = array.array('q', [0]) * (len(traces) * self.width)
+        self.solve_time = array.array('d', [0.0]) * len(traces)
+        self.ids = dict((t.key, t.id) for t in traces)
+
+    def _incr(self, t_id, counter, count=1):
+        self.counts[t_id * self.width + self.columns[counter]] += count
+
+    def select(self, t, count=1):
+        """
+        Count a trace chosen for items.
+        """
+        self._incr(t.id, 'selected', count)
+
+    def solve_failed(self, t):
+        """
+        Count a trace which failed to be solved.
+        """
+        self._incr(t.id, 'solve_failures')
+
+    def add_solve_time(self, t, seconds):
+        """
+        Add time spent solving a trace.
+        """
+        self.solve_time[t.id] += seconds
+
+    def record_outcome(self, keys, category):
+        """
+        Count the result category of an item for the traces chosen for it.
+
+        :param keys: Keys of the traces chosen for the item.
+        :param category: Result category of the item.
+        """
+        if category not in self.columns or category in ('selected',
+                                                        'solve_failures'):
+            category = 'other'
+        for key in keys:
+            t_id = self.ids.get(key)
+            if t_id is not None:
+                self._incr(t_id, category)
+
+    def get(self, t, counter):
+        """
+        Get a counter of a trace.
+        """
+        return self.counts[t.id * self.width + self.columns[counter]]
+
+    def serialize(self):
+        """
+        Serialize the counters into a JSON compatible dictionary.
+        """
+        traces = []
+        for t in self.traces:
+            start = t.id * self.width
+            traces.append({
+                'key': t.key,
+                'result': t.result,
+                'patterns': t.result_patts,
+                'pruned': t.pruned,
+                'counts': dict(zip(COUNTERS,
+                                   self.counts[start:start + self.width])),
+                'solve_time': self.solve_time[t.id],
+            })
+        return {'traces': traces}
+
+
+def report(coverages, unreached_only=False):
+    """
+    Format serialized trace coverages as a text report.
+
+    :param coverages: Dictionary of serialized TraceCoverage objects keyed by
+                      provider names.
+    :param unreached_only: Only report traces never chosen or never run,
+                           including those pruned as unsatisfiable.
+    :return: Text of the report.
+    """
+    lines = []
+    for name in sorted(coverages):
+        traces = coverages[name]['traces']
+        total_time = sum(t['solve_time'] for t in traces) or 1.0
+        lines.append('Provider %s: %d traces' % (name, len(traces)))
+        lines.append('%-24s %-8s %9s %7s %7s %6s  %s' % (
+            'trace', 'result', 'selected', 'unsat', 'run', 'time%',
+            'outcomes'))
+        for t in traces:
+            counts = t['counts']
+            run = sum(counts[outcome] for outcome in OUTCOMES)
+            if unreached_only and counts['selected'] and run:
+                continue
+            outcomes = ', '.join('%s=%d' % (outcome, counts[outcome])
+                                 for outcome in OUTCOMES if counts[outcome])
+            if t.get('pruned'):
+                outcomes = 'PRUNED'
+            elif not counts['selected']:
+                outcomes = 'UNREACHED'
+            elif not run:
+                outcomes = 'NEVER RUN'
+            if t['patterns']:
+                outcomes += '  [%s]' % t['patterns']
+            lines.append('%-24s %-8s %9d %7d %7d %6.1f  %s' % (
+                t['key'], t['result'], counts['selected'],
+                counts['solve_failures'], run,
+                100.0 * t['solve_time'] / total_time, outcomes))
+        lines.append('')
+    return '\n'.join(lines)
@@ -1,3 +1,11 @@
+import json
+
+from .. import utils
+from ..utils import payload
+from ..utils import persistent
+from ..utils import pyexec
+
+
 class ItemError(Exception):
     """
     Class for Item specific exceptions.
@@ -9,10 +17,53 @@ class ItemBase(object):
     """
     Base class for an item. This should be overridden in the providers item.py.
     """
+    # Delivery modes of options passed as payloads instead of command line
+    # arguments by argv(), keyed by option paths. See utils.payload.Payload.
+    payloads = {}
+    # Seconds after which running the item is given up. Adjusted for every
+    # item when adaptive timeouts are enabled.
+    timeout = 10
+    # Seconds without any progress of the processes of the item after which
+    # they are killed as stalled. None to wait for the timeout.
+    stall_window = None
+    # Resource limits applied to the processes of the item, see
+    # utils.rlimits.RESOURCES.
+    limits = None
+
     def __init__(self, provider):
         self.provider = provider
         self.res = ''
         self.fail_patts = set()
+        self.options = {}
+        self.traces = []
+        # Trace key and option paths solved by every constraint applied,
+        # keyed by constraint names
+        self.solved = {}
+
+    def __getattr__(self, name):
+        # Options used to be stored as attributes, which providers may
+        # still read them as
+        options = self.__dict__.get('options')
+        if options is not None and name in options:
+            return options[name]
+        raise AttributeError("'%s' object has no attribute '%s'" %
+                             (self.__class__.__name__, name))
+
+    def clone(self):
+        """
+        Copy the options and the constraint results of the item into a new
+        item of the same provider, which has not run.
+
+        :return: The new item.
+        """
+        item = self.__class__(provider=self.provider)
+        item.options = dict(
+            (path, list(value) if isinstance(value, list) else value)
+            for path, value in self.options.items())
+        item.fail_patts = set(self.fail_patts)
+        item.traces = list(self.traces)
+        item.solved = dict(self.solved)
+        return item
 
     def run(self):
         """
@@ -21,6 +72,19 @@ class ItemBase(object):
         raise NotImplementedError("run() not implemented for class '%s'" %
                                   self.__class__.__name__)
 
+    def execute(self, cmdline, **kwargs):
+        """
+        Run a command for the item with its timeout, stall window and
+        resource limits.
+
+        :param cmdline: Command line string or argument list, see utils.run().
+        :return: CmdResult of the command.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs.setdefault('stall_window', self.stall_window)
+        kwargs.setdefault('limits', self.limits)
+        return utils.run(cmdline, **kwargs)
+
     def set(self, path, value):
         """
         Set value for specific item option.
@@ -28,7 +92,7 @@ class ItemBase(object):
         :param path: An XPath-like string for the setting target.
         :param value: Option value to be set.
         """
-        setattr(self, path, value)
+        self.options[path] = value
 
     def get(self, path):
         """
@@ -37,4 +101,152 @@ class ItemBase(object):
         :param path: An XPath-like string for the getting target.
         :return: Option value got.
         """
-        return getattr(self, path, None)
+        return self.options.get(path)
+
+    def argv(self, program, args=(), opts=()):
+        """
+        Build an argument list running a program with options of the item,
+        to be passed to utils.run() without any shell quoting.
+
+        :param program: Path of the program to run.
+        :param args: Paths of options passed as positional arguments.
+        :param opts: Pairs of command line flag and path of option passed
+                     after the flag. Flags of None or False options are
+                     omitted and flags of True options are passed alone. A
+                     list option repeats the flag for each entry.
+        :return: A list of the program and its arguments. Options listed in
+                 ``payloads`` are put as Payload objects.
+        """
+        def _arg(path, value):
+            if path in self.payloads:
+                return payload.Payload(value, mode=self.payloads[path])
+            return str(value)
+
+        argv = [program]
+        for flag, path in opts:
+            value = self.get(path)
+            if value is None or value is False:
+                continue
+            if value is True:
+                argv.append(flag)
+            elif isinstance(value, (list, tuple)):
+                for entry in value:
+                    argv.extend([flag, str(entry)])
+            else:
+                argv.extend([flag, _arg(path, value)])
+        for path in args:
+            value = self.get(path)
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple)):
+                argv.extend(str(entry) for entry in value)
+            else:
+                argv.append(_arg(path, value))
+        return argv
+
+    def serialize(self):
+        """
+        Serialize the item into a JSON compatible dictionary.
+
+        :return: A dictionary contains options, expected failure patterns and
+                 the result of the item if it has run.
+        """
+        data = {
+            'provider': self.provider.name,
+            'options': dict(self.options),
+            'fail_patts': sorted(self.fail_patts),
+        }
+        if self.res:
+            data['result'] = self.res.serialize()
+        return data
+
+    @staticmethod
+    def deserialize(provider, data):
+        """
+        Create an item from a serialized one. Its result is not restored, so
+        it has to run again.
+
+        :param provider: Provider of the item.
+        :param data: A dictionary returned by serialize().
+        :return: The item, of the item class of the provider.
+        """
+        item = provider.Item(provider=provider)
+        item.options = dict(data.get('options', {}))
+        item.fail_patts = set(data.get('fail_patts', ()))
+        return item
+
+    def save(self, path):
+        """
+        Save the serialized item to a JSON file.
+
+        :param path: Path of the file to save to.
+        """
+        with open(path, 'w') as fp:
+            json.dump(self.serialize(), fp, indent=4, sort_keys=True)
+
+
+class PersistentItemBase(ItemBase):
+    """
+    Base class for an item run by a persistent target process, which
+    receives one input per item on its standard input instead of being
+    spawned for every item. See utils.persistent.PersistentProcess for the
+    protocols.
+    """
+    protocol = 'line'
+
+    def target_argv(self):
+        """
+        Argument list to start the persistent target. Must be overridden in
+        the providers.
+        """
+        raise NotImplementedError(
+            "target_argv() not implemented for class '%s'" %
+            self.__class__.__name__)
+
+    def encode(self):
+        """
+        Encode the item into an input of the target. Default to the options
+        of the item as a line of JSON. Inputs containing newlines fail
+        with the line protocol.
+
+        :return: Input bytes.
+        """
+        return json.dumps(self.options, sort_keys=True).encode('utf-8')
+
+    def run(self):
+        """
+        Send the item to the persistent target of the current thread.
+        """
+        argv = self.target_argv()
+        process = persistent.get_process(
+            (self.__class__, tuple(argv)), argv, protocol=self.protocol)
+        self.res = process.request(self.encode(), timeout=self.timeout)
+
+
+class PythonItemBase(ItemBase):
+    """
+    Base class for an item testing a Python function directly instead of a
+    command line wrapper. The function is called in a recycled worker
+    process of utils.pyexec, which saves the interpreter startup for every
+    item while keeping crashes and leaks of the tested code out of DICE.
+    """
+
+    def target(self):
+        """
+        Function to test with its arguments. Must be overridden in the
+        providers.
+
+        :return: A tuple of the function, a list of positional arguments and
+                 a dictionary of keyword arguments.
+        """
+        raise NotImplementedError(
+            "target() not implemented for class '%s'" %
+            self.__class__.__name__)
+
+    def run(self):
+        """
+        Call the target function in the worker pool.
+        """
+        func, args, kwargs = self.target()
+        self.res = pyexec.get_pool().call(func, args, kwargs,
+                                          timeout=self.timeout)
@@ -6,6 +6,7 @@ import logging
 import os
 
 from . import constraint
+from . import symbol
 
 logger = logging.getLogger('dice')
 
@@ -77,6 +78,17 @@ class Provider(object):
                 raise ProviderError("Module %s doesn't has class %s" %
                                     (mod_name, cls_name))
 
+        self.symbols = dict(symbol.SYMBOLS)
+        for mod_name, mod in self.modules.items():
+            for obj in vars(mod).values():
+                if (inspect.isclass(obj) and
+                        issubclass(obj, symbol.SymbolBase) and
+                        obj.__module__ == mod_name):
+                    try:
+                        symbol.register(obj, registry=self.symbols)
+                    except symbol.SymbolError as detail:
+                        raise ProviderError(str(detail))
+
         self.Item = self.modules['%s.item' % root_ns].Item
         self.constraint_manager = constraint.ConstraintManager(self)
 
@@ -89,3 +101,35 @@ class Provider(object):
         item = self.Item(provider=self)
         self.constraint_manager.constrain(item)
         return item
+
+    def mutate(self, parent):
+        """
+        Generate a variant of an item, re-solving or perturbing the options
+        of a few constraints and keeping the others.
+
+        :param parent: Item of this provider to make a variant of.
+        :return: Mutated item.
+        """
+        item = parent.clone()
+        self.constraint_manager.mutate(item)
+        return item
+
+    def generate_many(self, count=None, batch_size=64):
+        """
+        Generate constrained test items in batches.
+
+        Items of a batch are constrained together, which amortizes trace
+        choosing and solving over the batch.
+
+        :param count: Number of items to generate. Generate endlessly if None.
+        :param batch_size: Number of items constrained together.
+        :return: An iterator of constrained items.
+        """
+        while count is None or count > 0:
+            size = batch_size if count is None else min(count, batch_size)
+            items = [self.Item(provider=self) for _ in range(size)]
+            self.constraint_manager.constrain_many(items)
+            for item in items:
+                yield item
+            if count is not None:
+                count -= size
@@ -0,0 +1,133 @@
+import math
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class SelectorError(Exception):
+    """
+    Class for trace selector specific exceptions.
+    """
+    pass
+
+
+class SelectorBase(object):
+    """
+    Base class choosing among arms, the traces of a constraint, and learning
+    from rewards of the arms chosen.
+    """
+    def __init__(self):
+        self.pulls = {}
+        self.rewards = {}
+
+    def choose_many(self, arms, count):
+        """
+        Choose arms for a number of items at once.
+
+        :param arms: List of arms to choose among.
+        :param count: Number of arms to choose.
+        :return: A list of chosen arms.
+        """
+        raise NotImplementedError
+
+    def reward(self, arm, value):
+        """
+        Reward a chosen arm with the outcome of its item.
+
+        :param arm: The chosen arm.
+        :param value: Reward between 0 and 1.
+        """
+        self.pulls[arm] = self.pulls.get(arm, 0) + 1
+        self.rewards[arm] = self.rewards.get(arm, 0.0) + value
+
+
+class UniformSelector(SelectorBase):
+    """
+    Choose arms uniformly at random, ignoring rewards.
+    """
+    def choose_many(self, arms, count):
+        if numpy is not None and count > 1:
+            return [arms[idx] for idx in
+                    numpy.random.randint(len(arms), size=count).tolist()]
+        return [random.choice(arms) for _ in range(count)]
+
+
+class UCBSelector(SelectorBase):
+    """
+    Choose arms by the UCB1 upper confidence bound of their mean reward,
+    trying every arm once first.
+    """
+    def __init__(self, exploration=math.sqrt(2)):
+        """
+        :param exploration: Weight of the confidence term.
+        """
+        super(UCBSelector, self).__init__()
+        self.exploration = exploration
+
+    def choose_many(self, arms, count):
+        # Arms chosen in this batch count as pulled without reward, so a
+        # batch doesn't pile up on a single arm
+        pending = dict.fromkeys(arms, 0)
+        total = sum(self.pulls.get(arm, 0) for arm in arms)
+        chosen = []
+        for _ in range(count):
+            best = None
+            best_score = None
+            log_total = math.log(max(total, 1))
+            for arm in arms:
+                pulls = self.pulls.get(arm, 0) + pending[arm]
+                if not pulls:
+                    best = arm
+                    break
+                score = (self.rewards.get(arm, 0.0) / pulls +
+                         self.exploration * math.sqrt(log_total / pulls))
+                if best_score is None or score > best_score:
+                    best, best_score = arm, score
+            pending[best] += 1
+            total += 1
+            chosen.append(best)
+        return chosen
+
+
+class ThompsonSelector(SelectorBase):
+    """
+    Choose arms by Thompson sampling of a beta distribution of their reward
+    rate.
+    """
+    def choose_many(self, arms, count):
+        alphas = [1.0 + self.rewards.get(arm, 0.0) for arm in arms]
+        betas = [1.0 + self.pulls.get(arm, 0) - self.rewards.get(arm, 0.0)
+                 for arm in arms]
+        if numpy is not None and count > 1:
+            samples = numpy.random.beta(
+                numpy.array(alphas)[:, None], numpy.array(betas)[:, None],
+                size=(len(arms), count))
+            return [arms[idx] for idx in samples.argmax(axis=0).tolist()]
+        chosen = []
+        for _ in range(count):
+            samples = [random.betavariate(alpha, beta)
+                       for alpha, beta in zip(alphas, betas)]
+            chosen.append(arms[samples.index(max(samples))])
+        return chosen
+
+
+SELECTORS = {
+    'uniform': UniformSelector,
+    'ucb': UCBSelector,
+    'thompson': ThompsonSelector,
+}
+
+
+def create(name):
+    """
+    Create a trace selector by name.
+
+    :param name: One of the names in SELECTORS.
+    :return: A selector object.
+    """
+    if name not in SELECTORS:
+        raise SelectorError("Unknown trace selector '%s'" % name)
+    return SELECTORS[name]()
@@ -0,0 +1,260 @@
+import copy
+import operator
+
+from . import symbol
+
+
+class SolverError(Exception):
+    """
+    Class for relation solver specific exceptions.
+    """
+    pass
+
+
+class NoSolutionError(SolverError):
+    """
+    Exception raised when no values satisfy the relations between symbols.
+    """
+    pass
+
+
+# Relation operators, with Gt and GtE normalized to Lt and LtE by swapping
+# the operands.
+OPERATORS = {
+    'Lt': operator.lt,
+    'LtE': operator.le,
+    'Eq': operator.eq,
+    'NotEq': operator.ne,
+    'In': lambda left, right: left in right,
+    'NotIn': lambda left, right: left not in right,
+}
+
+SWAPPED = {
+    'Gt': 'Lt',
+    'GtE': 'LtE',
+}
+
+
+def normalize(left, op, right):
+    """
+    Normalize a relation between two symbols.
+
+    :param left: Name of the left symbol.
+    :param op: Operator name of the relation.
+    :param right: Name of the right symbol.
+    :return: A tuple of the left name, operator name and right name.
+    """
+    if op in SWAPPED:
+        return right, SWAPPED[op], left
+    if op not in OPERATORS:
+        raise SolverError('Unsupported relation operator: %s' % op)
+    return left, op, right
+
+
+def _holds(relation, values):
+    left, op, right = relation
+    try:
+        return OPERATORS[op](values[left], values[right])
+    except TypeError:
+        return False
+
+
+def _narrow_bounds(left, op, right):
+    """
+    Narrow the bounds of two integers by an ordering or equality relation.
+
+    :return: Whether a bound changed.
+    """
+    before = (left.minimum, left.maximum, right.minimum, right.maximum)
+    gap = 1 if op == 'Lt' else 0
+    if op in ('Lt', 'LtE'):
+        if left.minimum is not None:
+            right.narrow(minimum=left.minimum + gap)
+        if right.maximum is not None:
+            left.narrow(maximum=right.maximum - gap)
+    elif op == 'Eq':
+        left.narrow(right.minimum, right.maximum)
+        right.narrow(left.minimum, left.maximum)
+    after = (left.minimum, left.maximum, right.minimum, right.maximum)
+    return before != after
+
+
+def _strict_cycle(relations):
+    """
+    Check whether ordering relations form a cycle with a strict step, like
+    a < b <= a, which no values satisfy whatever their domains.
+    """
+    # Whether the right name is reachable from the left one, and through a
+    # strict step
+    reach = {}
+    for left, op, right in relations:
+        if op in ('Lt', 'LtE', 'Eq'):
+            reach[(left, right)] = reach.get((left, right), False) or \
+                op == 'Lt'
+        if op == 'Eq':
+            reach.setdefault((right, left), False)
+    names = set(name for pair in reach for name in pair)
+    for mid in names:
+        for left in names:
+            for right in names:
+                if (left, mid) in reach and (mid, right) in reach:
+                    reach[(left, right)] = (reach.get((left, right), False) or
+                                            reach[(left, mid)] or
+                                            reach[(mid, right)])
+    return any(reach.get((name, name)) for name in names)
+
+
+def propagate(symbols, relations, rounds=100):
+    """
+    Narrow the domains of symbols by their relations until nothing changes,
+    so sampling rarely has to backtrack.
+
+    Integer bounds are propagated along ordering and equality relations and
+    scopes are intersected along equality relations. Cycles of strict
+    orderings are rejected upfront. The number of rounds is limited as
+    bounds may keep moving along long chains, and the remaining
+    inconsistencies are left to sampling.
+
+    :param symbols: Dictionary of symbols keyed by names.
+    :param relations: List of normalized relations.
+    :param rounds: Maximum number of propagation rounds.
+    :raise NoSolutionError: If a domain becomes empty.
+    """
+    if _strict_cycle(relations):
+        raise NoSolutionError('Cyclic strict ordering in relations %s' %
+                              relations)
+    for _ in range(rounds):
+        changed = False
+        for left, op, right in relations:
+            sleft, sright = symbols[left], symbols[right]
+            if (isinstance(sleft, symbol.Integer) and
+                    isinstance(sright, symbol.Integer)):
+                changed |= _narrow_bounds(sleft, op, sright)
+            if (op == 'Eq' and sleft.scope is not None and
+                    sright.scope is not None):
+                scope = [val for val in sleft.scope if val in sright.scope]
+                if len(scope) < len(sleft.scope) or \
+                        len(scope) < len(sright.scope):
+                    sleft.scope = scope
+                    sright.scope = scope[:]
+                    changed = True
+        for name, sym in symbols.items():
+            if not sym.reduce():
+                raise NoSolutionError(
+                    'No value of %s satisfies relations %s' %
+                    (name, relations))
+        if not changed:
+            break
+
+
+def _restrict(sym, relations, name, values):
+    """
+    Copy a symbol restricted by its relations to the symbols sampled
+    already.
+
+    :return: The restricted symbol and a list of relations to enforce on
+             the sampled value.
+    """
+    restricted = copy.copy(sym)
+    fixups = []
+    for relation in relations:
+        left, op, right = relation
+        if left == name and right in values:
+            other, own_left = values[right], True
+        elif right == name and left in values:
+            other, own_left = values[left], False
+        else:
+            continue
+
+        if op in ('Lt', 'LtE') and isinstance(restricted, symbol.Integer):
+            gap = 1 if op == 'Lt' else 0
+            if own_left:
+                restricted.narrow(maximum=other - gap)
+            else:
+                restricted.narrow(minimum=other + gap)
+        elif op == 'Eq':
+            if restricted.scope is None or other in restricted.scope:
+                restricted.scope = [other]
+            else:
+                restricted.scope = []
+        elif op == 'NotEq':
+            restricted.excs = list(restricted.excs or []) + [other]
+        elif op == 'In' and own_left and isinstance(other, (list, tuple)):
+            scope = restricted.scope
+            restricted.scope = [val for val in other
+                                if scope is None or val in scope]
+        elif op == 'NotIn' and own_left and isinstance(other, (list, tuple)):
+            restricted.excs = list(restricted.excs or []) + list(other)
+        elif op in ('In', 'NotIn') and not own_left:
+            fixups.append((op, other))
+    return restricted, fixups
+
+
+def _fixup(value, fixups):
+    """
+    Add or remove the values a sampled list must or must not contain.
+    """
+    if not isinstance(value, list):
+        return value
+    for op, other in fixups:
+        if op == 'In' and other not in value:
+            value.append(other)
+        elif op == 'NotIn':
+            value = [val for val in value if val != other]
+    return value
+
+
+def solve(symbols, relations, retries=10, budget=1000):
+    """
+    Sample values of related symbols one after another, restricting the
+    domain of each by the values sampled before and backtracking on dead
+    ends.
+
+    :param symbols: Dictionary of symbols keyed by names.
+    :param relations: List of normalized relations.
+    :param retries: Samples of a symbol tried before backtracking.
+    :param budget: Total samples tried before giving up.
+    :return: Dictionary of the values of the related symbols.
+    :raise NoSolutionError: If no solution is found within the budget.
+    """
+    names = []
+    for left, _, right in relations:
+        for name in (left, right):
+            if name not in names:
+                names.append(name)
+
+    values = {}
+    attempts = [0] * len(names)
+    idx = 0
+    while idx < len(names):
+        if budget <= 0:
+            raise NoSolutionError(
+                'No solution found for relations %s' % relations)
+        budget -= 1
+
+        name = names[idx]
+        restricted, fixups = _restrict(symbols[name], relations, name,
+                                       values)
+        try:
+            values[name] = _fixup(restricted.model(), fixups)
+        except symbol.EmptyDomainError:
+            # Resampling an empty domain is pointless
+            attempts[idx] = retries
+        else:
+            if all(_holds(relation, values) for relation in relations
+                   if name in (relation[0], relation[2]) and
+                   relation[0] in values and relation[2] in values):
+                attempts[idx] = 0
+                idx += 1
+                continue
+            del values[name]
+            attempts[idx] += 1
+
+        if attempts[idx] >= retries:
+            if idx == 0:
+                raise NoSolutionError(
+                    'No solution found for relations %s' % relations)
+            attempts[idx] = 0
+            idx -= 1
+            del values[names[idx]]
+    return values
@@ -1,7 +1,29 @@
+import bisect
+import inspect
+import math
 import os
 import random
 import string
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class SymbolError(Exception):
+    """
+    Class for symbol specific exceptions.
+    """
+    pass
+
+
+class EmptyDomainError(SymbolError):
+    """
+    Exception raised when no value satisfies a symbol.
+    """
+    pass
+
 
 class SymbolBase(object):
     """
@@ -18,6 +40,7 @@ class SymbolBase(object):
         self.scope = scope
         self.excs = excs
         self.exc_types = exc_types
+        self._compiled = None
 
     def generate(self):
         """
@@ -27,34 +50,129 @@ class SymbolBase(object):
         raise NotImplementedError("Method 'generate' not implemented for %s" %
                                   self.__class__.__name__)
 
+    def _exclusions(self):
+        if not self.excs:
+            return frozenset()
+        try:
+            return frozenset(self.excs)
+        except TypeError:
+            return self.excs
+
+    def _domain_key(self):
+        return (id(self.scope), len(self.scope) if self.scope else 0,
+                id(self.excs), len(self.excs) if self.excs else 0)
+
+    def _compile(self):
+        excs = self._exclusions()
+        if self.scope is None:
+            return None, excs
+        return [val for val in self.scope if val not in excs], excs
+
+    def domain(self):
+        """
+        Get the domain of this symbol, computed once for its current scope
+        and exclusions.
+
+        :return: A tuple of the list of values in the scope but not
+                 excluded, or None if values are generated, and the
+                 exclusions.
+        """
+        key = self._domain_key()
+        if self._compiled is None or self._compiled[0] != key:
+            self._compiled = (key, self._compile())
+        return self._compiled[1]
+
+    def _empty(self):
+        return EmptyDomainError(
+            'No value of %s in scope %s satisfies exclusions %s' %
+            (self.__class__.__name__, self.scope, self.excs))
+
     def model(self):
         """
         Generate a random instance of this symbol.
+
+        :raise EmptyDomainError: If no value satisfies this symbol.
         """
-        if self.scope is None:
+        values, excs = self.domain()
+        if values is None:
+            # Exclusions are finite and generated values aren't, so
+            # resampling soon ends
             res = self.generate()
-            if self.excs is not None:
-                while res in self.excs:
-                    res = self.generate()
-            return res
-        else:
-            res = random.choice(self.scope)
-            if self.excs is not None:
-                while res in self.excs:
-                    res = random.choice(self.scope)
+            while res in excs:
+                res = self.generate()
             return res
+        if not values:
+            raise self._empty()
+        return random.choice(values)
+
+    def model_many(self, count):
+        """
+        Generate a number of random instances of this symbol.
+
+        :param count: Number of instances to generate.
+        :return: A list of generated instances.
+        """
+        return [self.model() for _ in range(count)]
+
+    def mutate(self, value):
+        """
+        Generate a random instance of this symbol close to a value. Default
+        to a new random instance.
+
+        :param value: Value to perturb.
+        """
+        return self.model()
+
+    def reduce(self):
+        """
+        Compute the domain of this symbol ahead of sampling.
+
+        :return: False if no value satisfies this symbol.
+        """
+        values = self.domain()[0]
+        return values is None or bool(values)
+
+
+def _mutate_text(text, alphabet):
+    """
+    Insert, delete or replace a random character of a string.
+    """
+    pos = random.randint(0, len(text))
+    action = random.choice(('insert', 'delete', 'replace'))
+    if action == 'insert' or pos == len(text):
+        return text[:pos] + random.choice(alphabet) + text[pos:]
+    if action == 'delete':
+        return text[:pos] + text[pos + 1:]
+    return text[:pos] + random.choice(alphabet) + text[pos + 1:]
 
 
 class Bytes(SymbolBase):
     """
     Symbol class for a string contains random bytes (1~255).
     """
+    alphabet = ''.join(chr(code) for code in range(1, 256))
+
+    def mutate(self, value):
+        """
+        Insert, delete or replace a character of a string, or generate a new
+        one if values are limited to a scope.
+
+        :param value: Value to perturb.
+        """
+        values, excs = self.domain()
+        if values is not None or not isinstance(value, str):
+            return self.model()
+        res = _mutate_text(value, self.alphabet)
+        if res in excs:
+            return self.model()
+        return res
+
     def generate(self):
         """
         Generate a random bytes string.
         """
         cnt = int(random.weibullvariate(65535, 1))
-        return ''.join(bt for bt in os.urandom(cnt) if bt != b'\x00')
+        return os.urandom(cnt).replace(b'\x00', b'').decode('latin-1')
 
 
 class NonEmptyBytes(Bytes):
@@ -66,13 +184,21 @@ class NonEmptyBytes(Bytes):
         Generate a random non-empty bytes string.
         """
         cnt = int(random.weibullvariate(65535, 1)) + 1
-        return ''.join(bt for bt in os.urandom(cnt) if bt != b'\x00')
+        return os.urandom(cnt).replace(b'\x00', b'').decode('latin-1')
+
+    def mutate(self, value):
+        res = super(NonEmptyBytes, self).mutate(value)
+        if not res:
+            return self.model()
+        return res
 
 
 class String(Bytes):
     """
     Symbol class for a random printable string.
     """
+    alphabet = string.printable
+
     def generate(self):
         """
         Generate a random printable string.
@@ -119,6 +245,24 @@ class StringList(SymbolBase):
                 res.add(entry)
         return list(res)
 
+    def mutate(self, value):
+        """
+        Add or remove a random entry of a list.
+
+        :param value: Value to perturb.
+        """
+        if not isinstance(value, list):
+            return self.model()
+        res = list(value)
+        if res and random.random() < 0.5:
+            del res[random.randrange(len(res))]
+            return res
+        scopes = [scope for scope, _, _ in self.scopes if scope]
+        entry = random.choice(scopes[-1]) if scopes else self.generate()
+        if entry and entry not in res:
+            res.append(entry)
+        return res
+
 
 class Integer(SymbolBase):
     """
@@ -146,24 +290,243 @@ class Integer(SymbolBase):
             minimum = '-Inf'
         return '<%s %s~%s>' % (self.__class__.__name__, minimum, maximum)
 
+    scale = 50.0
+
+    def narrow(self, minimum=None, maximum=None):
+        """
+        Intersect the bounds of this integer with new ones.
+
+        :param minimum: New inclusive lower bound, or None.
+        :param maximum: New inclusive upper bound, or None.
+        """
+        if minimum is not None and (self.minimum is None or
+                                    minimum > self.minimum):
+            self.minimum = minimum
+        if maximum is not None and (self.maximum is None or
+                                    maximum < self.maximum):
+            self.maximum = maximum
+
+    def _in_bounds(self, val):
+        if not isinstance(val, int):
+            return True
+        if self.minimum is not None and val < self.minimum:
+            return False
+        if self.maximum is not None and val > self.maximum:
+            return False
+        return True
+
+    def _intervals(self, excs=()):
+        """
+        Split the bounds into disjoint intervals around excluded integers.
+
+        :return: A sorted list of inclusive (low, high) intervals, where
+                 None stands for an unbounded end.
+        """
+        if (self.minimum is not None and self.maximum is not None and
+                self.minimum > self.maximum):
+            return []
+        intervals = [(self.minimum, self.maximum)]
+        for exc in sorted(val for val in excs
+                          if isinstance(val, int) and self._in_bounds(val)):
+            # Exclusions are sorted, so they fall in the last interval
+            low, high = intervals.pop()
+            if low is None or exc > low:
+                intervals.append((low, exc - 1))
+            if high is None or exc < high:
+                intervals.append((exc + 1, high))
+            if not intervals:
+                break
+        return intervals
+
+    def _parts(self, intervals):
+        """
+        Split intervals by sign into ranges of the magnitude 2 ** E - 1 of
+        generated integers, where E follows an exponential distribution,
+        weighted by their probabilities.
+
+        :return: A list of (sign, low, high, cdf_low, cdf_high) tuples and
+                 a list of cumulated probabilities.
+        """
+        parts = []
+        for low, high in intervals:
+            if high is None or high >= 0:
+                parts.append((1, max(low, 0) if low is not None else 0, high))
+            if low is None or low <= 0:
+                parts.append((-1, max(-high, 0) if high is not None else 0,
+                              -low if low is not None else None))
+
+        weighted = []
+        cumulated = []
+        total = 0.0
+        for sign, low, high in parts:
+            # Tail probabilities of E at the bounds of the magnitude, where
+            # magnitudes in [low, high] are drawn from E in
+            # [log2(low + 1), log2(high + 2))
+            cdf_low = math.exp(-math.log2(low + 1) / self.scale)
+            cdf_high = 0.0
+            if high is not None:
+                cdf_high = math.exp(-math.log2(high + 2) / self.scale)
+            weighted.append((sign, low, high, cdf_low, cdf_high))
+            total += cdf_low - cdf_high
+            cumulated.append(total)
+        return weighted, cumulated
+
+    def _draw(self, part, uniform):
+        sign, low, high, cdf_low, cdf_high = part
+        tail = cdf_low - uniform * (cdf_low - cdf_high)
+        # Beyond 2 ** 1023 magnitudes overflow floats
+        exponent = (-self.scale * math.log(tail) if tail > 0 else 1023.0)
+        magnitude = int(2.0 ** min(exponent, 1023.0) - 1.0)
+        # Correct float rounding at the bounds
+        magnitude = max(magnitude, low)
+        if high is not None:
+            magnitude = min(magnitude, high)
+        return sign * magnitude
+
+    def _sample(self, parts, cumulated):
+        if not parts:
+            raise self._empty()
+        if not cumulated[-1]:
+            # Too far from zero for any probability, take the closest value
+            sign, low = parts[0][:2]
+            return sign * low
+        idx = bisect.bisect_right(cumulated, random.random() * cumulated[-1])
+        return self._draw(parts[min(idx, len(parts) - 1)], random.random())
+
+    def _domain_key(self):
+        return (super(Integer, self)._domain_key() +
+                (self.minimum, self.maximum))
+
+    def _compile(self):
+        excs = self._exclusions()
+        if self.scope is not None:
+            values = [val for val in self.scope
+                      if self._in_bounds(val) and val not in excs]
+            return values, excs, None
+        return None, excs, self._parts(self._intervals(excs))
+
+    def _empty(self):
+        return EmptyDomainError(
+            'No integer in %s satisfies exclusions %s' % (self, self.excs))
+
     def generate(self):
         """
-        Generate a random integer.
-        """
-        scale = 50.0
-        maximum = self.maximum
-        minimum = self.minimum
-        while True:
-            sign = 1.0 if random.random() > 0.5 else -1.0
-            res = sign * (2.0 ** (random.expovariate(1.0 / scale)) - 1.0)
-            if maximum is not None:
-                if maximum >= 0 and res > maximum + 1:
-                    continue
-                if maximum < 0 and res > maximum:
-                    continue
-            if minimum is not None:
-                if minimum >= 0 and res < minimum:
-                    continue
-                if minimum < 0 and res < minimum - 1:
-                    continue
-            return int(res)
+        Generate a random integer within the bounds.
+        """
+        return self._sample(*self._parts(self._intervals()))
+
+    def model(self):
+        """
+        Generate a random integer within the bounds and not excluded, with a
+        single draw from the precomputed intervals.
+
+        :raise EmptyDomainError: If no integer satisfies this symbol.
+        """
+        values, _, parts = self.domain()
+        if values is not None:
+            if not values:
+                raise self._empty()
+            return random.choice(values)
+        return self._sample(*parts)
+
+    def mutate(self, value):
+        """
+        Move an integer by a small random step or onto a bound, keeping it
+        within the bounds and not excluded.
+
+        :param value: Value to perturb.
+        """
+        values, excs, _ = self.domain()
+        if values is not None or not isinstance(value, int):
+            return self.model()
+        bounds = [bound for bound in (self.minimum, self.maximum)
+                  if bound is not None]
+        if bounds and random.random() < 0.2:
+            # Values around bounds are the most likely to be mishandled
+            res = random.choice(bounds) + random.choice((-1, 0, 1))
+        else:
+            step = int(2 ** random.expovariate(0.25))
+            res = value + random.choice((-1, 1)) * step
+        if not self._in_bounds(res) or res in excs:
+            return self.model()
+        return res
+
+    def model_many(self, count):
+        """
+        Generate a number of random integers, vectorized with NumPy if
+        available.
+
+        :param count: Number of integers to generate.
+        :return: A list of generated integers.
+        """
+        values, _, parts = self.domain()
+        if numpy is None or values is not None:
+            return super(Integer, self).model_many(count)
+        parts, cumulated = parts
+        if not parts:
+            raise self._empty()
+        if not cumulated[-1]:
+            return [self._sample(parts, cumulated)] * count
+
+        weights = numpy.diff(numpy.array([0.0] + cumulated))
+        idxs = numpy.random.choice(len(parts), size=count,
+                                   p=weights / weights.sum())
+        cdf_low = numpy.array([part[3] for part in parts])[idxs]
+        cdf_high = numpy.array([part[4] for part in parts])[idxs]
+        tails = cdf_low - numpy.random.random(count) * (cdf_low - cdf_high)
+        with numpy.errstate(divide='ignore'):
+            exponents = numpy.minimum(-self.scale * numpy.log(tails), 1023.0)
+        magnitudes = numpy.exp2(exponents) - 1.0
+
+        results = []
+        for idx, magnitude in zip(idxs.tolist(), magnitudes.tolist()):
+            sign, low, high = parts[idx][:3]
+            magnitude = max(int(magnitude), low)
+            if high is not None:
+                magnitude = min(magnitude, high)
+            results.append(sign * magnitude)
+        return results
+
+    def reduce(self):
+        """
+        Compute the intervals of this integer ahead of sampling.
+
+        :return: False if no integer satisfies this symbol.
+        """
+        values, _, parts = self.domain()
+        if values is not None:
+            return bool(values)
+        return bool(parts[0])
+
+
+# Symbol classes usable in oracles, keyed by their names. Providers copy it
+# and add the symbol classes defined in their utils modules.
+SYMBOLS = {}
+
+
+def register(cls, name=None, registry=None):
+    """
+    Register a symbol class under a name, so oracles can compare options
+    with it like ``/path is Name``. Can be used as a class decorator.
+
+    :param cls: Subclass of SymbolBase to register.
+    :param name: Name used in oracles. Default to the name of the class.
+    :param registry: Dictionary to register into. Default to SYMBOLS.
+    :return: The registered class.
+    """
+    if not (inspect.isclass(cls) and issubclass(cls, SymbolBase)):
+        raise SymbolError('%r is not a symbol class' % cls)
+    if registry is None:
+        registry = SYMBOLS
+    if name is None:
+        name = cls.__name__
+    if registry.get(name, cls) is not cls:
+        raise SymbolError("Symbol '%s' is already registered as %r" %
+                          (name, registry[name]))
+    registry[name] = cls
+    return cls
+
+
+for _cls in (Bytes, NonEmptyBytes, String, StringList, Integer):
+    register(_cls)
+del _cls
@@ -1,9 +1,10 @@
 import ast
 import builtins
-import inspect
 import logging
+import random
 import sys
 
+from . import solver
 from . import symbol
 
 
@@ -17,19 +18,40 @@ class TraceError(Exception):
     pass
 
 
+class UnsatisfiableError(TraceError):
+    """
+    Exception raised when no option satisfies a trace.
+    """
+    pass
+
+
 class Trace(object):
     """
     Class represent a condition trace in constraint oracle code. It contains a
     list of commands, including comparisons, operations and ends with a return
     command.
     """
-    def __init__(self, provider, trace_list):
+    def __init__(self, provider, trace_list, path_prefix=None):
         """
         :param trace_list: A list contains code of the trace.
+        :param path_prefix: Prefix of the names of options in the trace.
+                            Comparing an option to a name with this prefix
+                            is a relation between the two options, and to
+                            any other name a test of its symbol class.
         """
         self.item = None
+        self.key = None
+        self.id = None
+        # Whether the trace is unsatisfiable for any item
+        self.pruned = False
         self.provider = provider
         self.symbols = {}
+        # Symbol classes known by oracles of the provider, keyed by names
+        self.symbol_classes = getattr(provider, 'symbols', symbol.SYMBOLS)
+        self.relations = []
+        self.path_prefix = path_prefix
+        # Map symbol names to option paths of items, set by the constraint
+        self.name2path = lambda name: name
         self.trace = trace_list[:]
         ret = trace_list[-1]
         assert isinstance(ret, ast.Return)
@@ -40,6 +62,26 @@ class Trace(object):
         if args:
             self.result_patts = args[0].s
 
+        # Names of the options helper functions are called with. If any,
+        # the trace has to be solved for every item separately.
+        self.call_args = set(
+            arg.id
+            for line in self.trace for node in ast.walk(line)
+            if isinstance(node, ast.Call) and
+            isinstance(node.func, ast.Attribute)
+            for arg in node.args if isinstance(arg, ast.Name))
+        self.item_dependent = bool(self.call_args)
+
+        # Whether helper functions are called at all. Traces without calls
+        # always get the same symbols, which are built once by prepare().
+        self.has_calls = any(
+            isinstance(node, ast.Call) and
+            isinstance(node.func, ast.Attribute)
+            for line in self.trace for node in ast.walk(line))
+        self.domains = None
+        # Helper functions resolved by (module name, function name)
+        self.helpers = {}
+
     def __repr__(self):
         lines = []
         for line in self.trace:
@@ -52,17 +94,30 @@ class Trace(object):
             lines.append(s)
         return repr(lines)
 
+    def _helper(self, pkg_name, func_name):
+        """
+        Resolve a helper function of the provider once per trace.
+        """
+        try:
+            return self.helpers[(pkg_name, func_name)]
+        except KeyError:
+            pass
+        mod_name = '%s_utils.%s' % (self.provider.name, pkg_name)
+        try:
+            func = getattr(sys.modules[mod_name], func_name)
+        except (KeyError, AttributeError):
+            raise TraceError("Unknown helper function '%s.%s'" %
+                             (pkg_name, func_name))
+        self.helpers[(pkg_name, func_name)] = func
+        return func
+
     def _exec_call(self, node):
-        func_name = node.func.attr
-        pkg_name = node.func.value.id
-        mod_name = '.'.join([self.provider.name, 'utils', pkg_name])
-        mod = sys.modules[mod_name]
-        func = getattr(mod, func_name)
+        func = self._helper(node.func.value.id, node.func.attr)
         args = []
         for arg in node.args:
             if isinstance(arg, ast.Name):
                 name = arg.id
-                args.append(self.item.get(name))
+                args.append(self.item.get(self.name2path(name)))
             else:
                 raise TraceError('Unknown argument type: %s' % arg)
         return func(*args)
@@ -76,16 +131,14 @@ class Trace(object):
         op = node.ops[0].__class__.__name__
         comparator = node.comparators[0]
 
-        known_symbols = []
-        for name in dir(symbol):
-            obj = getattr(symbol, name)
-            if inspect.isclass(obj) and issubclass(obj, symbol.SymbolBase):
-                known_symbols.append(name)
-
         exc_types = []
         right_value = None
         if isinstance(comparator, ast.Name):
-            if comparator.id not in known_symbols:
+            if self.path_prefix is not None and \
+                    comparator.id.startswith(self.path_prefix + '_'):
+                self._proc_relation(left, op, comparator.id)
+                return
+            if comparator.id not in self.symbol_classes:
                 raise TraceError("Unknown symbol '%s'" % comparator.id)
             if op == 'IsNot':
                 sym_type = 'Bytes'
@@ -112,14 +165,14 @@ class Trace(object):
                 sym_type = 'Integer'
 
         if left not in self.symbols:
-            self.symbols[left] = getattr(
-                symbol, sym_type)(exc_types=[exc_types])
+            self.symbols[left] = self.symbol_classes[sym_type](
+                exc_types=[exc_types])
 
         sleft = self.symbols[left]
         sleft_type = sleft.__class__.__name__
 
         if op != 'IsNot':
-            if not issubclass(sleft.__class__, getattr(symbol, sym_type)):
+            if not isinstance(sleft, self.symbol_classes[sym_type]):
                 raise TraceError(
                     'Unmatched type %s(operator: %s). Should be %s' %
                     (sym_type, op, sleft_type))
@@ -130,7 +183,7 @@ class Trace(object):
             pass
         elif op == 'Eq':
             if sleft.scope and right_value not in sleft.scope:
-                raise Exception(
+                raise UnsatisfiableError(
                     'Unsatisfiable condition. Need equal to "%s", '
                     'but scope is %s' % (right_value, sleft.scope)
                 )
@@ -140,24 +193,48 @@ class Trace(object):
                 sleft.excs = []
             sleft.excs.append(right_value)
         elif op == 'Lt':
-            if sleft_type == 'Integer':
-                sleft.maximum = right_value - 1
+            if isinstance(sleft, symbol.Integer):
+                sleft.narrow(maximum=right_value - 1)
         elif op == 'LtE':
-            if sleft_type == 'Integer':
-                sleft.maximum = right_value
+            if isinstance(sleft, symbol.Integer):
+                sleft.narrow(maximum=right_value)
         elif op == 'Gt':
-            if sleft_type == 'Integer':
-                sleft.minimum = right_value + 1
+            if isinstance(sleft, symbol.Integer):
+                sleft.narrow(minimum=right_value + 1)
         elif op == 'GtE':
-            if sleft_type == 'Integer':
-                sleft.minimum = right_value
+            if isinstance(sleft, symbol.Integer):
+                sleft.narrow(minimum=right_value)
         elif op == 'In':
-            sleft.scope = call_ret
+            # Helper results may be cached, so they are never changed
+            sleft.scope = list(call_ret)
         elif op == 'NotIn':
-            sleft.excs = call_ret
+            sleft.excs = list(call_ret)
         else:
             raise TraceError('Unknown operator: %s' % op)
 
+    def _proc_relation(self, left, op, right):
+        """
+        Record a relation between two options, creating their symbols after
+        the type of the other one if they don't exist yet.
+        """
+        try:
+            relation = solver.normalize(left, op, right)
+        except solver.SolverError as detail:
+            raise TraceError(str(detail))
+
+        if op in ('In', 'NotIn'):
+            defaults = {left: symbol.String, right: symbol.StringList}
+        else:
+            default = symbol.Integer
+            for name in (left, right):
+                if name in self.symbols:
+                    default = self.symbols[name].__class__
+            defaults = {left: default, right: default}
+        for name in (left, right):
+            if name not in self.symbols:
+                self.symbols[name] = defaults[name]()
+        self.relations.append(relation)
+
     def _proc_call(self, node):
         func_name = node.func.id
         assert func_name in ['any', 'all']
@@ -198,14 +275,16 @@ class Trace(object):
         else:
             raise TraceError('Unknown left type %s' % left)
 
-    def solve(self, item):
+    def _process(self, item):
         """
-        Generate a satisfiable random option according to this trace.
+        Build the symbols of this trace for an item.
+
         :param item: Item to which generated option applies.
-        :return: Generated random option.
+        :raise UnsatisfiableError: If no option satisfies the trace.
         """
         self.item = item
         self.symbols = {}
+        self.relations = []
 
         for node in self.trace:
             if isinstance(node, ast.Compare):
@@ -213,9 +292,109 @@ class Trace(object):
             elif isinstance(node, ast.Call):
                 self._proc_call(node)
             elif isinstance(node, ast.Return):
-                result = {}
-                for name, sym in self.symbols.items():
-                    result[name] = sym.model()
-                return result
+                break
             else:
                 raise TraceError('Unknown node type: %s' % type(node))
+
+        if self.relations:
+            try:
+                solver.propagate(self.symbols, self.relations)
+            except solver.NoSolutionError as detail:
+                raise UnsatisfiableError(str(detail))
+        for name, sym in self.symbols.items():
+            if not sym.reduce():
+                raise UnsatisfiableError(
+                    'No value of %s satisfies trace %s' % (name, self.key))
+
+    def prepare(self):
+        """
+        Build the narrowed domains of the symbols once if the trace calls no
+        helper function, so solving doesn't rebuild them for every item.
+
+        :raise UnsatisfiableError: If no option satisfies the trace.
+        """
+        if self.has_calls:
+            return
+        self._process(None)
+        self.domains = self.symbols
+
+    def _symbols(self, item):
+        if self.domains is not None:
+            return self.domains
+        self._process(item)
+        return self.symbols
+
+    def _related(self):
+        return set(name for left, _, right in self.relations
+                   for name in (left, right))
+
+    def mutate(self, item, values):
+        """
+        Perturb a random option of a solution of this trace through its
+        symbol, which keeps the solution satisfying the trace. Options
+        related to others are left to be solved again.
+
+        :param item: Item to which the solution applies.
+        :param values: Dictionary of solved values keyed by symbol names.
+        :return: A tuple of the name and the new value of the perturbed
+                 symbol, or None if no symbol can be perturbed.
+        """
+        symbols = self._symbols(item)
+        related = self._related()
+        names = [name for name in symbols
+                 if name not in related and name in values]
+        if not names:
+            return None
+        name = random.choice(names)
+        try:
+            return name, symbols[name].mutate(values[name])
+        except symbol.EmptyDomainError:
+            return None
+
+    def solve(self, item):
+        """
+        Generate a satisfiable random option according to this trace.
+        :param item: Item to which generated option applies.
+        :return: Generated random option.
+        """
+        symbols = self._symbols(item)
+        related = self._related()
+        result = {}
+        try:
+            for name, sym in symbols.items():
+                if name not in related:
+                    result[name] = sym.model()
+            if self.relations:
+                result.update(solver.solve(symbols, self.relations))
+        except (symbol.EmptyDomainError, solver.NoSolutionError) as detail:
+            raise UnsatisfiableError(str(detail))
+        return result
+
+    def solve_many(self, items):
+        """
+        Generate satisfiable random options for a batch of items.
+
+        Unless the trace depends on options of the items, its symbols are
+        built once and sampled for all the items at once. Related options are
+        solved item by item.
+
+        :param items: List of items to which generated options apply.
+        :return: List of generated random options for each item.
+        """
+        if self.item_dependent:
+            return [self.solve(item) for item in items]
+
+        symbols = self._symbols(None)
+        related = self._related()
+        try:
+            columns = {name: sym.model_many(len(items))
+                       for name, sym in symbols.items()
+                       if name not in related}
+            results = [{name: column[idx] for name, column in columns.items()}
+                       for idx in range(len(items))]
+            if self.relations:
+                for result in results:
+                    result.update(solver.solve(symbols, self.relations))
+        except (symbol.EmptyDomainError, solver.NoSolutionError) as detail:
+            raise UnsatisfiableError(str(detail))
+        return results
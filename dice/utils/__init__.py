@@ -3,10 +3,21 @@ import fcntl
 import os
 import random
 import select
+import shlex
 import signal
 import subprocess
 import time
 
+from . import affinity
+from . import cache
+from . import forkserver
+from . import payload
+from . import procstat
+from . import rlimits
+
+# Helpers of providers are memoized with ``@utils.cacheable(ttl)``
+cacheable = cache.cacheable
+
 
 class CmdResult(object):
     """A class representing the result of a system call.
@@ -19,14 +30,32 @@ class CmdResult(object):
         self.exit_code = None
         self.exit_status = "undefined"
         self.call_time = 0.0
+        # Resource usage of the command, keyed by procstat.RUSAGE_FIELDS
+        self.rusage = None
 
     def __str__(self):
         s = ''
         s += "command: %s\n" % self.cmdline
         s += "stdout:\n%s\n" % self.stdout
         s += "stderr:\n%s\n" % self.stderr
+        if self.rusage:
+            s += "rusage:\n%s\n" % format_rusage(self.rusage)
         return s
 
+    def serialize(self):
+        """
+        Serialize the command result into a JSON compatible dictionary.
+        """
+        return {
+            'cmdline': self.cmdline,
+            'stdout': self.stdout,
+            'stderr': self.stderr,
+            'exit_code': self.exit_code,
+            'exit_status': self.exit_status,
+            'call_time': self.call_time,
+            'rusage': self.rusage,
+        }
+
     def pprint(self):
         """
         Print the command result in a pretty and colorful way.
@@ -44,6 +73,17 @@ class CmdResult(object):
             print('\033[91m%s\033[0m' % line)
 
 
+def format_rusage(rusage):
+    """
+    Format a resource usage dictionary as a line of text.
+    """
+    return ('cpu %.3fs (user %.3fs, sys %.3fs), maxrss %dKB, '
+            'ctxsw %d/%d, blkio %d/%d' % (
+                rusage['utime'] + rusage['stime'], rusage['utime'],
+                rusage['stime'], rusage['maxrss'], rusage['nvcsw'],
+                rusage['nivcsw'], rusage['inblock'], rusage['oublock']))
+
+
 def weighted_choice(choices):
     total = sum(choice.weight for choice in choices)
     rnd_num = random.uniform(0, total)
@@ -55,15 +95,23 @@ def weighted_choice(choices):
     assert False, "Shouldn't get here"
 
 
+_ESCAPE_TABLE = dict((ord(char), '\\' + char)
+                     for char in """~()[]{}<>|&$#?'"`*; \n\t\r\\""")
+
+
 def escape(org_str):
-    escapes = """~()[]{}<>|&$#?'"`*; \n\t\r\\"""
-    new_str = ""
-    for char in org_str:
-        if char in escapes:
-            new_str += '\\' + char
-        else:
-            new_str += char
-    return new_str
+    """
+    Escape shell special characters in a string. Prefer passing an argument
+    list to run() which doesn't need escaping at all.
+    """
+    return org_str.translate(_ESCAPE_TABLE)
+
+
+def join_argv(argv):
+    """
+    Join an argument list into a shell command line for displaying.
+    """
+    return ' '.join(shlex.quote(arg) for arg in argv)
 
 
 def pids():
@@ -82,52 +130,139 @@ def kernel_pids():
     return results
 
 
-def run(cmdline, timeout=10):
-    """Run the command line and return the result with a CmdResult object.
+def _decode(data):
+    return data.decode('utf-8', 'replace')
 
-    :param cmdline: The command line to run.
-    :type cmdline: str.
-    :param timeout: After which the calling processing is killed.
-    :type timeout: float.
-    :returns: CmdResult -- the command result.
-    :raises:
-    """
 
-    start = time.time()
-    process = subprocess.Popen(
-        cmdline,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        shell=True,
-        preexec_fn=os.setsid,
-    )
-
-    fcntl.fcntl(
-        process.stdout,
-        fcntl.F_SETFL,
-        fcntl.fcntl(process.stdout, fcntl.F_GETFL) | os.O_NONBLOCK,
-    )
+def _set_nonblock(fileobj):
     fcntl.fcntl(
-        process.stderr,
+        fileobj,
         fcntl.F_SETFL,
-        fcntl.fcntl(process.stderr, fcntl.F_GETFL) | os.O_NONBLOCK,
+        fcntl.fcntl(fileobj, fcntl.F_GETFL) | os.O_NONBLOCK,
     )
 
+
+def _write_stdin(process, view):
+    """
+    Write as much pending input to the process as possible without blocking.
+
+    :return: The input left to write, or None if all of it has been written
+             or the process doesn't read it anymore.
+    """
+    try:
+        written = os.write(process.stdin.fileno(), view[:65536])
+        view = view[written:]
+    except OSError as detail:
+        if detail.errno == errno.EAGAIN:
+            return view
+        if detail.errno != errno.EPIPE:
+            raise
+        view = None
+    if not view:
+        process.stdin.close()
+        return None
+    return view
+
+
+def _run_forkserver(server, cmdline, argv, timeout, stdin, pass_fds,
+                    stall_window, limits):
+    """
+    Run the command through the fork server.
+    """
+    result = CmdResult(cmdline)
+    response = server.run(argv, timeout=timeout, stdin=stdin,
+                          stall_window=stall_window, limits=limits,
+                          cpus=affinity.current(), pass_fds=pass_fds)
+    result.stdout = _decode(response['stdout'])
+    result.stderr = _decode(response['stderr'])
+    result.call_time = response['call_time']
+    result.exit_code = response['exit_code']
+    result.rusage = response['rusage']
+    if response['timed_out']:
+        result.exit_status = "timeout"
+    elif response['stalled']:
+        result.exit_status = "stalled"
+    elif result.exit_code == 0:
+        result.exit_status = "success"
+    else:
+        result.exit_status = "failure"
+    return result
+
+
+def _wait(process, result, block=False):
+    """
+    Reap the command with os.wait4() to record the resource usage of the
+    command and the descendants it waited for.
+
+    :return: Exit code of the command or None if it's still running.
+    """
+    if process.returncode is not None:
+        return process.returncode
+    pid, status, rusage = os.wait4(process.pid, 0 if block else os.WNOHANG)
+    if pid == 0:
+        return None
+    process.returncode = procstat.exit_code(status)
+    result.rusage = procstat.rusage_dict(rusage)
+    return process.returncode
+
+
+def _run_popen(cmdline, argv, shell, timeout, stdin, pass_fds,
+               stall_window):
+    """
+    Run the command in a child process of DICE.
+    """
     result = CmdResult(cmdline)
 
+    start = time.time()
+    try:
+        process = subprocess.Popen(
+            cmdline if shell else argv,
+            stdin=None if stdin is None else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=shell,
+            start_new_session=True,
+            pass_fds=pass_fds,
+        )
+    except OSError as detail:
+        # e.g. the program doesn't exist or arguments are too long
+        result.exit_code = 127
+        result.exit_status = "failure"
+        result.stderr = str(detail)
+        return result
+
+    _set_nonblock(process.stdout)
+    _set_nonblock(process.stderr)
+
+    stdin_view = None
+    if stdin is not None:
+        _set_nonblock(process.stdin)
+        stdin_view = _write_stdin(process, memoryview(stdin))
+
+    detector = None
+    if stall_window:
+        detector = procstat.StallDetector(process.pid, stall_window)
+
+    out_chunks = []
+    err_chunks = []
+
     try:
         while True:
-            exit_code = process.poll()
+            exit_code = _wait(process, result)
             result.call_time = (time.time() - start)
 
-            select.select([process.stdout, process.stderr], [], [], 0.1)
+            wlist = [] if stdin_view is None else [process.stdin]
+            _, writable, _ = select.select(
+                [process.stdout, process.stderr], wlist, [], 0.1)
+            if writable:
+                stdin_view = _write_stdin(process, stdin_view)
             try:
                 out_lines = process.stdout.read()
                 if out_lines:
-                    result.stdout += out_lines
+                    out_chunks.append(out_lines)
                 err_lines = process.stderr.read()
                 if err_lines:
-                    result.stderr += err_lines
+                    err_chunks.append(err_lines)
             except IOError as detail:
                 if detail.errno != errno.EAGAIN:
                     raise detail
@@ -142,8 +277,106 @@ def run(cmdline, timeout=10):
 
             if result.call_time > timeout:
                 return result
+
+            if detector is not None and detector.check():
+                result.exit_status = "stalled"
+                return result
     finally:
+        result.stdout = _decode(b''.join(out_chunks))
+        result.stderr = _decode(b''.join(err_chunks))
+        if stdin_view is not None:
+            process.stdin.close()
+        process.stdout.close()
+        process.stderr.close()
         if result.exit_code is None:
             pgid = os.getpgid(process.pid)
             os.killpg(pgid, signal.SIGKILL)
-            result.exit_status = "timeout"
+            _wait(process, result, block=True)
+            if result.exit_status != "stalled":
+                result.exit_status = "timeout"
+
+
+def run(cmdline, timeout=10, stdin=None, pass_fds=(), stall_window=None,
+        limits=None):
+    """Run the command line and return the result with a CmdResult object.
+
+    A command line string runs through the shell, while an argument list is
+    executed directly without quoting. Payload objects in an argument list
+    are delivered according to their modes. The command runs through the
+    fork server if it has been started with forkserver.start(), which
+    receives the file descriptors passed to the command over a Unix socket.
+    Commands with resource limits start the fork server if needed, which
+    applies the limits in the forked child before executing them.
+    The command runs on the CPUs the calling thread is pinned to with
+    affinity.pin().
+
+    :param cmdline: The command line or argument list to run.
+    :type cmdline: str or list.
+    :param timeout: After which the calling processing is killed.
+    :type timeout: float.
+    :param stdin: Data written to the standard input of the command.
+    :type stdin: bytes or str.
+    :param pass_fds: File descriptors inherited by the command.
+    :type pass_fds: list.
+    :param stall_window: If set, the command is killed with the "stalled"
+                         exit status once its processes have all been
+                         sleeping without using any CPU for this many
+                         seconds.
+    :type stall_window: float.
+    :param limits: Resource limits applied to the command, keyed by names
+                   of rlimits.RESOURCES. A failure caused by hitting a limit
+                   gets an exit status of "oom", "cpu_limit", "fsize_limit"
+                   or "nproc_limit".
+    :type limits: dict.
+    :returns: CmdResult -- the command result.
+    :raises:
+    """
+    payloads = []
+    pass_fds = list(pass_fds)
+    if limits:
+        rlimits.check(limits)
+    if stdin is not None:
+        stdin = payload.to_bytes(stdin)
+    try:
+        if isinstance(cmdline, (list, tuple)):
+            argv = []
+            for arg in cmdline:
+                if isinstance(arg, payload.Payload):
+                    payloads.append(arg)
+                    arg = arg.open()
+                    if payloads[-1].fd is not None:
+                        pass_fds.append(payloads[-1].fd)
+                    if payloads[-1].mode == 'stdin':
+                        if stdin is not None:
+                            raise payload.PayloadError(
+                                'Only one payload can be sent to stdin')
+                        stdin = payloads[-1].data
+                    if arg is None:
+                        continue
+                argv.append(str(arg))
+            cmdline = join_argv(argv)
+            if stdin is not None:
+                cmdline += ' < [%d bytes]' % len(stdin)
+            shell = False
+        else:
+            argv = ['/bin/sh', '-c', cmdline]
+            shell = True
+
+        server = forkserver.get_server()
+        if server is None and limits:
+            # Running Python code between fork and exec with preexec_fn may
+            # deadlock in a threaded process, so the fork server sets the
+            # limits up instead
+            server = forkserver.start()
+        if server is not None:
+            result = _run_forkserver(server, cmdline, argv, timeout, stdin,
+                                     pass_fds, stall_window, limits)
+        else:
+            result = _run_popen(cmdline, argv, shell, timeout, stdin,
+                                pass_fds, stall_window)
+        if limits and result.exit_status == "failure":
+            result.exit_status = rlimits.classify(result, limits) or "failure"
+        return result
+    finally:
+        for pld in payloads:
+            pld.close()
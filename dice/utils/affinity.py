@@ -0,0 +1,114 @@
+import os
+import threading
+
+
+class AffinityError(Exception):
+    """
+    Class for CPU affinity specific exceptions.
+    """
+    pass
+
+
+_LOCAL = threading.local()
+
+
+def supported():
+    """
+    Whether CPU affinity can be set on this system.
+    """
+    return hasattr(os, 'sched_setaffinity')
+
+
+def _parse_cpu_list(text):
+    cpus = set()
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def cores(cpus=None):
+    """
+    Group CPUs by the physical core they belong to, so that SMT siblings
+    sharing a core end up in the same group.
+
+    :param cpus: CPUs to group. Default to the CPUs DICE is allowed on.
+    :return: A list of sorted lists of CPUs, sorted by their first CPU.
+    """
+    if cpus is None:
+        cpus = os.sched_getaffinity(0)
+    groups = {}
+    for cpu in cpus:
+        path = ('/sys/devices/system/cpu/cpu%d/topology/thread_siblings_list' %
+                cpu)
+        try:
+            with open(path) as fp:
+                siblings = _parse_cpu_list(fp.read())
+        except (IOError, OSError, ValueError):
+            siblings = set([cpu])
+        key = min(siblings)
+        groups.setdefault(key, []).append(cpu)
+    return [sorted(groups[key]) for key in sorted(groups)]
+
+
+def plan(workers, avoid_smt=False, reserve=1, cpus=None):
+    """
+    Split the CPUs between the main thread and a number of workers.
+
+    :param workers: Number of workers running items.
+    :param avoid_smt: Use only one CPU of each core for workers, so that
+                      no two workers share a core.
+    :param reserve: Number of cores reserved for the UI and the other
+                    threads of DICE. Nothing is reserved if there are not
+                    more cores than that.
+    :param cpus: CPUs to split. Default to the CPUs DICE is allowed on.
+    :return: A tuple of the set of reserved CPUs and a list of CPU sets, one
+             for every worker.
+    """
+    if workers < 1:
+        raise AffinityError('Need at least one worker to pin')
+    groups = cores(cpus)
+    reserved = set()
+    if len(groups) > reserve:
+        for group in groups[:reserve]:
+            reserved.update(group)
+        groups = groups[reserve:]
+
+    if avoid_smt:
+        pool = [group[0] for group in groups]
+    else:
+        # Spread workers over cores before using their siblings
+        pool = []
+        for idx in range(max(len(group) for group in groups)):
+            pool.extend(group[idx] for group in groups if idx < len(group))
+
+    sets = [set() for _ in range(workers)]
+    for idx in range(max(len(pool), workers)):
+        sets[idx % workers].add(pool[idx % len(pool)])
+    if not reserved:
+        reserved = set(pool)
+    return reserved, sets
+
+
+def pin(cpus):
+    """
+    Pin the calling thread, and the processes it spawns from now on, to a
+    set of CPUs.
+
+    :param cpus: Set of CPU numbers.
+    """
+    os.sched_setaffinity(0, cpus)
+    _LOCAL.cpus = set(cpus)
+
+
+def current():
+    """
+    Get the CPUs the calling thread is pinned to with pin(), or None if it
+    is not pinned.
+    """
+    return getattr(_LOCAL, 'cpus', None)
@@ -0,0 +1,226 @@
+import fcntl
+import functools
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+
+
+class CacheError(Exception):
+    """
+    Class for helper cache specific exceptions.
+    """
+    pass
+
+
+# Directory of caches shared between processes of the user
+SHARED_DIR = os.path.join(tempfile.gettempdir(),
+                          'dice-cache-%d' % os.getuid())
+
+# All caches made by cacheable(), to be invalidated together
+_caches = []
+_caches_lock = threading.Lock()
+
+
+class Cache(object):
+    """
+    Memoize the results of a helper function by its arguments.
+
+    Results expire after ``ttl`` seconds, or never if ``ttl`` is None, and
+    can be invalidated explicitly. Concurrent calls with the same arguments
+    in different threads call the function only once. A shared cache also
+    stores results as JSON in files of a directory private to the user,
+    locked while they are computed, so processes running the same provider
+    share them. Shared results must be JSON serializable and come back as
+    lists instead of tuples.
+    """
+    def __init__(self, func, ttl=None, shared=False, directory=None):
+        """
+        :param func: Function to memoize.
+        :param ttl: Seconds a result is valid for. Never expires if None.
+        :param shared: Whether results are shared between processes.
+        :param directory: Directory of shared results. Default to
+                          SHARED_DIR.
+        """
+        self.func = func
+        self.ttl = ttl
+        self.shared = shared
+        self.directory = directory or SHARED_DIR
+        self.name = '%s.%s' % (func.__module__,
+                               getattr(func, '__qualname__', func.__name__))
+        self.entries = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(args, kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            # Lists and dictionaries of options are keyed by their values
+            key = repr(key)
+        return key
+
+    def _expired(self, expires):
+        return expires is not None and expires <= time.time()
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, '%s.%s' % (self.name, digest))
+
+    def _load(self, fp):
+        fp.seek(0)
+        try:
+            expires, value = json.load(fp)
+        except (ValueError, TypeError):
+            return None
+        if self._expired(expires):
+            return None
+        return expires, value
+
+    def _check_directory(self):
+        """
+        Create the directory of shared results only the user can access,
+        refusing one which others could have planted results in.
+        """
+        try:
+            os.makedirs(self.directory, 0o700)
+        except OSError:
+            if not os.path.isdir(self.directory):
+                raise
+        info = os.lstat(self.directory)
+        if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or
+                info.st_mode & 0o077):
+            raise CacheError('Shared cache directory %s must be owned by the '
+                             'user and private' % self.directory)
+
+    def _call_shared(self, key, args, kwargs):
+        """
+        Get a result from the shared file of the arguments, or compute and
+        save it while holding the file lock so other processes wait for it.
+        """
+        self._check_directory()
+        with open(self._path(key), 'a+') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                entry = self._load(fp)
+                if entry is not None:
+                    return entry, True
+                value = self.func(*args, **kwargs)
+                expires = None if self.ttl is None else time.time() + self.ttl
+                try:
+                    data = json.dumps([expires, value])
+                except TypeError as detail:
+                    raise CacheError('Result of %s is not shareable: %s' %
+                                     (self.name, detail))
+                fp.seek(0)
+                fp.truncate()
+                fp.write(data)
+                fp.flush()
+                # Same value as other processes load
+                return tuple(json.loads(data)), False
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def __call__(self, *args, **kwargs):
+        key = self._key(args, kwargs)
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and not self._expired(entry[0]):
+                    self.hits += 1
+                    return entry[1]
+                event = self.pending.get(key)
+                if event is None:
+                    event = self.pending[key] = threading.Event()
+                    break
+            # Another thread is computing the same result
+            event.wait()
+
+        try:
+            if self.shared:
+                entry, hit = self._call_shared(key, args, kwargs)
+            else:
+                value = self.func(*args, **kwargs)
+                expires = None if self.ttl is None else time.time() + self.ttl
+                entry, hit = (expires, value), False
+            with self.lock:
+                self.entries[key] = entry
+                if hit:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            return entry[1]
+        finally:
+            with self.lock:
+                del self.pending[key]
+            event.set()
+
+    def invalidate(self, *args, **kwargs):
+        """
+        Invalidate the result of the arguments, or all results if no
+        argument is given.
+        """
+        with self.lock:
+            if args or kwargs:
+                keys = [self._key(args, kwargs)]
+                self.entries.pop(keys[0], None)
+            else:
+                keys = list(self.entries)
+                self.entries.clear()
+        if not self.shared or not os.path.isdir(self.directory):
+            return
+        if args or kwargs:
+            paths = [self._path(keys[0])]
+        else:
+            prefix = self.name + '.'
+            paths = [os.path.join(self.directory, name)
+                     for name in os.listdir(self.directory)
+                     if name.startswith(prefix)]
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def cacheable(ttl=None, shared=False, directory=None):
+    """
+    Decorator memoizing a provider helper function called by oracles. The
+    decorated function gets an ``invalidate`` method. It can be used as
+    ``@cacheable`` or with arguments like ``@cacheable(ttl=60)``.
+
+    :param ttl: Seconds a result is valid for. Never expires if None.
+    :param shared: Whether results are shared between processes.
+    :param directory: Directory of shared results.
+    """
+    if callable(ttl):
+        return cacheable()(ttl)
+
+    if ttl is not None and ttl < 0:
+        raise CacheError('Negative TTL %s' % ttl)
+
+    def decorator(func):
+        cache = Cache(func, ttl=ttl, shared=shared, directory=directory)
+        functools.update_wrapper(cache, func)
+        with _caches_lock:
+            _caches.append(cache)
+        return cache
+    return decorator
+
+
+def invalidate_all():
+    """
+    Invalidate the results of all cacheable helpers, for example after the
+    host state they enumerate changed.
+    """
+    with _caches_lock:
+        caches = list(_caches)
+    for cache in caches:
+        cache.invalidate()
@@ -0,0 +1,586 @@
+import array
+import errno
+import fcntl
+import itertools
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import connection
+
+from . import procstat
+from . import rlimits
+
+
+# Signals ignored by the fork server or Python which commands should handle
+# by default.
+_DEFAULT_SIGNALS = [getattr(signal, name)
+                    for name in ('SIGPIPE', 'SIGXFSZ', 'SIGINT')
+                    if hasattr(signal, name)]
+
+
+class ForkServerError(Exception):
+    """
+    Class for fork server specific exceptions.
+    """
+    pass
+
+
+def _send_fds(sock, fds):
+    """
+    Send file descriptors over a Unix socket as SCM_RIGHTS ancillary data.
+    """
+    sock.sendmsg([b'F'], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                           array.array('i', fds))])
+
+
+def _recv_fds(sock, count):
+    """
+    Receive file descriptors sent by _send_fds().
+
+    :return: List of the received file descriptors, not inherited by
+             commands.
+    :raises: ForkServerError if fewer descriptors are received.
+    """
+    fds = array.array('i')
+    _, ancdata, _, _ = sock.recvmsg(1, socket.CMSG_LEN(count * fds.itemsize))
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - len(data) % fds.itemsize])
+    fds = list(fds)
+    for fd in fds:
+        os.set_inheritable(fd, False)
+    if len(fds) != count:
+        for fd in fds:
+            os.close(fd)
+        raise ForkServerError('Received %d of %d file descriptors' %
+                              (len(fds), count))
+    return fds
+
+
+def _move_fds(fds):
+    """
+    Duplicate file descriptors to their numbers in the client, in a forked
+    child. They are moved above all the target numbers first so none is
+    overwritten before being duplicated.
+
+    :param fds: List of tuples of the target number and the descriptor.
+    """
+    floor = max(target for target, _ in fds) + 1
+    moved = [(target, fcntl.fcntl(fd, fcntl.F_DUPFD, floor))
+             for target, fd in fds]
+    for target, fd in moved:
+        os.dup2(fd, target)
+    for _, fd in moved:
+        os.close(fd)
+
+
+class _Child(object):
+    """
+    A command spawned by the fork server.
+    """
+    def __init__(self, request, fds=()):
+        """
+        :param request: Request dictionary sent by the client.
+        :param fds: File descriptors received along with the request, which
+                    the command inherits at the numbers of request['fds'].
+        """
+        self.id = request['id']
+        self.argv = request['argv']
+        self.timeout = request['timeout']
+        self.pid = None
+        self.fds = []
+        self.chunks = {}
+        self.exit_code = None
+        self.timed_out = False
+        self.stalled = False
+        self.rusage = None
+        self.start = time.time()
+        self.call_time = 0.0
+        self.in_fd = None
+        self.stdin = None
+
+        cwd = request.get('cwd')
+        if cwd is not None:
+            os.chdir(cwd)
+
+        in_r = None
+        if request.get('stdin') is not None:
+            in_r, self.in_fd = os.pipe()
+            fcntl.fcntl(self.in_fd, fcntl.F_SETFL,
+                        fcntl.fcntl(self.in_fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            self.stdin = memoryview(request['stdin'])
+
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        try:
+            self.pid = self._spawn_pinned(request.get('cpus'),
+                                          request.get('env'),
+                                          request.get('limits'),
+                                          list(zip(request.get('fds', ()),
+                                                   fds)),
+                                          in_r, out_w, err_w)
+        except OSError:
+            os.close(out_r)
+            os.close(err_r)
+            self._close_stdin()
+            raise
+        finally:
+            os.close(out_w)
+            os.close(err_w)
+            if in_r is not None:
+                os.close(in_r)
+
+        self.detector = None
+        if request.get('stall_window'):
+            self.detector = procstat.StallDetector(self.pid,
+                                                   request['stall_window'])
+
+        for fd in (out_r, err_r):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            self.chunks[fd] = []
+        self.out_fd, self.err_fd = out_r, err_r
+        self.fds = [out_r, err_r]
+
+    def _spawn_pinned(self, cpus, *args):
+        """
+        Spawn the child on a set of CPUs, which it inherits from the server.
+        """
+        if not cpus:
+            return self._spawn(*args)
+        saved = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, cpus)
+        try:
+            return self._spawn(*args)
+        finally:
+            os.sched_setaffinity(0, saved)
+
+    def _spawn(self, env, limits, fds, in_r, out_w, err_w):
+        if env is None:
+            env = os.environ
+
+        # Resource limits and inherited descriptors are set up in a forked
+        # child
+        if hasattr(os, 'posix_spawnp') and not limits and not fds:
+            if in_r is None:
+                stdin_action = (os.POSIX_SPAWN_OPEN, 0, os.devnull,
+                                os.O_RDONLY, 0)
+            else:
+                stdin_action = (os.POSIX_SPAWN_DUP2, in_r, 0)
+            return os.posix_spawnp(
+                self.argv[0], self.argv, env,
+                file_actions=[
+                    stdin_action,
+                    (os.POSIX_SPAWN_DUP2, out_w, 1),
+                    (os.POSIX_SPAWN_DUP2, err_w, 2),
+                ],
+                setsid=True,
+                setsigdef=_DEFAULT_SIGNALS,
+            )
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.setsid()
+                for signum in _DEFAULT_SIGNALS:
+                    signal.signal(signum, signal.SIG_DFL)
+                if limits:
+                    rlimits.apply(limits)
+                if in_r is None:
+                    in_r = os.open(os.devnull, os.O_RDONLY)
+                os.dup2(in_r, 0)
+                os.dup2(out_w, 1)
+                os.dup2(err_w, 2)
+                if fds:
+                    _move_fds(fds)
+                os.execvpe(self.argv[0], self.argv, env)
+            finally:
+                os._exit(127)
+        return pid
+
+    def write(self, fds):
+        """
+        Write pending input to the child.
+
+        :param fds: File descriptors ready to be written.
+        """
+        if self.in_fd is None or self.in_fd not in fds:
+            return
+        try:
+            written = os.write(self.in_fd, self.stdin[:65536])
+            self.stdin = self.stdin[written:]
+        except OSError as detail:
+            if detail.errno == errno.EAGAIN:
+                return
+            if detail.errno != errno.EPIPE:
+                raise
+            self.stdin = None
+        if not self.stdin:
+            self._close_stdin()
+
+    def _close_stdin(self):
+        if self.in_fd is not None:
+            os.close(self.in_fd)
+            self.in_fd = None
+            self.stdin = None
+
+    def read(self, fds, drain=False):
+        """
+        Read available output of the child.
+
+        :param fds: File descriptors ready to be read.
+        :param drain: Keep reading until no output is available.
+        """
+        for fd in list(self.fds):
+            if fd not in fds:
+                continue
+            while True:
+                try:
+                    data = os.read(fd, 65536)
+                except OSError as detail:
+                    if detail.errno != errno.EAGAIN:
+                        raise
+                    break
+                if not data:
+                    self.fds.remove(fd)
+                    os.close(fd)
+                    break
+                self.chunks[fd].append(data)
+                if not drain:
+                    break
+
+    def poll(self, now):
+        """
+        Check whether the child exited or timed out.
+
+        :param now: Current time.
+        :return: True if the child finished.
+        """
+        pid, status, rusage = os.wait4(self.pid, os.WNOHANG)
+        self.call_time = now - self.start
+        if pid == 0:
+            if self.call_time <= self.timeout:
+                if self.detector is None or not self.detector.check(now):
+                    return False
+                self.stalled = True
+            else:
+                self.timed_out = True
+            try:
+                os.killpg(self.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            _, status, rusage = os.wait4(self.pid, 0)
+        else:
+            self.exit_code = procstat.exit_code(status)
+        self.rusage = procstat.rusage_dict(rusage)
+
+        # Drain output written right before the exit
+        self.read(list(self.fds), drain=True)
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
+        self._close_stdin()
+        return True
+
+    def kill(self):
+        """
+        Kill the process group of the child.
+        """
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+            os.waitpid(self.pid, 0)
+        except OSError:
+            pass
+        for fd in self.fds:
+            os.close(fd)
+        self._close_stdin()
+
+    def response(self):
+        """
+        Build the response to the client.
+        """
+        return {
+            'id': self.id,
+            'exit_code': self.exit_code,
+            'timed_out': self.timed_out,
+            'stalled': self.stalled,
+            'rusage': self.rusage,
+            'call_time': self.call_time,
+            'stdout': b''.join(self.chunks[self.out_fd]),
+            'stderr': b''.join(self.chunks[self.err_fd]),
+        }
+
+
+def serve(req_fd, resp_fd, wakeup_fd=None):
+    """
+    Serve command requests until the request socket is closed.
+
+    :param req_fd: File descriptor of the Unix socket to receive requests
+                   and the file descriptors passed to commands from.
+    :param resp_fd: File descriptor to send responses to.
+    :param wakeup_fd: File descriptor written to when a child exits.
+    """
+    requests = connection.Connection(req_fd, writable=False)
+    responses = connection.Connection(resp_fd, readable=False)
+    children = []
+    sock = None
+    try:
+        while True:
+            now = time.time()
+            wait = 0.1
+            for child in children:
+                wait = min(wait, max(child.start + child.timeout - now, 0))
+
+            rlist = [requests.fileno()]
+            if wakeup_fd is not None:
+                rlist.append(wakeup_fd)
+            wlist = []
+            for child in children:
+                rlist.extend(child.fds)
+                if child.in_fd is not None:
+                    wlist.append(child.in_fd)
+            ready, writable, _ = select.select(rlist, wlist, [], wait)
+
+            if wakeup_fd in ready:
+                try:
+                    os.read(wakeup_fd, 4096)
+                except OSError as detail:
+                    if detail.errno != errno.EAGAIN:
+                        raise
+
+            if requests.fileno() in ready:
+                try:
+                    request = requests.recv()
+                except EOFError:
+                    return
+                fds = []
+                try:
+                    if request.get('fds'):
+                        if sock is None:
+                            sock = socket.fromfd(requests.fileno(),
+                                                 socket.AF_UNIX,
+                                                 socket.SOCK_STREAM)
+                        fds = _recv_fds(sock, len(request['fds']))
+                    children.append(_Child(request, fds))
+                except (OSError, ForkServerError) as detail:
+                    responses.send({
+                        'id': request['id'],
+                        'exit_code': 127,
+                        'timed_out': False,
+                        'stalled': False,
+                        'rusage': None,
+                        'call_time': 0.0,
+                        'stdout': b'',
+                        'stderr': str(detail).encode('utf-8'),
+                    })
+                finally:
+                    # The children inherited their copies
+                    for fd in fds:
+                        os.close(fd)
+
+            now = time.time()
+            for child in list(children):
+                child.write(writable)
+                child.read(ready)
+                if child.poll(now):
+                    children.remove(child)
+                    responses.send(child.response())
+    finally:
+        for child in children:
+            child.kill()
+        if sock is not None:
+            sock.close()
+
+
+def main():
+    """
+    Entry point of the fork server process, which receives requests from
+    the client on its standard input, a Unix socket, and responds on its
+    standard output.
+    """
+    req_fd, resp_fd = os.dup(0), os.dup(1)
+    null_fd = os.open(os.devnull, os.O_RDWR)
+    os.dup2(null_fd, 0)
+    os.dup2(null_fd, 1)
+    os.close(null_fd)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Wake up from select() as soon as a child exits
+    wakeup_r, wakeup_w = os.pipe()
+    for fd in (wakeup_r, wakeup_w):
+        fcntl.fcntl(fd, fcntl.F_SETFL,
+                    fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    serve(req_fd, resp_fd, wakeup_fd=wakeup_r)
+
+
+class ForkServer(object):
+    """
+    Client of a small pre-spawned helper process which spawns commands on
+    behalf of DICE. Spawning from a tiny process without a shell is much
+    cheaper than forking the whole DICE process for every command.
+    """
+    def __init__(self):
+        self.process = None
+        self.channel = None
+        self.requests = None
+        self.responses = None
+        self.reader = None
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.ids = itertools.count()
+
+    def start(self):
+        """
+        Spawn the fork server process.
+        """
+        base_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+        bootstrap = ('import sys; sys.path.insert(0, %r); '
+                     'from dice.utils import forkserver; forkserver.main()' %
+                     base_dir)
+        # Requests go through a Unix socket to pass file descriptors along
+        self.channel, server_end = socket.socketpair()
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, '-c', bootstrap],
+                stdin=server_end.fileno(),
+                stdout=subprocess.PIPE,
+            )
+        finally:
+            server_end.close()
+        self.requests = connection.Connection(
+            os.dup(self.channel.fileno()), readable=False)
+        self.responses = connection.Connection(
+            os.dup(self.process.stdout.fileno()), writable=False)
+        self.process.stdout.close()
+
+        self.reader = threading.Thread(target=self._receive,
+                                       name='dice-forkserver')
+        self.reader.daemon = True
+        self.reader.start()
+
+    def stop(self):
+        """
+        Stop the fork server and kill the commands still running.
+        """
+        if self.process is None:
+            return
+        self.requests.close()
+        self.channel.close()
+        self.process.wait()
+        self.reader.join()
+        self.responses.close()
+        self.process = None
+
+    def _receive(self):
+        while True:
+            try:
+                response = self.responses.recv()
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                slot = self.pending.pop(response['id'], None)
+            if slot is not None:
+                slot.append(response)
+                slot[0].set()
+
+        # Wake up callers waiting on a dead server
+        with self.lock:
+            slots, self.pending = list(self.pending.values()), {}
+        for slot in slots:
+            slot[0].set()
+
+    def run(self, argv, timeout=10, cwd=None, env=None, stdin=None,
+            stall_window=None, limits=None, cpus=None, pass_fds=()):
+        """
+        Run a command through the fork server.
+
+        :param argv: List of the program and its arguments.
+        :param timeout: After which the command is killed.
+        :param cwd: Working directory of the command. Default to the current
+                    working directory.
+        :param env: Environment variables of the command. Default to the
+                    environment of the fork server.
+        :param stdin: Bytes written to the standard input of the command.
+        :param stall_window: Seconds without progress after which the
+                             command is killed as stalled.
+        :param limits: Resource limits applied to the command.
+        :param cpus: Set of CPUs the command is pinned to.
+        :param pass_fds: File descriptors inherited by the command at the
+                         same numbers.
+        :return: A dictionary of exit_code, timed_out, stalled, rusage,
+                 call_time, stdout and stderr of the command.
+        :raises: ForkServerError if the fork server is not running.
+        """
+        if self.process is None:
+            raise ForkServerError('Fork server is not running')
+
+        slot = [threading.Event()]
+        with self.lock:
+            request_id = next(self.ids)
+            self.pending[request_id] = slot
+            self.requests.send({
+                'id': request_id,
+                'argv': list(argv),
+                'timeout': timeout,
+                'cwd': os.getcwd() if cwd is None else cwd,
+                'env': env,
+                'stdin': stdin,
+                'stall_window': stall_window,
+                'limits': limits,
+                'cpus': None if cpus is None else sorted(cpus),
+                'fds': list(pass_fds),
+            })
+            if pass_fds:
+                try:
+                    _send_fds(self.channel, pass_fds)
+                except OSError:
+                    # e.g. a descriptor is closed, the server still expects
+                    # a message and fails the request
+                    self.channel.sendall(b'F')
+        slot[0].wait()
+        if len(slot) < 2:
+            raise ForkServerError('Fork server exited unexpectedly')
+        return slot[1]
+
+
+_SERVER = None
+_SERVER_LOCK = threading.Lock()
+
+
+def start():
+    """
+    Start the shared fork server used by utils.run().
+    """
+    global _SERVER
+    with _SERVER_LOCK:
+        if _SERVER is None:
+            server = ForkServer()
+            server.start()
+            _SERVER = server
+    return _SERVER
+
+
+def stop():
+    """
+    Stop the shared fork server.
+    """
+    global _SERVER
+    with _SERVER_LOCK:
+        if _SERVER is not None:
+            _SERVER.stop()
+            _SERVER = None
+
+
+def get_server():
+    """
+    Get the shared fork server, or None if it's not started.
+    """
+    return _SERVER
@@ -0,0 +1,114 @@
+import mmap
+import os
+import tempfile
+
+
+class PayloadError(Exception):
+    """
+    Class for payload specific exceptions.
+    """
+    pass
+
+
+def to_bytes(data):
+    """
+    Convert payload data to bytes. Strings of characters up to 255, such as
+    those generated by the Bytes symbol, are converted byte by byte.
+    """
+    if isinstance(data, bytes):
+        return data
+    if not isinstance(data, str):
+        data = str(data)
+    try:
+        return data.encode('latin-1')
+    except UnicodeEncodeError:
+        return data.encode('utf-8')
+
+
+def _shm_dir():
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+class Payload(object):
+    """
+    Large data delivered to a command other than through its command line,
+    to avoid ARG_MAX limits and copies through the command line.
+
+    A payload put in an argument list of utils.run() is delivered when the
+    command runs according to its mode:
+
+    - ``stdin``: streamed to the standard input of the command and removed
+      from the argument list;
+    - ``file``: written to a memory-mapped temporary file, preferably on
+      tmpfs, and replaced by the path of the file;
+    - ``fd``: written to an anonymous memory file inherited by the command
+      and replaced by its file descriptor number.
+    """
+    modes = ('stdin', 'file', 'fd')
+
+    def __init__(self, data, mode='stdin'):
+        """
+        :param data: Content of the payload.
+        :param mode: How the payload is delivered.
+        """
+        if mode not in self.modes:
+            raise PayloadError("Unknown payload mode '%s'" % mode)
+        self.data = to_bytes(data)
+        self.mode = mode
+        self.path = None
+        self.fd = None
+
+    def __repr__(self):
+        return '<%s %s %d bytes>' % (self.__class__.__name__, self.mode,
+                                     len(self.data))
+
+    def _write_mmap(self, fd):
+        size = len(self.data)
+        os.ftruncate(fd, size)
+        if size:
+            buf = mmap.mmap(fd, size)
+            try:
+                buf[:] = self.data
+            finally:
+                buf.close()
+
+    def open(self):
+        """
+        Prepare the payload for delivery.
+
+        :return: The argument replacing the payload, or None if the payload
+                 is removed from the argument list.
+        """
+        if self.mode == 'file':
+            fd, self.path = tempfile.mkstemp(prefix='dice-', dir=_shm_dir())
+            try:
+                self._write_mmap(fd)
+            finally:
+                os.close(fd)
+            return self.path
+        elif self.mode == 'fd':
+            if hasattr(os, 'memfd_create'):
+                self.fd = os.memfd_create('dice-payload')
+            else:
+                self.fd, path = tempfile.mkstemp(prefix='dice-',
+                                                 dir=_shm_dir())
+                os.unlink(path)
+            self._write_mmap(self.fd)
+            return str(self.fd)
+        return None
+
+    def close(self):
+        """
+        Clean up the delivered payload.
+        """
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.path = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
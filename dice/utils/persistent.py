@@ -0,0 +1,326 @@
+import errno
+import fcntl
+import os
+import select
+import signal
+import struct
+import subprocess
+import threading
+import time
+
+from . import CmdResult
+from . import join_argv
+
+
+class PersistentError(Exception):
+    """
+    Class for persistent process specific exceptions.
+    """
+    pass
+
+
+def _set_nonblock(fd):
+    fcntl.fcntl(fd, fcntl.F_SETFL,
+                fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+
+def _read(fd):
+    """
+    Read from a non-blocking file descriptor.
+
+    :return: Bytes read, b'' on EOF or None if nothing is available.
+    """
+    try:
+        return os.read(fd, 65536)
+    except OSError as detail:
+        if detail.errno != errno.EAGAIN:
+            raise
+        return None
+
+
+class PersistentProcess(object):
+    """
+    A long-running target processing many inputs sent to its standard input,
+    which saves spawning a process for every input.
+
+    With the ``line`` protocol, every input is a line and the target answers
+    with a line ``<exit code> <message>``. The message is taken as stdout if
+    the exit code is 0 and as stderr otherwise.
+
+    With the ``length`` protocol, every input is a little-endian uint32
+    length followed by the input bytes. The target answers with an int32
+    exit code followed by the uint32 length and bytes of stdout, then those
+    of stderr.
+
+    Anything the target writes to its stderr while processing an input is
+    appended to the stderr of the result. A target which hangs or answers
+    with a malformed response is killed and one which exits is restarted
+    before the next input. An input the line protocol can't frame, i.e. one
+    containing a newline, fails without being sent.
+    """
+    protocols = ('line', 'length')
+
+    def __init__(self, argv, protocol='line', env=None):
+        """
+        :param argv: List of the target program and its arguments.
+        :param protocol: Protocol framing inputs and responses.
+        :param env: Environment variables of the target.
+        """
+        if protocol not in self.protocols:
+            raise PersistentError("Unknown protocol '%s'" % protocol)
+        self.argv = [str(arg) for arg in argv]
+        self.protocol = protocol
+        self.env = env
+        self.process = None
+        self.buf = b''
+        self.err_eof = False
+        self.starts = 0
+
+    def start(self):
+        """
+        Start the target process.
+        """
+        self.process = subprocess.Popen(
+            self.argv,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+            env=self.env,
+        )
+        for fileobj in (self.process.stdin, self.process.stdout,
+                        self.process.stderr):
+            _set_nonblock(fileobj.fileno())
+        self.buf = b''
+        self.err_eof = False
+        self.starts += 1
+
+    def stop(self):
+        """
+        Kill the target process.
+        """
+        if self.process is None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.process.wait()
+        for fileobj in (self.process.stdin, self.process.stdout,
+                        self.process.stderr):
+            try:
+                fileobj.close()
+            except (IOError, OSError):
+                pass
+        self.process = None
+
+    def _frame(self, data):
+        if self.protocol == 'line':
+            return data + b'\n'
+        return struct.pack('<I', len(data)) + data
+
+    def _parse(self):
+        """
+        Parse a response from the stdout buffer.
+
+        :return: A tuple of exit code, stdout and stderr or None if the
+                 response is incomplete.
+        :raises: PersistentError if the response is malformed.
+        """
+        buf = self.buf
+        if self.protocol == 'line':
+            if b'\n' not in buf:
+                return None
+            line, self.buf = buf.split(b'\n', 1)
+            code, _, message = line.partition(b' ')
+            try:
+                code = int(code)
+            except ValueError:
+                raise PersistentError('Malformed response: %r' % line)
+            if code == 0:
+                return code, message, b''
+            return code, b'', message
+
+        if len(buf) < 8:
+            return None
+        code, out_len = struct.unpack('<iI', buf[:8])
+        if len(buf) < 12 + out_len:
+            return None
+        err_len, = struct.unpack('<I', buf[8 + out_len:12 + out_len])
+        end = 12 + out_len + err_len
+        if len(buf) < end:
+            return None
+        self.buf = buf[end:]
+        return code, buf[8:8 + out_len], buf[12 + out_len:end]
+
+    def _drain_stderr(self):
+        """
+        Discard what the target wrote to its stderr after its last response,
+        so it doesn't end up in the result of the next input.
+        """
+        if self.err_eof:
+            return
+        chunk = _read(self.process.stderr.fileno())
+        while chunk:
+            chunk = _read(self.process.stderr.fileno())
+        if chunk == b'':
+            self.err_eof = True
+
+    def request(self, data, timeout=10):
+        """
+        Send an input to the target and wait for its response.
+
+        :param data: Input bytes.
+        :param timeout: After which the target is killed.
+        :return: CmdResult of the input.
+        """
+        result = CmdResult('%s < %r' % (join_argv(self.argv), data[:256]))
+        if self.protocol == 'line' and b'\n' in data:
+            result.exit_code = 1
+            result.exit_status = "failure"
+            result.stderr = 'Input of line protocol contains a newline\n'
+            return result
+
+        if self.process is not None and self.process.poll() is not None:
+            self.stop()
+        if self.process is None:
+            self.start()
+        else:
+            self._drain_stderr()
+
+        pending = memoryview(self._frame(data))
+        err_chunks = []
+        process = self.process
+        out_fd = process.stdout.fileno()
+        err_fd = process.stderr.fileno()
+        in_fd = process.stdin.fileno()
+
+        start = time.time()
+        response = None
+        while response is None:
+            result.call_time = time.time() - start
+            if result.call_time > timeout:
+                result.exit_status = "timeout"
+                self.stop()
+                break
+
+            rlist = [out_fd] if self.err_eof else [out_fd, err_fd]
+            wlist = [in_fd] if pending else []
+            ready, writable, _ = select.select(rlist, wlist, [], 0.1)
+            if writable:
+                try:
+                    pending = pending[os.write(in_fd, pending[:65536]):]
+                except OSError as detail:
+                    if detail.errno not in (errno.EAGAIN, errno.EPIPE):
+                        raise
+                    if detail.errno == errno.EPIPE:
+                        pending = None
+
+            eof = False
+            for fd in ready:
+                chunk = _read(fd)
+                if chunk is None:
+                    continue
+                if not chunk:
+                    if fd == out_fd:
+                        eof = True
+                    else:
+                        self.err_eof = True
+                elif fd == out_fd:
+                    self.buf += chunk
+                else:
+                    err_chunks.append(chunk)
+
+            exited = eof or process.poll() is not None
+            if exited:
+                # Collect what the target wrote before exiting
+                for fd, chunks in ((out_fd, None), (err_fd, err_chunks)):
+                    chunk = _read(fd)
+                    while chunk:
+                        if chunks is None:
+                            self.buf += chunk
+                        else:
+                            chunks.append(chunk)
+                        chunk = _read(fd)
+
+            try:
+                response = self._parse()
+            except PersistentError as detail:
+                # The target doesn't follow the protocol anymore
+                result.exit_code = 1
+                result.exit_status = "failure"
+                err_chunks.append(str(detail).encode('utf-8') + b'\n')
+                self.stop()
+                break
+
+            if response is None and exited:
+                # The target crashed while processing the input
+                result.exit_code = process.wait()
+                result.exit_status = "failure"
+                self.stop()
+                break
+
+        if response is not None:
+            result.exit_code, stdout, stderr = response
+            result.stdout = stdout.decode('utf-8', 'replace')
+            err_chunks.insert(0, stderr)
+            if result.exit_code == 0:
+                result.exit_status = "success"
+            else:
+                result.exit_status = "failure"
+        result.stderr = b''.join(err_chunks).decode('utf-8', 'replace')
+        return result
+
+
+_LOCK = threading.Lock()
+_PROCESSES = []
+_LOCAL = threading.local()
+
+
+def get_process(key, argv, protocol='line'):
+    """
+    Get the persistent process of the calling thread for a target, so that
+    concurrent test threads never share a target.
+
+    :param key: Hashable key identifying the target.
+    :param argv: List of the target program and its arguments.
+    :param protocol: Protocol framing inputs and responses.
+    :return: A PersistentProcess object.
+    """
+    processes = getattr(_LOCAL, 'processes', None)
+    if processes is None:
+        processes = _LOCAL.processes = {}
+    if key not in processes:
+        process = PersistentProcess(argv, protocol=protocol)
+        processes[key] = process
+        with _LOCK:
+            _PROCESSES.append(process)
+    return processes[key]
+
+
+def stop_thread():
+    """
+    Stop the persistent processes of the calling thread, called when a
+    test thread exits.
+    """
+    processes = getattr(_LOCAL, 'processes', None)
+    if not processes:
+        return
+    _LOCAL.processes = {}
+    with _LOCK:
+        for process in processes.values():
+            if process in _PROCESSES:
+                _PROCESSES.remove(process)
+    for process in processes.values():
+        process.stop()
+
+
+def stop_all():
+    """
+    Stop the persistent processes of all the threads.
+    """
+    with _LOCK:
+        processes = _PROCESSES[:]
+        del _PROCESSES[:]
+    for process in processes:
+        process.stop()
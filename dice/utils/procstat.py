@@ -0,0 +1,152 @@
+import os
+import time
+
+
+# States of processes waiting for an event rather than running.
+SLEEP_STATES = ('S', 'D')
+
+# Resource usage recorded for commands, from struct rusage. Times are in
+# seconds, maxrss in kilobytes, the others are counts.
+RUSAGE_FIELDS = ('utime', 'stime', 'maxrss', 'nvcsw', 'nivcsw',
+                 'inblock', 'oublock')
+
+
+def rusage_dict(rusage):
+    """
+    Convert a resource usage returned by os.wait4() to a dictionary.
+
+    :param rusage: A resource.struct_rusage object.
+    :return: A dictionary keyed by RUSAGE_FIELDS.
+    """
+    return dict((name, getattr(rusage, 'ru_' + name))
+                for name in RUSAGE_FIELDS)
+
+
+def exit_code(status):
+    """
+    Convert a wait status to an exit code, negative for a signal like
+    subprocess does.
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def read_stat(pid):
+    """
+    Read the state and CPU usage of a process from /proc.
+
+    :param pid: Process ID.
+    :return: A tuple of state letter, process group ID and CPU time in clock
+             ticks, or None if the process is gone.
+    """
+    try:
+        with open('/proc/%d/stat' % pid, 'rb') as fp:
+            data = fp.read()
+    except (IOError, OSError):
+        return None
+    # The command name may contain spaces and parentheses
+    fields = data[data.rindex(b')') + 2:].split()
+    state = fields[0].decode('ascii')
+    pgrp = int(fields[2])
+    cpu = int(fields[11]) + int(fields[12])
+    return state, pgrp, cpu
+
+
+def _children(pid):
+    """
+    List the child processes of all the threads of a process.
+    """
+    children = []
+    try:
+        tids = os.listdir('/proc/%d/task' % pid)
+    except (IOError, OSError):
+        return children
+    for tid in tids:
+        try:
+            with open('/proc/%d/task/%s/children' % (pid, tid), 'rb') as fp:
+                children.extend(int(child) for child in fp.read().split())
+        except (IOError, OSError):
+            # The thread exited or the kernel doesn't list children
+            pass
+    return children
+
+
+def tree_stats(pid):
+    """
+    Read the states and CPU usage of a process and its descendants. Only
+    the tree of the process is walked instead of every process in /proc,
+    which keeps sampling cheap on a busy host.
+
+    :param pid: Process ID of the root of the tree.
+    :return: A list of tuples returned by read_stat().
+    """
+    stats = []
+    pending = [pid]
+    seen = set()
+    while pending:
+        pid = pending.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        stat = read_stat(pid)
+        if stat is not None:
+            stats.append(stat)
+            pending.extend(_children(pid))
+    return stats
+
+
+class StallDetector(object):
+    """
+    Detect a command blocked forever, e.g. on I/O or on a lock, long before
+    its timeout. The command is stalled when none of its processes has used
+    any CPU time or left a sleep state for a whole window.
+    """
+    def __init__(self, pid, window, interval=0.1):
+        """
+        :param pid: Process ID of the command, whose descendants are
+                    sampled along with it.
+        :param window: Seconds without progress after which the command is
+                       stalled.
+        :param interval: Minimum seconds between two samples of /proc.
+        """
+        self.pid = pid
+        self.window = window
+        self.interval = interval
+        self.cpu = None
+        self.last_progress = None
+        self.last_sample = None
+
+    @classmethod
+    def supported(cls):
+        """
+        Whether process states can be read from /proc on this system.
+        """
+        return os.path.exists('/proc/self/stat')
+
+    def check(self, now=None):
+        """
+        Sample the processes of the command and check whether it's
+        stalled.
+
+        :param now: Current time.
+        :return: True if the command made no progress during the
+                 window.
+        """
+        if now is None:
+            now = time.time()
+        if self.last_sample is not None and \
+                now - self.last_sample < self.interval:
+            return False
+        self.last_sample = now
+
+        stats = [stat for stat in tree_stats(self.pid) if stat[0] != 'Z']
+        if not stats:
+            return False
+        cpu = sum(stat[2] for stat in stats)
+        sleeping = all(stat[0] in SLEEP_STATES for stat in stats)
+        if self.last_progress is None or cpu != self.cpu or not sleeping:
+            self.cpu = cpu
+            self.last_progress = now
+            return False
+        return now - self.last_progress >= self.window
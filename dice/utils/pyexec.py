@@ -0,0 +1,225 @@
+import contextlib
+import io
+import multiprocessing
+import pickle
+import signal
+import threading
+import time
+import traceback
+
+from . import CmdResult
+
+
+def _describe(func, args, kwargs, limit=256):
+    params = [repr(arg) for arg in args]
+    params.extend('%s=%r' % (key, value)
+                  for key, value in sorted(kwargs.items()))
+    text = '%s(%s)' % (getattr(func, '__name__', repr(func)),
+                       ', '.join(params))
+    if len(text) > limit:
+        text = text[:limit - 3] + '...'
+    return text
+
+
+def _worker_main(conn):
+    """
+    Main loop of a worker process calling the functions sent to it.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+
+        func, args, kwargs = task
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        value = None
+        failed = False
+        with contextlib.redirect_stdout(stdout), \
+                contextlib.redirect_stderr(stderr):
+            try:
+                value = func(*args, **kwargs)
+            # pylint: disable=broad-except
+            except BaseException:
+                failed = True
+                traceback.print_exc()
+
+        try:
+            value = pickle.loads(pickle.dumps(value))
+        # pylint: disable=broad-except
+        except Exception:
+            value = repr(value)
+        conn.send((failed, value, stdout.getvalue(), stderr.getvalue()))
+
+
+class _Worker(object):
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+    def retire(self):
+        try:
+            self.conn.send(None)
+        except (IOError, OSError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+class WorkerPool(object):
+    """
+    Pool of worker processes calling Python functions for items, so that
+    crashes, hangs and leaks of the tested code never affect DICE itself.
+    Workers are forked from DICE, so functions of provider modules are
+    available to them, and are recycled after a number of calls.
+    """
+    def __init__(self, size=None, max_tasks=1000):
+        """
+        :param size: Maximum number of worker processes. Default to the
+                     number of CPUs.
+        :param max_tasks: Number of calls after which a worker is replaced.
+        """
+        try:
+            self.ctx = multiprocessing.get_context('fork')
+        except AttributeError:
+            self.ctx = multiprocessing
+        self.size = size or multiprocessing.cpu_count()
+        self.max_tasks = max_tasks
+        self.lock = threading.Lock()
+        self.slots = threading.Semaphore(self.size)
+        self.idle = []
+
+    def _acquire(self):
+        self.slots.acquire()
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return _Worker(self.ctx)
+
+    def _release(self, worker):
+        if worker is not None:
+            if worker.tasks >= self.max_tasks:
+                worker.retire()
+            else:
+                with self.lock:
+                    self.idle.append(worker)
+        self.slots.release()
+
+    def call(self, func, args=(), kwargs=None, timeout=10):
+        """
+        Call a function in a worker process.
+
+        :param func: A picklable function to call.
+        :param args: Positional arguments of the function.
+        :param kwargs: Keyword arguments of the function.
+        :param timeout: After which the worker is killed.
+        :return: CmdResult of the call. The stdout and stderr are those
+                 printed by the function, an exception raised is a failure
+                 with its traceback in stderr, and the returned value is
+                 stored as ``value``. A function or arguments which can't
+                 be pickled are a failure too.
+        """
+        if kwargs is None:
+            kwargs = {}
+        result = CmdResult(_describe(func, args, kwargs))
+        result.value = None
+
+        worker = self._acquire()
+        start = time.time()
+        try:
+            try:
+                # The task is pickled whole before being written, so the
+                # worker stays usable
+                worker.conn.send((func, args, kwargs))
+            except (pickle.PicklingError, AttributeError, TypeError) as detail:
+                result.exit_code = 1
+                result.exit_status = "failure"
+                result.stderr = 'Failed to send %s to worker: %s\n' % (
+                    result.cmdline, detail)
+                return result
+            worker.tasks += 1
+            if not worker.conn.poll(timeout):
+                result.call_time = time.time() - start
+                result.exit_status = "timeout"
+                worker.kill()
+                worker = None
+                return result
+            failed, value, stdout, stderr = worker.conn.recv()
+        except (EOFError, IOError, OSError):
+            # The worker died with the function
+            worker.process.join()
+            result.call_time = time.time() - start
+            result.exit_code = worker.process.exitcode
+            result.exit_status = "failure"
+            worker.kill()
+            worker = None
+            return result
+        finally:
+            self._release(worker)
+
+        result.call_time = time.time() - start
+        result.value = value
+        result.stdout = stdout
+        result.stderr = stderr
+        if failed:
+            result.exit_code = 1
+            result.exit_status = "failure"
+        else:
+            result.exit_code = 0
+            result.exit_status = "success"
+        return result
+
+    def close(self):
+        """
+        Stop all the idle workers.
+        """
+        with self.lock:
+            workers, self.idle = self.idle, []
+        for worker in workers:
+            worker.retire()
+
+
+_POOL = None
+
+
+def start(size=None, max_tasks=1000):
+    """
+    Start the shared worker pool used by Python items.
+    """
+    global _POOL
+    if _POOL is None:
+        _POOL = WorkerPool(size=size, max_tasks=max_tasks)
+    return _POOL
+
+
+def stop():
+    """
+    Stop the shared worker pool.
+    """
+    global _POOL
+    if _POOL is not None:
+        _POOL.close()
+        _POOL = None
+
+
+def get_pool():
+    """
+    Get the shared worker pool, starting it with default settings if needed.
+    """
+    return start()
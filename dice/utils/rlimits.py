@@ -0,0 +1,109 @@
+import re
+import resource
+import signal
+
+
+class RLimitError(Exception):
+    """
+    Class for resource limit specific exceptions.
+    """
+    pass
+
+
+# Limits applied to commands, keyed by the names used in limit dictionaries.
+# Sizes are in bytes and CPU time in seconds. RLIMIT_NPROC counts all the
+# processes of the user, not only those of the command.
+RESOURCES = {
+    'as': resource.RLIMIT_AS,
+    'cpu': resource.RLIMIT_CPU,
+    'nproc': resource.RLIMIT_NPROC,
+    'fsize': resource.RLIMIT_FSIZE,
+    'core': resource.RLIMIT_CORE,
+}
+
+# Exit statuses of commands stopped by a resource limit.
+STATUSES = ('oom', 'cpu_limit', 'fsize_limit', 'nproc_limit')
+
+_OOM_PATTERN = re.compile(
+    r'Cannot allocate memory|[Oo]ut of memory|MemoryError|bad_alloc|'
+    r'memory exhausted')
+_NPROC_PATTERN = re.compile(
+    r'Resource temporarily unavailable|[Cc]annot fork|fork: retry')
+
+
+def check(limits):
+    """
+    Check names and values of resource limits.
+
+    :param limits: Dictionary of limits keyed by RESOURCES names.
+    :raises: RLimitError if a limit is unknown or negative.
+    """
+    for name, value in limits.items():
+        if name not in RESOURCES:
+            raise RLimitError("Unknown resource limit '%s'" % name)
+        if value is not None and value < 0:
+            raise RLimitError("Negative resource limit '%s'" % name)
+
+
+def apply(limits):
+    """
+    Apply resource limits to the current process. Called in the forked
+    child of the fork server right before executing a command.
+
+    :param limits: Dictionary of limits keyed by RESOURCES names. None
+                   values are skipped.
+    """
+    for name, value in limits.items():
+        if value is None:
+            continue
+        res = RESOURCES[name]
+        _, hard = resource.getrlimit(res)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        resource.setrlimit(res, (int(value), hard))
+
+
+def _signaled(code, sig):
+    """
+    Tell whether an exit code comes from a signal, either directly or
+    through a shell exiting with 128 plus the signal number.
+    """
+    return code in (-sig, 128 + sig)
+
+
+def classify(result, limits):
+    """
+    Tell whether a failed command has been stopped by a resource limit, from
+    its exit signal, resource usage and error output.
+
+    :param result: CmdResult of the command.
+    :param limits: Dictionary of limits applied to the command.
+    :return: One of "oom", "cpu_limit", "fsize_limit" and "nproc_limit", or
+             None if no limit is hit.
+    """
+    code = result.exit_code
+    rusage = result.rusage or {}
+    if limits.get('cpu') is not None:
+        cpu_time = rusage.get('utime', 0) + rusage.get('stime', 0)
+        if _signaled(code, signal.SIGXCPU) or \
+                (_signaled(code, signal.SIGKILL) and
+                 cpu_time >= limits['cpu']):
+            return 'cpu_limit'
+    if limits.get('fsize') is not None and _signaled(code, signal.SIGXFSZ):
+        return 'fsize_limit'
+    if limits.get('as') is not None:
+        # An error message alone may be what the target prints for a bad
+        # input, so the command must also have crashed or used memory up
+        # to the limit. Unchecked allocation failures usually end with a
+        # crash too.
+        crashed = any(_signaled(code, sig) for sig in
+                      (signal.SIGSEGV, signal.SIGABRT, signal.SIGBUS))
+        near_limit = rusage.get('maxrss', 0) * 1024 >= limits['as'] / 2
+        if _OOM_PATTERN.search(result.stderr) and (crashed or near_limit):
+            return 'oom'
+        if crashed and near_limit:
+            return 'oom'
+    if limits.get('nproc') is not None and \
+            _NPROC_PATTERN.search(result.stderr):
+        return 'nproc_limit'
+    return None
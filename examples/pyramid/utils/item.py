@@ -1,11 +1,9 @@
 import os
 
 from dice.core import item
-from dice import utils
 
 
 class Item(item.ItemBase):
     def run(self):
-        cmdline = os.path.join(self.provider.path, 'pyramid')
-        cmdline += ' %s' % utils.escape(str(self.get('option')))
-        self.res = utils.run(cmdline)
+        program = os.path.join(self.provider.path, 'pyramid')
+        self.res = self.execute(self.argv(program, args=['option']))
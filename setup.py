@@ -46,6 +46,11 @@ setup(
     long_description=__doc__,
     scripts=['scripts/dice'],
     packages=get_packages(),
+    python_requires='>=3.5',
+    classifiers=[
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+    ],
     # Config file will be introduced later.
     # Currently this does nothing but fail rtd build.
 )
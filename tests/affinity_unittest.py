@@ -0,0 +1,52 @@
+import os
+import unittest
+
+from dice import utils
+from dice.utils import affinity
+from dice.utils import forkserver
+
+
+class PlanTest(unittest.TestCase):
+    def test_plan(self):
+        cpus = set(range(8))
+        reserved, sets = affinity.plan(3, cpus=cpus)
+        self.assertTrue(reserved)
+        self.assertEqual(len(sets), 3)
+        for cpu_set in sets:
+            self.assertTrue(cpu_set)
+            self.assertFalse(cpu_set & reserved)
+
+    def test_oversubscribed(self):
+        reserved, sets = affinity.plan(4, cpus=set([0]))
+        self.assertEqual(reserved, set([0]))
+        self.assertEqual(sets, [set([0])] * 4)
+
+
+@unittest.skipUnless(affinity.supported(), 'requires sched_setaffinity')
+class PinTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = os.sched_getaffinity(0)
+
+    def tearDown(self):
+        affinity.pin(self.saved)
+
+    def _check_pinned(self):
+        cpu = min(self.saved)
+        affinity.pin(set([cpu]))
+        self.assertEqual(affinity.current(), set([cpu]))
+        res = utils.run(['grep', 'Cpus_allowed_list', '/proc/self/status'])
+        self.assertEqual(res.stdout.split()[-1], str(cpu))
+
+    def test_pin(self):
+        self._check_pinned()
+
+    def test_pin_forkserver(self):
+        forkserver.start()
+        try:
+            self._check_pinned()
+        finally:
+            forkserver.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from dice import utils
+from dice.core import constraint
+from dice.core import item
+from dice.utils import cache
+
+
+class CacheableTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def _helper(self, *args, **kwargs):
+        def helper(value, extra=()):
+            self.calls.append(value)
+            return [value, len(self.calls)]
+        return utils.cacheable(*args, **kwargs)(helper)
+
+    def test_memoize(self):
+        helper = self._helper()
+        self.assertEqual(helper(1), [1, 1])
+        self.assertEqual(helper(1), [1, 1])
+        self.assertEqual(helper(2), [2, 2])
+        # Unhashable arguments are keyed by their values
+        self.assertEqual(helper(1, extra=[1]), [1, 3])
+        self.assertEqual(helper(1, extra=[1]), [1, 3])
+        self.assertEqual((helper.hits, helper.misses), (2, 3))
+        self.assertEqual(helper.__name__, 'helper')
+
+    def test_bare(self):
+        @utils.cacheable
+        def helper():
+            self.calls.append(None)
+        helper()
+        helper()
+        self.assertEqual(len(self.calls), 1)
+
+    def test_ttl(self):
+        helper = self._helper(ttl=0.05)
+        helper(1)
+        helper(1)
+        self.assertEqual(len(self.calls), 1)
+        time.sleep(0.1)
+        helper(1)
+        self.assertEqual(len(self.calls), 2)
+        self.assertRaises(cache.CacheError, cache.cacheable, -1)
+
+    def test_invalidate(self):
+        helper = self._helper()
+        helper(1)
+        helper(2)
+        helper.invalidate(1)
+        helper(1)
+        helper(2)
+        self.assertEqual(self.calls, [1, 2, 1])
+        cache.invalidate_all()
+        helper(2)
+        self.assertEqual(self.calls, [1, 2, 1, 2])
+
+    def test_threads(self):
+        event = threading.Event()
+
+        @utils.cacheable
+        def helper(value):
+            event.wait()
+            self.calls.append(value)
+            return value
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(helper(1)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        event.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(results, [1] * 8)
+
+    def test_shared(self):
+        directory = tempfile.mkdtemp()
+        try:
+            helper = self._helper(shared=True, directory=directory)
+            other = self._helper(shared=True, directory=directory)
+            self.assertEqual(helper(1), [1, 1])
+            # Another process would load the same result from the file
+            self.assertEqual(other(1), [1, 1])
+            self.assertEqual(len(self.calls), 1)
+            helper.invalidate()
+            self.assertEqual(other.__class__(other.func, shared=True,
+                                             directory=directory)(1),
+                             [1, 2])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_shared_directory(self):
+        directory = tempfile.mkdtemp()
+        try:
+            os.chmod(directory, 0o777)
+            helper = self._helper(shared=True, directory=directory)
+            self.assertRaises(cache.CacheError, helper, 1)
+            self.assertEqual(self.calls, [])
+
+            os.chmod(directory, 0o700)
+            # Files not written as JSON are ignored
+            with open(helper._path(helper._key((1,), {})), 'w') as fp:
+                fp.write('garbage')
+            self.assertEqual(helper(1), [1, 1])
+        finally:
+            shutil.rmtree(directory)
+
+
+HELPER_ORACLE = """
+if /name not in helpers.names():
+    if /name != 'c':
+        return success()
+"""
+
+
+class _Provider(object):
+    name = 'cachetest'
+
+
+class CachedHelperTraceTest(unittest.TestCase):
+    def setUp(self):
+        self.mod_name = 'cachetest_utils.helpers'
+        self.calls = []
+        helpers = type(sys)('helpers')
+
+        @utils.cacheable
+        def names():
+            self.calls.append(None)
+            return ['a', 'b']
+        helpers.names = names
+        sys.modules[self.mod_name] = helpers
+
+    def tearDown(self):
+        del sys.modules[self.mod_name]
+
+    def test_not_mutated(self):
+        cstr = constraint.Constraint('name', _Provider(),
+                                     oracle=HELPER_ORACLE)
+        for _ in range(20):
+            itm = item.ItemBase(None)
+            cstr.apply(itm)
+            self.assertNotIn(itm.get('/name'), ['a', 'b', 'c'])
+        self.assertEqual(sys.modules[self.mod_name].names(), ['a', 'b'])
+        self.assertEqual(len(self.calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+
+from dice import utils
+from dice.client import concurrency
+
+
+def _result(cpu_time, call_time):
+    res = utils.CmdResult('dummy')
+    res.call_time = call_time
+    res.rusage = {'utime': cpu_time, 'stime': 0.0}
+    return res
+
+
+class ConcurrencyControllerTest(unittest.TestCase):
+    def setUp(self):
+        # Decisions shouldn't depend on the load of the test host
+        self.load = concurrency._load
+        concurrency._load = lambda sampler: 0.0
+
+    def tearDown(self):
+        concurrency._load = self.load
+
+    def _run(self, controller, rates, cpu_ratio):
+        now = controller.last_update
+        for rate in rates:
+            for _ in range(rate):
+                controller.record(_result(cpu_ratio * 0.1, 0.1))
+            now += controller.interval
+            controller.update(now)
+
+    def test_grow_sleepy(self):
+        controller = concurrency.ConcurrencyController(max_jobs=8)
+        controller.cpus = 2
+        self._run(controller, [10, 20, 30, 40], cpu_ratio=0.01)
+        self.assertEqual(controller.jobs, 5)
+        self.assertEqual(controller.metrics()['concurrency_grows'], 4)
+
+    def test_cpu_ceiling(self):
+        controller = concurrency.ConcurrencyController(jobs=3, max_jobs=8)
+        controller.cpus = 2
+        self._run(controller, [10, 10], cpu_ratio=1.0)
+        self.assertEqual(controller.jobs, 1)
+        self.assertEqual(controller.last_decision, 'shrink (cpu)')
+
+    def test_back_off(self):
+        controller = concurrency.ConcurrencyController(max_jobs=8)
+        controller.cpus = 100
+        self._run(controller, [10, 20, 10, 10], cpu_ratio=0.01)
+        self.assertEqual(controller.jobs, 2)
+        self.assertEqual(controller.last_decision, 'hold (cooldown)')
+
+    def test_fixed(self):
+        controller = concurrency.ConcurrencyController(jobs=3, adaptive=False)
+        self._run(controller, [10, 20], cpu_ratio=0.01)
+        self.assertEqual(controller.jobs, 3)
+
+
+class CpuLoadTest(unittest.TestCase):
+    def _write(self, lines):
+        with open(self.path, 'w') as fp:
+            fp.write('\n'.join(lines) + '\n')
+
+    def test_sample(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+        self._write(['cpu  300 0 0 300 0 0 0 0 0 0',
+                     'cpu0 100 0 0 100 0 0 0 0 0 0',
+                     'cpu1 100 0 0 100 0 0 0 0 0 0',
+                     'cpu2 100 0 0 100 0 0 0 0 0 0',
+                     'intr 1234'])
+        load = concurrency.CpuLoad({0, 1}, path=self.path)
+        # CPU 0 fully busy, CPU 1 half busy, CPU 2 not watched
+        self._write(['cpu  500 0 0 400 0 0 0 0 0 0',
+                     'cpu0 200 0 0 100 0 0 0 0 0 0',
+                     'cpu1 150 0 0 150 0 0 0 0 0 0',
+                     'cpu2 100 0 0 200 0 0 0 0 0 0'])
+        self.assertAlmostEqual(load.sample(), 1.5)
+        self.assertEqual(load.sample(), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,415 @@
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+from dice.core import constraint
+from dice.core import coverage
+from dice.core import item
+from dice.core import provider
+from dice.core import symbol
+from dice.core import trace
+
+PYRAMID_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'examples', 'pyramid')
+
+
+def expected_patts(option):
+    if not isinstance(option, int):
+        return {'Invalid number'}
+    if option < 0:
+        return {'Min input is 0'}
+    if option > 9223372036854775808:
+        return {'Number overflow'}
+    if option > 1000:
+        return {'Max input is 1000'}
+    return set()
+
+
+class GenerateManyTest(unittest.TestCase):
+    def setUp(self):
+        self.provider = provider.Provider(PYRAMID_PATH)
+
+    def test_generate_many(self):
+        items = list(self.provider.generate_many(500, batch_size=64))
+        self.assertEqual(len(items), 500)
+        for item in items:
+            option = item.get('option')
+            self.assertEqual(item.fail_patts, expected_patts(option))
+
+    def test_generate(self):
+        for _ in range(100):
+            item = self.provider.generate()
+            option = item.get('option')
+            self.assertEqual(item.fail_patts, expected_patts(option))
+
+
+class MutateTest(unittest.TestCase):
+    def test_mutate(self):
+        prvdr = provider.Provider(PYRAMID_PATH)
+        changed = 0
+        for parent in prvdr.generate_many(300):
+            parent_options = dict(parent.options)
+            mutant = prvdr.mutate(parent)
+            self.assertEqual(parent.options, parent_options)
+            option = mutant.get('option')
+            self.assertEqual(mutant.fail_patts, expected_patts(option))
+            self.assertEqual(len(mutant.traces), 1)
+            self.assertEqual(list(mutant.solved), ['option'])
+            if option != parent.get('option'):
+                changed += 1
+        self.assertGreater(changed, 200)
+
+    def test_perturb(self):
+        sym = symbol.Integer()
+        sym.narrow(minimum=0, maximum=1000)
+        sym.excs = [500]
+        for _ in range(200):
+            res = sym.mutate(499)
+            self.assertTrue(0 <= res <= 1000)
+            self.assertNotEqual(res, 500)
+
+        sym = symbol.NonEmptyBytes()
+        for _ in range(50):
+            self.assertTrue(sym.mutate('a'))
+        sym = symbol.String(scope=['a', 'b'])
+        self.assertIn(sym.mutate('a'), ['a', 'b'])
+
+
+RECONSTRAIN_ORACLES = """
+- name: a
+  oracle: |
+      if /a < 0:
+          return FAIL('negative a')
+      else:
+          return SUCCESS()
+- name: b
+  oracle: |
+      /b in helpers.above(/a)
+- name: c
+  require: a is SUCCESS
+  oracle: |
+      /c is String
+"""
+
+
+REGISTRY_ORACLES = """
+- name: addr
+  oracle: |
+      if /addr is Ip:
+          if /addr != '10.0.0.1':
+              return SUCCESS()
+"""
+
+
+class _Provider(object):
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+
+
+class ReconstrainTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.path, 'oracles'))
+        with open(os.path.join(self.path, 'oracles', 'test.yaml'), 'w') as fp:
+            fp.write(RECONSTRAIN_ORACLES)
+        helpers = types.ModuleType('helpers')
+        helpers.above = lambda value: list(range(value + 1, value + 5))
+        self.mod_name = 'reconstrain_utils.helpers'
+        sys.modules[self.mod_name] = helpers
+        self.manager = constraint.ConstraintManager(
+            _Provider('reconstrain', self.path))
+
+    def tearDown(self):
+        del sys.modules[self.mod_name]
+        shutil.rmtree(self.path)
+
+    def test_reconstrain(self):
+        # Reads are known before any trace is applied
+        self.assertEqual(self.manager.reads['b'], {'/a'})
+        self.assertEqual(self.manager.reads['c'], set())
+        itm = item.ItemBase(None)
+        self.manager.constrain(itm)
+
+        a = self.manager.by_name['a']
+        self.manager._unsolve(itm, 'a')
+        a._assign(itm, a.passes[0], {'DPATH_a': 100})
+        self.manager.reconstrain(itm, ['/a'], changed=['a'])
+        self.assertIn(itm.get('/b'), range(101, 105))
+        c_value = itm.get('/c')
+        self.assertIsNotNone(c_value)
+
+        itm.set('/a', 200)
+        self.manager.reconstrain(itm, ['/a'])
+        self.assertIn(itm.get('/b'), range(201, 205))
+        self.assertEqual(itm.get('/c'), c_value)
+
+        self.manager._unsolve(itm, 'a')
+        a._assign(itm, a.fails[0], {'DPATH_a': -3})
+        self.manager.reconstrain(itm, ['/a'], changed=['a'])
+        self.assertIn(itm.get('/b'), range(-2, 2))
+        self.assertNotIn('c', itm.solved)
+        self.assertIsNone(itm.get('/c'))
+        self.assertEqual(itm.fail_patts, {'negative a'})
+
+
+REGISTRY_ITEM = """
+from dice.core import item
+
+
+class Item(item.ItemBase):
+    def run(self):
+        pass
+"""
+
+REGISTRY_SYMBOLS = """
+import random
+
+from dice.core import symbol
+from dice.core import trace
+
+
+class Ip(symbol.String):
+    def generate(self):
+        return '10.0.0.%d' % random.randint(1, 254)
+"""
+
+
+class SymbolRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'registry')
+        for folder in ('oracles', 'utils'):
+            os.makedirs(os.path.join(self.path, folder))
+        for name, content in [('oracles/test.yaml', REGISTRY_ORACLES),
+                              ('utils/item.py', REGISTRY_ITEM),
+                              ('utils/net.py', REGISTRY_SYMBOLS)]:
+            with open(os.path.join(self.path, name), 'w') as fp:
+                fp.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.path))
+
+    def test_provider_symbol(self):
+        prvdr = provider.Provider(self.path)
+        self.assertIn('Ip', prvdr.symbols)
+        self.assertNotIn('Ip', symbol.SYMBOLS)
+        for itm in prvdr.generate_many(20):
+            self.assertTrue(itm.get('/addr').startswith('10.0.0.'))
+            self.assertNotEqual(itm.get('/addr'), '10.0.0.1')
+
+    def test_register(self):
+        self.assertIs(symbol.SYMBOLS['Integer'], symbol.Integer)
+        registry = {}
+        symbol.register(symbol.Integer, registry=registry)
+        self.assertRaises(symbol.SymbolError, symbol.register,
+                          symbol.String, 'Integer', registry)
+        self.assertRaises(symbol.SymbolError, symbol.register, int)
+
+
+class TraceSelectorTest(unittest.TestCase):
+    def test_reward(self):
+        prvdr = provider.Provider(PYRAMID_PATH)
+        manager = prvdr.constraint_manager
+        manager.set_selector('thompson')
+        for _ in range(20):
+            for item in prvdr.generate_many(100):
+                novel = item.fail_patts == {'Min input is 0'}
+                manager.reward(item, 1.0 if novel else 0.0)
+
+        items = list(prvdr.generate_many(1000))
+        fails = [item for item in items if item.fail_patts]
+        favored = [item for item in fails
+                   if item.fail_patts == {'Min input is 0'}]
+        self.assertGreater(len(favored), len(fails) * 0.6)
+
+
+PRUNED_ORACLE = """
+if x > 10:
+    if x < 5:
+        return fail('never')
+    else:
+        return success()
+else:
+    if x == 3:
+        if x == 4:
+            return fail('never')
+        else:
+            return fail('three')
+    else:
+        return fail('small')
+"""
+
+
+ALL_PRUNED_ORACLE = """
+if x > 3:
+    if x < 2:
+        return success()
+"""
+
+
+FALLBACK_ORACLE = """
+if x < 0:
+    return fail('negative')
+elif x > 100:
+    return fail('big')
+elif x > 50:
+    return success()
+else:
+    return success()
+"""
+
+
+class FallbackTest(unittest.TestCase):
+    def setUp(self):
+        self.constraint = constraint.Constraint('f', None,
+                                                oracle=FALLBACK_ORACLE)
+        for idx, t in enumerate(self.constraint.traces):
+            t.id = idx
+        self.constraint.coverage = coverage.TraceCoverage(
+            self.constraint.traces)
+        self.unsat = set()
+        solve = self.constraint._solve
+
+        def _solve(t, items):
+            if t in self.unsat:
+                self.constraint.coverage.solve_failed(t)
+                raise trace.UnsatisfiableError('unsat')
+            return solve(t, items)
+        self.constraint._solve = _solve
+
+    def test_same_result_first(self):
+        fails = self.constraint.fails
+        passes = self.constraint.passes
+        self.unsat.add(passes[0])
+        for _ in range(20):
+            itm = item.ItemBase(None)
+            self.assertEqual(
+                self.constraint._apply_trace(itm, passes[0]), 'success')
+            self.assertEqual(itm.traces, [passes[1].key])
+        # Solving counts every attempt, selecting only the chosen trace
+        cov = self.constraint.coverage
+        self.assertEqual(cov.get(passes[0], 'solve_failures'), 20)
+        self.assertEqual(cov.get(passes[1], 'solve_failures'), 0)
+        self.assertEqual(cov.get(passes[0], 'selected'), 0)
+
+        # The other result only when none with the same result works
+        self.unsat.update(passes)
+        itm = item.ItemBase(None)
+        self.assertEqual(self.constraint._apply_trace(itm, passes[0]),
+                         'fail')
+        self.assertIn(itm.traces[0], [t.key for t in fails])
+
+    def test_batch_failure(self):
+        passes = self.constraint.passes
+        self.unsat.add(passes[0])
+        self.constraint._choose_many = lambda count: [passes[0]] * count
+        items = [item.ItemBase(None) for _ in range(10)]
+        self.assertEqual(self.constraint.apply_many(items),
+                         ['success'] * 10)
+        self.assertTrue(all(itm.traces == [passes[1].key] for itm in items))
+        # The failed batch isn't solved again for every item
+        cov = self.constraint.coverage
+        self.assertEqual(cov.get(passes[0], 'solve_failures'), 1)
+
+    def test_select(self):
+        self.unsat.update(self.constraint.traces)
+        chosen = self.constraint._choose()
+        self.assertEqual(self.constraint._apply_trace(item.ItemBase(None),
+                                                      chosen), 'skipped')
+        self.assertEqual(self.constraint.coverage.get(chosen, 'selected'), 1)
+
+
+class PruneTest(unittest.TestCase):
+    def setUp(self):
+        with self.assertLogs('dice.core.constraint', 'WARNING') as logs:
+            self.constraint = constraint.Constraint('c', None,
+                                                    oracle=PRUNED_ORACLE)
+        self.warnings = logs.output
+
+    def test_pruned(self):
+        keys = [t.key for t in self.constraint.traces]
+        self.assertEqual(keys, ['c:1', 'c:3', 'c:4'])
+        self.assertEqual([t.key for t in self.constraint.all_traces
+                          if t.pruned], ['c:0', 'c:2'])
+        self.assertEqual(len(self.warnings), 2)
+        self.assertEqual(len(self.constraint.passes), 1)
+        for t in self.constraint.traces:
+            self.assertIsNotNone(t.domains)
+
+    def test_apply(self):
+        for _ in range(200):
+            itm = item.ItemBase(None)
+            result = self.constraint.apply(itm)
+            x = itm.get('x')
+            if result == 'success':
+                self.assertGreater(x, 10)
+            elif itm.fail_patts == {'three'}:
+                self.assertEqual(x, 3)
+            else:
+                self.assertLessEqual(x, 10)
+                self.assertNotEqual(x, 3)
+
+    def test_all_pruned(self):
+        with self.assertLogs('dice.core.constraint', 'WARNING'):
+            self.assertRaises(constraint.ConstraintError,
+                              constraint.Constraint, 'c', None,
+                              oracle=ALL_PRUNED_ORACLE)
+
+    def test_reduce(self):
+        sym = symbol.Integer()
+        sym.narrow(minimum=1, maximum=5)
+        sym.narrow(minimum=0, maximum=2)
+        sym.excs = [1]
+        self.assertTrue(sym.reduce())
+        self.assertEqual(set(sym.model_many(100)), {2})
+        sym.excs = [1, 2]
+        self.assertFalse(sym.reduce())
+
+
+class IntegerModelManyTest(unittest.TestCase):
+    def test_bounds(self):
+        sym = symbol.Integer()
+        sym.minimum = -5
+        sym.maximum = 20
+        for res in sym.model_many(1000):
+            self.assertTrue(-5 <= res <= 20)
+
+    def test_exclusions(self):
+        sym = symbol.Integer()
+        sym.minimum = -3
+        sym.maximum = 3
+        sym.excs = [-3, 0, 2, 3, 7]
+        self.assertEqual(sym._intervals(sym._exclusions()),
+                         [(-2, -1), (1, 1)])
+        results = set(sym.model_many(1000)) | set(
+            sym.model() for _ in range(1000))
+        self.assertEqual(results, {-2, -1, 1})
+
+    def test_far_bounds(self):
+        sym = symbol.Integer()
+        sym.minimum = 10 ** 12
+        sym.maximum = 10 ** 12 + 5
+        for res in sym.model_many(100) + [sym.model() for _ in range(100)]:
+            self.assertTrue(10 ** 12 <= res <= 10 ** 12 + 5)
+        sym.maximum = None
+        for res in sym.model_many(100):
+            self.assertGreaterEqual(res, 10 ** 12)
+
+    def test_empty(self):
+        sym = symbol.String(scope=['a', 'b'], excs=['b', 'a'])
+        self.assertFalse(sym.reduce())
+        self.assertRaises(symbol.EmptyDomainError, sym.model)
+        sym = symbol.Integer()
+        sym.minimum = 1
+        sym.maximum = 1
+        sym.excs = [1]
+        self.assertRaises(symbol.EmptyDomainError, sym.model)
+        self.assertRaises(symbol.EmptyDomainError, sym.model_many, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import unittest
+
+from dice.core import constraint
+from dice.core import coverage
+from dice.core import provider
+
+PYRAMID_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'examples', 'pyramid')
+
+PRUNED_ORACLE = """
+if x > 3:
+    if x < 2:
+        return fail('never')
+    else:
+        return success()
+"""
+
+
+class TraceCoverageTest(unittest.TestCase):
+    def setUp(self):
+        self.provider = provider.Provider(PYRAMID_PATH)
+        self.manager = self.provider.constraint_manager
+
+    def test_counters(self):
+        items = list(self.provider.generate_many(200))
+        items.append(self.provider.generate())
+        traces = self.manager.coverage.traces
+        self.assertEqual(
+            sum(self.manager.coverage.get(t, 'selected') for t in traces),
+            201)
+
+        for item in items:
+            self.manager.record_outcome(item, 'success')
+        self.manager.record_outcome(items[0], 'unknown')
+        data = self.manager.coverage.serialize()
+        counts = [t['counts'] for t in data['traces']]
+        self.assertEqual(sum(c['success'] for c in counts), 201)
+        self.assertEqual(sum(c['other'] for c in counts), 1)
+        self.assertTrue(all(t['solve_time'] >= 0 for t in data['traces']))
+
+    def test_report(self):
+        text = coverage.report({'pyramid': self.manager.coverage.serialize()})
+        self.assertIn('Provider pyramid', text)
+        self.assertEqual(text.count('UNREACHED'),
+                         len(self.manager.coverage.traces))
+
+        list(self.provider.generate_many(200))
+        text = coverage.report({'pyramid': self.manager.coverage.serialize()},
+                               unreached_only=True)
+        self.assertIn('NEVER RUN', text)
+
+    def test_pruned(self):
+        with self.assertLogs('dice.core.constraint', 'WARNING'):
+            cstr = constraint.Constraint('c', None, oracle=PRUNED_ORACLE)
+        for idx, t in enumerate(cstr.all_traces):
+            t.id = idx
+        data = coverage.TraceCoverage(cstr.all_traces).serialize()
+        self.assertEqual([t['pruned'] for t in data['traces']],
+                         [True, False])
+        text = coverage.report({'c': data}, unreached_only=True)
+        self.assertIn('c:0', text)
+        self.assertIn('PRUNED', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
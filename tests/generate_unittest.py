@@ -0,0 +1,108 @@
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+from dice.client import generate
+
+PYRAMID_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'examples', 'pyramid')
+
+
+def _decode_bin_value(data, pos):
+    tag = data[pos:pos + 1]
+    pos += 1
+    if tag == b'n':
+        return None, pos
+    elif tag == b'b':
+        return data[pos:pos + 1] == b'\x01', pos + 1
+    elif tag == b'l':
+        count, = struct.unpack('<I', data[pos:pos + 4])
+        pos += 4
+        values = []
+        for _ in range(count):
+            value, pos = _decode_bin_value(data, pos)
+            values.append(value)
+        return values, pos
+    length, = struct.unpack('<I', data[pos:pos + 4])
+    raw = data[pos + 4:pos + 4 + length]
+    pos += 4 + length
+    if tag == b'i':
+        return int(raw.decode('ascii')), pos
+    elif tag == b's':
+        return raw.decode('latin-1'), pos
+    return raw.decode('utf-8'), pos
+
+
+def _decode_bin(data):
+    count, = struct.unpack('<I', data[:4])
+    pos = 4
+    options = {}
+    for _ in range(count):
+        length, = struct.unpack('<I', data[pos:pos + 4])
+        path = data[pos + 4:pos + 4 + length].decode('utf-8')
+        options[path], pos = _decode_bin_value(data, pos + 4 + length)
+    return options, pos
+
+
+class EncodeTest(unittest.TestCase):
+    def test_bin(self):
+        options = {'/none': None, '/flag': True, '/int': -12,
+                   '/raw': 'a\x00\xff', '/text': u'é中',
+                   '/list': [1, 'x', False]}
+        data = generate.encode_bin({'options': options})
+        self.assertEqual(data[:4], struct.pack('<I', 6))
+        decoded, end = _decode_bin(data)
+        self.assertEqual(decoded, options)
+        self.assertEqual(end, len(data))
+        self.assertEqual(generate.encode_bin({'options': {}}),
+                         struct.pack('<I', 0))
+
+    def test_jsonl(self):
+        data = generate.encode_jsonl({'options': {'b': 1, 'a': [2]}})
+        self.assertEqual(data, b'{"options": {"a": [2], "b": 1}}\n')
+
+
+class GenerateAppTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.argv = sys.argv
+
+    def tearDown(self):
+        sys.argv = self.argv
+        shutil.rmtree(self.path)
+
+    def _run(self, *args):
+        output = os.path.join(self.path, 'items')
+        sys.argv = ['dice', PYRAMID_PATH, '--output', output] + list(args)
+        self.assertEqual(generate.GenerateApp().run(), 0)
+        with open(output, 'rb') as fp:
+            return fp.read()
+
+    def test_jsonl(self):
+        lines = self._run('--count', '300', '--jobs', '2').splitlines()
+        self.assertEqual(len(lines), 300)
+        for line in lines:
+            data = json.loads(line.decode('utf-8'))
+            self.assertEqual(data['provider'], 'pyramid')
+            self.assertEqual(list(data['options']), ['option'])
+
+    def test_bin(self):
+        data = self._run('--count', '20', '--format', 'bin')
+        pos = 0
+        for _ in range(20):
+            options, end = _decode_bin(data[pos:])
+            self.assertEqual(list(options), ['option'])
+            pos += end
+        self.assertEqual(pos, len(data))
+
+    def test_null(self):
+        self.assertEqual(self._run('--count', '10', '--format', 'null'), b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
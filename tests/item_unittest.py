@@ -0,0 +1,33 @@
+import unittest
+
+from dice.core import item
+
+
+class ArgvTest(unittest.TestCase):
+    def test_argv(self):
+        itm = item.ItemBase(provider=None)
+        itm.set('/name', 'a b')
+        itm.set('/force', True)
+        itm.set('/quiet', False)
+        itm.set('/tags', ['x', 'y'])
+        itm.set('/count', 3)
+        argv = itm.argv('prog', args=['/count', '/missing'],
+                        opts=[('--name', '/name'), ('--force', '/force'),
+                              ('--quiet', '/quiet'), ('--tag', '/tags')])
+        self.assertEqual(argv, ['prog', '--name', 'a b', '--force',
+                                '--tag', 'x', '--tag', 'y', '3'])
+
+
+class OptionsTest(unittest.TestCase):
+    def test_attributes(self):
+        itm = item.ItemBase(provider=None)
+        itm.set('option', 3)
+        self.assertEqual(itm.get('option'), 3)
+        self.assertEqual(itm.option, 3)
+        self.assertEqual(itm.options, {'option': 3})
+        self.assertRaises(AttributeError, getattr, itm, 'missing')
+        self.assertFalse(hasattr(itm, 'missing'))
+
+
+if __name__ == '__main__':
+    unittest.main()
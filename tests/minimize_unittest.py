@@ -0,0 +1,99 @@
+import threading
+import unittest
+
+from dice import utils
+from dice.client import categories
+from dice.client import minimize
+from dice.core import item
+
+
+class _Item(item.ItemBase):
+    runs = []
+    lock = threading.Lock()
+
+    def run(self):
+        with self.lock:
+            self.runs.append(dict(self.options))
+        self.res = utils.CmdResult('test')
+        text = self.get('text') or ''
+        number = self.get('number') or 0
+        if 'b' in text and number > 10:
+            self.res.exit_status = 'failure'
+            # Messages echo the input and vary between runs
+            self.res.stderr = "boom on '%s' at 0x%x\nexiting" % (
+                text, id(self))
+        else:
+            self.res.exit_status = 'success'
+
+
+class MinimizerTest(unittest.TestCase):
+    def setUp(self):
+        _Item.runs = []
+        self.item = _Item(None)
+        self.item.set('text', 'aaaaabaaaaaaaaaaaaaa')
+        self.item.set('number', 12345)
+        self.item.set('extra', ['x', 'y', 'z'])
+        self.item.set('flag', True)
+
+    def _check(self, jobs):
+        minimizer = minimize.Minimizer(self.item, jobs=jobs)
+        self.assertEqual(minimizer.target[0], 'failure')
+        result = minimizer.minimize()
+        self.assertEqual(result.options, {'text': 'b', 'number': 11})
+        self.assertEqual(categories.categorize(result)[0], 'failure')
+        # No candidate runs twice
+        runs = [repr(sorted(options.items())) for options in _Item.runs]
+        self.assertEqual(len(runs) - 2, len(set(runs[1:-1])))
+        self.assertEqual(minimizer.probes, len(runs) - 2)
+
+    def test_minimize(self):
+        self._check(jobs=1)
+
+    def test_parallel(self):
+        self._check(jobs=4)
+
+    def test_max_probes(self):
+        minimizer = minimize.Minimizer(self.item, max_probes=5)
+        result = minimizer.minimize()
+        self.assertEqual(minimizer.probes, 5)
+        self.assertEqual(categories.categorize(result)[0], 'failure')
+
+    def test_match(self):
+        minimizer = minimize.Minimizer(
+            self.item, match=lambda key: 'aaaaa' in key)
+        result = minimizer.minimize()
+        self.assertEqual(result.options['text'], 'aaaaab')
+
+    def test_inherit_settings(self):
+        self.item.timeout = 0.5
+        self.item.limits = {'cpu': 1}
+        minimizer = minimize.Minimizer(self.item)
+        cand = minimizer._clone({})
+        self.assertEqual((cand.timeout, cand.limits), (0.5, {'cpu': 1}))
+
+
+class CategorizeTest(unittest.TestCase):
+    def test_limit_status(self):
+        itm = _Item(None)
+        itm.res = utils.CmdResult('test')
+        itm.res.exit_status = 'oom'
+        itm.res.stderr = 'Cannot allocate memory'
+        self.assertEqual(categories.categorize(itm), ('oom', itm.res.stderr))
+        # Expected by the oracle
+        itm.fail_patts = set(['allocate'])
+        self.assertEqual(categories.categorize(itm),
+                         ('expected_neg', 'allocate'))
+        itm.fail_patts = set(['other'])
+        self.assertEqual(categories.categorize(itm)[0], 'oom')
+
+
+class SignatureTest(unittest.TestCase):
+    def test_signature(self):
+        self.assertEqual(
+            categories.signature('\nsegfault at 0x7ffd1 in "abc" pid 12\n'),
+            'segfault at ? in "?" pid ?')
+        self.assertEqual(categories.signature(''), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import sys
+import threading
+import time
+import unittest
+
+from dice.utils import persistent
+
+TARGET = r'''
+import sys, time
+for line in iter(sys.stdin.readline, ''):
+    line = line.rstrip('\n')
+    if line == 'crash':
+        sys.stderr.write('crashed\n')
+        sys.exit(3)
+    elif line == 'hang':
+        time.sleep(60)
+    elif line == 'late':
+        sys.stdout.write('0 late\n')
+        sys.stdout.flush()
+        sys.stderr.write('late\n')
+        sys.stderr.flush()
+        continue
+    elif line == 'garbage':
+        sys.stdout.write('garbage\n')
+    elif line.startswith('bad'):
+        sys.stdout.write('1 %s\n' % line)
+    else:
+        sys.stdout.write('0 %s\n' % line)
+    sys.stdout.flush()
+'''
+
+
+class PersistentProcessTest(unittest.TestCase):
+    def setUp(self):
+        self.process = persistent.PersistentProcess(
+            [sys.executable, '-c', TARGET])
+
+    def tearDown(self):
+        self.process.stop()
+
+    def test_requests(self):
+        for idx in range(20):
+            res = self.process.request(b'input%d' % idx)
+            self.assertEqual(res.exit_status, 'success')
+            self.assertEqual(res.stdout, 'input%d' % idx)
+        res = self.process.request(b'bad input')
+        self.assertEqual(res.exit_status, 'failure')
+        self.assertEqual(res.stderr, 'bad input')
+        self.assertEqual(self.process.starts, 1)
+
+    def test_restart(self):
+        res = self.process.request(b'crash')
+        self.assertEqual(res.exit_status, 'failure')
+        self.assertEqual(res.exit_code, 3)
+        self.assertIn('crashed', res.stderr)
+        res = self.process.request(b'hang', timeout=0.5)
+        self.assertEqual(res.exit_status, 'timeout')
+        res = self.process.request(b'ok')
+        self.assertEqual(res.exit_status, 'success')
+        self.assertEqual(self.process.starts, 3)
+
+    def test_invalid(self):
+        res = self.process.request(b'two\nlines')
+        self.assertEqual(res.exit_status, 'failure')
+        self.assertIn('newline', res.stderr)
+        self.assertEqual(self.process.starts, 0)
+
+        res = self.process.request(b'garbage')
+        self.assertEqual(res.exit_status, 'failure')
+        self.assertIn('Malformed response', res.stderr)
+        self.assertIsNone(self.process.process)
+        self.assertEqual(self.process.request(b'ok').stdout, 'ok')
+        self.assertEqual(self.process.starts, 2)
+
+    def test_late_stderr(self):
+        self.assertEqual(self.process.request(b'late').stdout, 'late')
+        time.sleep(0.2)
+        res = self.process.request(b'next')
+        self.assertEqual(res.stdout, 'next')
+        self.assertEqual(res.stderr, '')
+
+
+class ThreadProcessTest(unittest.TestCase):
+    def tearDown(self):
+        persistent.stop_all()
+
+    def test_stop_thread(self):
+        processes = []
+
+        def _worker():
+            process = persistent.get_process(
+                'target', [sys.executable, '-c', TARGET])
+            process.request(b'input')
+            processes.append(process)
+            persistent.stop_thread()
+
+        thread = threading.Thread(target=_worker)
+        thread.start()
+        thread.join()
+        self.assertIsNone(processes[0].process)
+        self.assertNotIn(processes[0], persistent._PROCESSES)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import itertools
+import threading
+import time
+import unittest
+
+from dice.client import prefetch
+
+
+class PrefetcherTest(unittest.TestCase):
+    def test_order(self):
+        counter = itertools.count()
+        prefetcher = prefetch.Prefetcher(lambda: next(counter), size=4)
+        prefetcher.start()
+        try:
+            items = [prefetcher.get(timeout=5) for _ in range(20)]
+        finally:
+            prefetcher.stop()
+        self.assertEqual(items, list(range(20)))
+        self.assertEqual(prefetcher.consumed, 20)
+        self.assertGreaterEqual(prefetcher.generated, 20)
+
+    def test_error(self):
+        generated = []
+        ready = threading.Event()
+
+        def generate():
+            if len(generated) == 3:
+                ready.set()
+                raise ValueError('broken provider')
+            generated.append(len(generated))
+            return generated[-1]
+
+        prefetcher = prefetch.Prefetcher(generate, size=8)
+        prefetcher.start()
+        self.assertTrue(ready.wait(5))
+        prefetcher.thread.join(5)
+        # Raised even though generated items are still queued
+        self.assertEqual(prefetcher.queue.qsize(), 3)
+        self.assertRaises(ValueError, prefetcher.get)
+        prefetcher.stop()
+
+    def test_stop_full(self):
+        prefetcher = prefetch.Prefetcher(lambda: 1, size=2)
+        prefetcher.start()
+        while not prefetcher.queue.full():
+            time.sleep(0.01)
+        start = time.time()
+        prefetcher.stop()
+        self.assertFalse(prefetcher.thread.is_alive())
+        self.assertLess(time.time() - start, 1)
+        self.assertIsNone(prefetcher.exc_info)
+
+
+if __name__ == '__main__':
+    unittest.main()
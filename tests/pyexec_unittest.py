@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+import unittest
+
+from dice.core import item
+from dice.utils import pyexec
+
+
+def _echo(text, repeat=1):
+    print(text * repeat)
+    return len(text) * repeat
+
+
+def _raise(text):
+    raise ValueError(text)
+
+
+def _crash():
+    os._exit(5)
+
+
+def _hang():
+    time.sleep(60)
+
+
+class WorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = pyexec.WorkerPool(size=1, max_tasks=2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_success(self):
+        res = self.pool.call(_echo, ('ab',), {'repeat': 2})
+        self.assertEqual(res.exit_status, 'success')
+        self.assertEqual(res.stdout, 'abab\n')
+        self.assertEqual(res.value, 4)
+        self.assertEqual(res.cmdline, "_echo('ab', repeat=2)")
+
+    def test_exception(self):
+        res = self.pool.call(_raise, ('boom',))
+        self.assertEqual(res.exit_status, 'failure')
+        self.assertIn('ValueError: boom', res.stderr)
+
+    def test_unpicklable(self):
+        res = self.pool.call(lambda: None)
+        self.assertEqual(res.exit_status, 'failure')
+        self.assertIn('Failed to send', res.stderr)
+        res = self.pool.call(_echo, (threading.Lock(),))
+        self.assertEqual(res.exit_status, 'failure')
+        self.assertEqual(self.pool.call(_echo, ('a',)).exit_status,
+                         'success')
+
+    def test_crash(self):
+        res = self.pool.call(_crash)
+        self.assertEqual(res.exit_status, 'failure')
+        self.assertEqual(res.exit_code, 5)
+        self.assertEqual(self.pool.call(_echo, ('a',)).exit_status,
+                         'success')
+
+    def test_timeout(self):
+        res = self.pool.call(_hang, timeout=0.2)
+        self.assertEqual(res.exit_status, 'timeout')
+        self.assertEqual(self.pool.call(_echo, ('a',)).exit_status,
+                         'success')
+
+    def test_recycle(self):
+        pids = set()
+        for _ in range(4):
+            self.assertEqual(self.pool.call(os.getpid).exit_status,
+                             'success')
+            pids.add(self.pool.call(os.getpid).value)
+        self.assertEqual(len(pids), 4)
+
+
+class _PythonItem(item.PythonItemBase):
+    def target(self):
+        return _echo, [self.get('text')], {}
+
+
+class PythonItemTest(unittest.TestCase):
+    def tearDown(self):
+        pyexec.stop()
+
+    def test_run(self):
+        itm = _PythonItem(None)
+        itm.set('text', 'ab')
+        itm.run()
+        self.assertEqual(itm.res.exit_status, 'success')
+        self.assertEqual(itm.res.value, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+from dice.client import resources
+from dice.utils import procstat
+
+
+def _rusage(**kwargs):
+    rusage = dict.fromkeys(procstat.RUSAGE_FIELDS, 0)
+    rusage.update(kwargs)
+    return rusage
+
+
+class ResourceSummaryTest(unittest.TestCase):
+    def test_add(self):
+        summary = resources.ResourceSummary()
+        summary.add(_rusage(utime=1.0, maxrss=100))
+        summary.add(_rusage(utime=3.0, maxrss=300))
+        self.assertEqual(summary.count, 2)
+        self.assertEqual(summary.total['utime'], 4.0)
+        self.assertEqual(summary.peak['maxrss'], 300)
+        self.assertIn('maxrss', str(summary))
+
+
+class OutlierDetectorTest(unittest.TestCase):
+    def test_check(self):
+        detector = resources.OutlierDetector(threshold=3.0, min_samples=10)
+        for idx in range(20):
+            outliers = detector.check(
+                'dummy', _rusage(utime=0.01 * (idx % 2), maxrss=1000))
+            self.assertEqual(outliers, [])
+        outliers = detector.check('dummy', _rusage(utime=0.01, maxrss=50000))
+        self.assertEqual(outliers, ['maxrss'])
+        outliers = detector.check('other', _rusage(maxrss=50000))
+        self.assertEqual(outliers, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
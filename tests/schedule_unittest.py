@@ -0,0 +1,66 @@
+import unittest
+
+from dice import utils
+from dice.client import schedule
+
+
+class _Provider(object):
+    def __init__(self, name, call_time):
+        self.name = name
+        self.call_time = call_time
+
+
+class _Item(object):
+    def __init__(self, provider):
+        self.provider = provider
+        self.res = utils.CmdResult('dummy')
+        self.res.call_time = provider.call_time
+
+
+class ProviderSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.providers = [_Provider('fast', 0.005), _Provider('slow', 5.0)]
+
+    def _run(self, scheduler, count, new_key=lambda prvdr: False):
+        items = dict((prvdr.name, 0) for prvdr in self.providers)
+        times = dict((prvdr.name, 0.0) for prvdr in self.providers)
+        for _ in range(count):
+            prvdr = scheduler.choose()
+            scheduler.record(_Item(prvdr), new_key=new_key(prvdr))
+            items[prvdr.name] += 1
+            times[prvdr.name] += prvdr.call_time
+        return items, times
+
+    def test_items(self):
+        scheduler = schedule.ProviderScheduler(
+            self.providers, weights={'slow': 3})
+        items, _ = self._run(scheduler, 400)
+        self.assertEqual(items, {'fast': 100, 'slow': 300})
+
+    def test_time(self):
+        scheduler = schedule.ProviderScheduler(self.providers, mode='time')
+        _, times = self._run(scheduler, 10000)
+        self.assertAlmostEqual(times['fast'] / times['slow'], 1.0, delta=0.1)
+
+    def test_yield(self):
+        scheduler = schedule.ProviderScheduler(
+            [_Provider('a', 0.01), _Provider('b', 0.01)], mode='yield')
+        self.providers = list(scheduler.shares[name].provider
+                              for name in scheduler.shares)
+        items, _ = self._run(scheduler, 1000,
+                             new_key=lambda prvdr: prvdr.name == 'a')
+        self.assertGreater(items['a'], 5 * items['b'])
+
+    def test_weights(self):
+        self.assertEqual(
+            schedule.ProviderScheduler.parse_weights('a=1, b=2.5'),
+            {'a': 1.0, 'b': 2.5})
+        self.assertRaises(schedule.ScheduleError,
+                          schedule.ProviderScheduler.parse_weights, 'a')
+        self.assertRaises(schedule.ScheduleError,
+                          schedule.ProviderScheduler, self.providers,
+                          weights={'missing': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+from dice.core import selector
+
+
+class SelectorTest(unittest.TestCase):
+    def _train(self, slctr, rates, rounds=50, batch=20):
+        arms = sorted(rates)
+        chosen = []
+        for _ in range(rounds):
+            chosen = slctr.choose_many(arms, batch)
+            for arm in chosen:
+                slctr.reward(arm, rates[arm])
+        return chosen
+
+    def test_ucb(self):
+        chosen = self._train(selector.UCBSelector(),
+                             {'a': 0.0, 'b': 1.0, 'c': 0.0})
+        self.assertGreater(chosen.count('b'), 10)
+
+    def test_thompson(self):
+        chosen = self._train(selector.ThompsonSelector(),
+                             {'a': 0.0, 'b': 1.0, 'c': 0.0})
+        self.assertGreater(chosen.count('b'), 15)
+
+    def test_ucb_batch_spread(self):
+        chosen = selector.UCBSelector().choose_many(['a', 'b', 'c'], 3)
+        self.assertEqual(sorted(chosen), ['a', 'b', 'c'])
+
+    def test_create(self):
+        self.assertIsInstance(selector.create('uniform'),
+                              selector.UniformSelector)
+        self.assertRaises(selector.SelectorError, selector.create, 'unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
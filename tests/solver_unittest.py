@@ -0,0 +1,119 @@
+import unittest
+
+from dice.core import constraint
+from dice.core import item
+from dice.core import solver
+from dice.core import symbol
+from dice.core import trace
+
+
+RANGE_ORACLE = """
+if /range/min > /range/max:
+    return fail('Min greater than max')
+else:
+    if /range/min < 0:
+        return fail('Negative min')
+    else:
+        if /range/max > 100:
+            return fail('Max too big')
+        else:
+            return success()
+"""
+
+
+class _Provider(object):
+    name = 'solvertest'
+    symbols = dict(symbol.SYMBOLS, IPv4=symbol.String)
+
+
+class SolverTest(unittest.TestCase):
+    def test_propagate(self):
+        symbols = {'a': symbol.Integer(), 'b': symbol.Integer(),
+                   'c': symbol.Integer()}
+        symbols['a'].narrow(minimum=0)
+        symbols['c'].narrow(maximum=10)
+        relations = [('a', 'Lt', 'b'), ('b', 'LtE', 'c')]
+        solver.propagate(symbols, relations)
+        self.assertEqual(symbols['b'].minimum, 1)
+        self.assertEqual(symbols['b'].maximum, 10)
+        self.assertEqual(symbols['a'].maximum, 9)
+        self.assertEqual(symbols['c'].minimum, 1)
+
+        for _ in range(200):
+            values = solver.solve(symbols, relations)
+            self.assertTrue(0 <= values['a'] < values['b'] <= values['c'] <=
+                            10)
+
+    def test_empty(self):
+        symbols = {'a': symbol.Integer(), 'b': symbol.Integer()}
+        symbols['a'].narrow(minimum=5)
+        symbols['b'].narrow(maximum=5)
+        self.assertRaises(solver.NoSolutionError, solver.propagate,
+                          symbols, [('a', 'Lt', 'b')])
+
+    def test_cycle(self):
+        symbols = {'a': symbol.Integer(), 'b': symbol.Integer()}
+        self.assertRaises(solver.NoSolutionError, solver.propagate,
+                          symbols, [('a', 'Lt', 'b'), ('b', 'LtE', 'a')])
+        solver.propagate(symbols, [('a', 'LtE', 'b'), ('b', 'LtE', 'a')])
+
+    def test_in(self):
+        symbols = {'a': symbol.String(), 'b': symbol.StringList(),
+                   'c': symbol.String(scope=['x', 'y'])}
+        relations = [('a', 'In', 'b'), ('c', 'NotIn', 'b')]
+        for _ in range(50):
+            values = solver.solve(symbols, relations)
+            self.assertIn(values['a'], values['b'])
+            self.assertNotIn(values['c'], values['b'])
+
+    def test_normalize(self):
+        self.assertEqual(solver.normalize('a', 'Gt', 'b'), ('b', 'Lt', 'a'))
+        self.assertRaises(solver.SolverError, solver.normalize,
+                          'a', 'Is', 'b')
+
+
+class RelationalOracleTest(unittest.TestCase):
+    def test_apply(self):
+        cstr = constraint.Constraint('range', None, oracle=RANGE_ORACLE)
+        self.assertEqual(len(cstr.traces), 4)
+        results = set()
+        for _ in range(300):
+            itm = item.ItemBase(None)
+            result = cstr.apply(itm)
+            low, high = itm.get('/range/min'), itm.get('/range/max')
+            if result == 'success':
+                self.assertTrue(0 <= low <= high <= 100)
+            elif itm.fail_patts == {'Min greater than max'}:
+                self.assertGreater(low, high)
+            elif itm.fail_patts == {'Negative min'}:
+                self.assertTrue(low < 0 and low <= high)
+            else:
+                self.assertTrue(0 <= low <= high and high > 100)
+            results.add(result)
+        self.assertEqual(results, {'success', 'fail'})
+
+    def test_apply_many(self):
+        cstr = constraint.Constraint('range', None, oracle=RANGE_ORACLE)
+        items = [item.ItemBase(None) for _ in range(200)]
+        for itm, result in zip(items, cstr.apply_many(items)):
+            if result == 'success':
+                self.assertTrue(0 <= itm.get('/range/min') <=
+                                itm.get('/range/max') <= 100)
+
+    def test_symbol_names(self):
+        # Only option names are relations, whatever the case of a class
+        cstr = constraint.Constraint('addr', _Provider(),
+                                     oracle='/addr is IPv4')
+        itm = item.ItemBase(None)
+        self.assertEqual(cstr.apply(itm), 'success')
+        self.assertIsInstance(itm.get('/addr'), str)
+
+        def _apply():
+            cstr = constraint.Constraint('x', None, oracle='/x is integer')
+            cstr.apply(item.ItemBase(None))
+        self.assertRaisesRegex(trace.TraceError, "Unknown symbol 'integer'",
+                               _apply)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+
+from dice import utils
+from dice.client import timeouts
+
+
+class _Provider(object):
+    name = 'dummy'
+
+
+class _Item(object):
+    timeout = 10
+
+    def __init__(self, call_time, exit_status='success', traces=()):
+        self.provider = _Provider()
+        self.traces = list(traces)
+        self.res = utils.CmdResult('dummy')
+        self.res.call_time = call_time
+        self.res.exit_status = exit_status
+
+
+class LatencyHistogramTest(unittest.TestCase):
+    def test_percentile(self):
+        hist = timeouts.LatencyHistogram()
+        self.assertIsNone(hist.percentile(99))
+        for idx in range(1000):
+            hist.add((idx + 1) / 1000.0)
+        self.assertAlmostEqual(hist.percentile(50), 0.5, delta=0.05)
+        self.assertAlmostEqual(hist.percentile(99.9), 1.0, delta=0.1)
+
+
+class TimeoutEstimatorTest(unittest.TestCase):
+    def test_adapt(self):
+        est = timeouts.TimeoutEstimator(multiplier=2.0, floor=0.01,
+                                        min_samples=10)
+        item = _Item(0.02)
+        self.assertEqual(est.timeout_for(item), 10.0)
+        for _ in range(10):
+            est.observe(_Item(0.02))
+        timeout = est.timeout_for(item)
+        self.assertAlmostEqual(timeout, 0.04, delta=0.005)
+
+        item = _Item(timeout, exit_status='timeout')
+        item.timeout = timeout
+        est.observe(item)
+        metrics = est.metrics()
+        self.assertEqual(metrics['timeout_hits'], 1)
+        self.assertAlmostEqual(metrics['timeout_saved_time'], 10 - timeout,
+                               places=2)
+
+    def test_latency_shift(self):
+        est = timeouts.TimeoutEstimator(multiplier=2.0, floor=0.01,
+                                        min_samples=10, window=10)
+        for _ in range(20):
+            est.observe(_Item(0.02))
+        learned = est.timeout_for(_Item(0))
+        self.assertLess(learned, 0.1)
+
+        # Calls now take longer than the learned timeout
+        for _ in range(100):
+            timeout = est.timeout_for(_Item(0))
+            if timeout < 0.5:
+                item = _Item(timeout, exit_status='timeout')
+                item.timeout = timeout
+            else:
+                item = _Item(0.5)
+            est.observe(item)
+        self.assertGreaterEqual(est.timeout_for(_Item(0)), 0.5)
+        self.assertLess(est.timeout_for(_Item(0)), 10.0)
+
+    def test_per_trace(self):
+        est = timeouts.TimeoutEstimator(multiplier=1.0, floor=0.0,
+                                        per_trace=True, min_samples=10)
+        for _ in range(10):
+            est.observe(_Item(0.01, traces=['a:0']))
+            est.observe(_Item(1.0, traces=['a:1']))
+        fast = est.timeout_for(_Item(0, traces=['a:0']))
+        slow = est.timeout_for(_Item(0, traces=['a:1']))
+        self.assertLess(fast, 0.02)
+        self.assertGreater(slow, 0.9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,182 @@
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
 
+from dice import utils
+from dice.utils import forkserver
+from dice.utils import payload
+from dice.utils import procstat
+
 
 class TestBase(unittest.TestCase):
     def test_cmd(self):
         pass
 
 
+class RunTest(unittest.TestCase):
+    def test_run(self):
+        res = utils.run('echo out; echo err >&2; exit 3')
+        self.assertEqual(res.stdout, 'out\n')
+        self.assertEqual(res.stderr, 'err\n')
+        self.assertEqual(res.exit_code, 3)
+        self.assertEqual(res.exit_status, 'failure')
+
+    def test_argv(self):
+        res = utils.run(['echo', 'a b;c', '$HOME'])
+        self.assertEqual(res.stdout, 'a b;c $HOME\n')
+        self.assertEqual(res.exit_status, 'success')
+
+    def test_stdin(self):
+        data = 'x' * 1000000
+        res = utils.run(['wc', '-c'], stdin=data)
+        self.assertEqual(res.stdout.strip(), '1000000')
+
+    def test_payloads(self):
+        data = ''.join(chr(c) for c in range(1, 256)) * 1000
+        for mode in ('stdin', 'file', 'fd'):
+            pld = payload.Payload(data, mode=mode)
+            if mode == 'fd':
+                argv = ['sh', '-c', 'wc -c <&$0', pld]
+            else:
+                argv = ['wc', '-c', pld]
+            res = utils.run(argv)
+            self.assertEqual(res.stdout.split()[0], '255000', res.stderr)
+
+    def test_rusage(self):
+        res = utils.run(['sh', '-c', 'i=0; while [ $i -lt 20000 ]; do '
+                         'i=$((i+1)); done'])
+        self.assertEqual(res.exit_status, 'success')
+        self.assertEqual(set(res.rusage), set(procstat.RUSAGE_FIELDS))
+        self.assertGreater(res.rusage['utime'] + res.rusage['stime'], 0)
+        self.assertGreater(res.rusage['maxrss'], 0)
+
+        res = utils.run('sleep 10', timeout=0.2)
+        self.assertIsNotNone(res.rusage)
+
+    def test_limits(self):
+        self.addCleanup(forkserver.stop)
+        res = utils.run(['sh', '-c', 'while :; do :; done'], timeout=10,
+                        limits={'cpu': 1, 'core': 0})
+        self.assertEqual(res.exit_status, 'cpu_limit')
+
+        # The shell exits with 128 plus the signal killing its child
+        with tempfile.NamedTemporaryFile() as fp:
+            res = utils.run('head -c 2000000 /dev/zero > %s; exit $?' %
+                            fp.name, limits={'fsize': 1000000})
+        self.assertEqual(res.exit_code, 128 + signal.SIGXFSZ)
+        self.assertEqual(res.exit_status, 'fsize_limit')
+
+        # Descriptors are passed along to the fork server, which applies
+        # the limits before executing the command
+        rfd, wfd = os.pipe()
+        self.addCleanup(os.close, rfd)
+        self.addCleanup(os.close, wfd)
+        res = utils.run('ulimit -t; echo passed >&%d' % wfd,
+                        pass_fds=[wfd], limits={'cpu': 1})
+        self.assertEqual(res.exit_status, 'success', res.stderr)
+        self.assertEqual(res.stdout, '1\n')
+        self.assertEqual(os.read(rfd, 100), b'passed\n')
+
+        with tempfile.NamedTemporaryFile() as fp:
+            res = utils.run('exec head -c 2000000 /dev/zero > %s' % fp.name,
+                            limits={'fsize': 1000000})
+        self.assertEqual(res.exit_status, 'fsize_limit')
+
+        res = utils.run([sys.executable, '-c',
+                         'x = []\nwhile True: x.append(b"x" * (1 << 24))'],
+                        limits={'as': 512 * 1024 * 1024})
+        self.assertEqual(res.exit_status, 'oom')
+
+        # Allocation errors printed without using memory are no limit hit
+        res = utils.run([sys.executable, '-c',
+                         'import sys; sys.exit("Cannot allocate memory")'],
+                        limits={'as': 512 * 1024 * 1024})
+        self.assertEqual(res.exit_status, 'failure')
+
+        res = utils.run(['true'], limits={'as': 512 * 1024 * 1024})
+        self.assertEqual(res.exit_status, 'success')
+
+    def test_timeout(self):
+        res = utils.run('sleep 10', timeout=0.2)
+        self.assertEqual(res.exit_status, 'timeout')
+        self.assertLess(res.call_time, 5)
+
+    @unittest.skipUnless(procstat.StallDetector.supported(),
+                         'requires /proc')
+    def test_stall(self):
+        res = utils.run(['sleep', '10'], stall_window=0.3)
+        self.assertEqual(res.exit_status, 'stalled')
+        self.assertLess(res.call_time, 5)
+
+        res = utils.run(['sh', '-c', 'while :; do :; done'], timeout=1,
+                        stall_window=0.3)
+        self.assertEqual(res.exit_status, 'timeout')
+
+
+@unittest.skipUnless(procstat.StallDetector.supported(), 'requires /proc')
+class TreeStatsTest(unittest.TestCase):
+    def test_tree(self):
+        process = subprocess.Popen(['sh', '-c', 'sleep 10 & sleep 10 & wait'],
+                                   start_new_session=True)
+        self.addCleanup(process.wait)
+        self.addCleanup(os.killpg, process.pid, signal.SIGKILL)
+        for _ in range(50):
+            states = [stat[0] for stat in procstat.tree_stats(process.pid)]
+            if states == ['S'] * 3:
+                break
+            time.sleep(0.05)
+        self.assertEqual(states, ['S'] * 3)
+        self.assertEqual(procstat.tree_stats(os.getpid())[0][1],
+                         os.getpgrp())
+
+        self.assertEqual(procstat.tree_stats(2 ** 22 + 1), [])
+
+
+class EscapeTest(unittest.TestCase):
+    def test_escape(self):
+        text = 'a b;c$d`e\\f'
+        res = utils.run('printf %%s %s' % utils.escape(text))
+        self.assertEqual(res.stdout, text)
+
+
+class ForkServerRunTest(RunTest):
+    def setUp(self):
+        forkserver.start()
+
+    def tearDown(self):
+        forkserver.stop()
+
+    def test_server_argv(self):
+        response = forkserver.get_server().run(['echo', 'a b;c'])
+        self.assertEqual(response['stdout'], b'a b;c\n')
+        self.assertEqual(response['exit_code'], 0)
+
+    def test_server_fds(self):
+        pipes = [os.pipe() for _ in range(3)]
+        for rfd, wfd in pipes:
+            self.addCleanup(os.close, rfd)
+            self.addCleanup(os.close, wfd)
+        wfds = [wfd for _, wfd in pipes]
+        script = ('import os, sys\n'
+                  'for idx, fd in enumerate(sys.argv[1:]):\n'
+                  '    os.write(int(fd), b"%d\\n" % idx)\n')
+        response = forkserver.get_server().run(
+            [sys.executable, '-c', script] + [str(fd) for fd in wfds],
+            pass_fds=wfds)
+        self.assertEqual(response['exit_code'], 0, response['stderr'])
+        for idx, (rfd, _) in enumerate(pipes):
+            self.assertEqual(os.read(rfd, 100), b'%d\n' % idx)
+
+        # A closed descriptor fails the command only
+        response = forkserver.get_server().run(['true'], pass_fds=[1000])
+        self.assertEqual(response['exit_code'], 127)
+        response = forkserver.get_server().run(['true'])
+        self.assertEqual(response['exit_code'], 0)
+
+
 if __name__ == '__main__':
     unittest.main()